@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Intermediate representation of the instantiation of a row of the ontology_instanciation sheet.
+
+owl_filler.parse_article turns a row into an ArticleIR: the list of the operations to do on
+the ontology (individuals created, properties set or appended...), in the order of the
+original code. It does not touch the ontology, so that it can run in another process.
+apply_article, the single writer of the ontology, then applies the operations in order.
+
+The individuals are referred to by Entity(class name, IRI), and the results of the lookups
+which depend on the individuals created by the previous rows (LULC classes by name, algorithms
+or study cases of the process by label, classes of the nomenclatures of the process) by Var.
+These lookups are resolved by apply_article, when it reaches them. Once the algorithms, study
+cases and inputs of the process are created, they are indexed by label (ArticleIR.index_process),
+so that the lookups of the metrics of the row do not read the ontology again.
+
+The values of the properties are not written one by one through owlready2, but collected
+in a TripleBatch (see bulk_loader.py), flushed before each lookup and at the end.
+"""
+import logging
+import urllib.parse
+from collections import namedtuple
+
+from ontology_index import lulc_class_index, individual_index
+from incremental import content_hash
+from bulk_loader import TripleBatch
+
+logger = logging.getLogger("article_ir")
+
+#Individual onto[class_name](iri)
+Entity = namedtuple("Entity", ["class_name", "iri"])
+#Result of a lookup done by apply_article
+Var = namedtuple("Var", ["number"])
+#Class onto[name], e.g. appended to the is_a of an individual
+OntoClass = namedtuple("OntoClass", ["name"])
+
+
+class StopBlock(Exception):
+    """Stops the operations of the current block (see ArticleIR.block)."""
+
+
+class ArticleIR:
+    """
+    Operations instantiating a row, built by parse_article.
+    article and process are the Entities of the paper and of its process.
+    unknown_places are the texts the parsing needed to know if they are place names, without geocoding them.
+    """
+    def __init__(self):
+        self.ops = []
+        self.article = None
+        self.process = None
+        self.vars = 0
+        self.unknown_places = set()
+
+    def var(self):
+        self.vars += 1
+        return Var(self.vars)
+
+    def create(self, class_name, iri):
+        """Creates (or gets) the individual onto[class_name](iri), and returns its Entity."""
+        entity = Entity(class_name, iri)
+        self.ops.append(("create", entity))
+        return entity
+
+    def set(self, entity, name, value):
+        self.ops.append(("set", entity, name, value))
+
+    def append(self, entity, name, value):
+        self.ops.append(("append", entity, name, value))
+
+    def extend(self, entity, name, values):
+        self.ops.append(("extend", entity, name, tuple(values)))
+
+    def iadd(self, entity, name, values):
+        """entity.name += values, as written in the original code."""
+        self.ops.append(("iadd", entity, name, values))
+
+    def is_a(self, entity, class_name):
+        self.append(entity, "is_a", OntoClass(class_name))
+
+    def lulc_class(self, class_name, name):
+        """Creates (or gets) the LULC class name of type class_name, indexed by name."""
+        var = self.var()
+        self.ops.append(("lulc_class", var, class_name, name))
+        return var
+
+    def find_lulc_class(self, name, create_as=None):
+        """LULC class indexed by name, or None. If it is not found and create_as is given, it is created with this type."""
+        var = self.var()
+        self.ops.append(("find_lulc_class", var, name, create_as))
+        return var
+
+    def find(self, entity, name, label, contains=False):
+        """First individual of the property name of entity whose lowercase label is label (or contains it), or None."""
+        var = self.var()
+        self.ops.append(("find", var, entity, name, label, contains))
+        return var
+
+    def item(self, entity, name, index):
+        """Individual index of the property name of entity (IndexError if there are not enough)."""
+        var = self.var()
+        self.ops.append(("item", var, entity, name, index))
+        return var
+
+    def process_class(self, process, index, count, metric):
+        """
+        LULC class of a value of a per class metric without class name: the only class of
+        the nomenclatures of the process, or the class index if there are count classes.
+        Otherwise the current block is stopped.
+        """
+        var = self.var()
+        self.ops.append(("process_class", var, process, index, count, metric))
+        return var
+
+    def index_process(self, process):
+        """
+        Indexes the algorithms, study cases and inputs of the process by lowercase label, for the
+        next lookups of the row (find, item, append_matches, if_single). They must not be modified after.
+        """
+        self.ops.append(("index_process", process))
+
+    def append_found(self, entity, name, var):
+        """Appends the individual found by a lookup, if any."""
+        self.ops.append(("append_found", entity, name, var))
+
+    def append_matches(self, entity, name, source, source_name, label):
+        """Appends the individuals of the property source_name of source whose lowercase label is label."""
+        self.ops.append(("append_matches", entity, name, source, source_name, label))
+
+    def computed_assessments(self, process, metric, metric_type, doi):
+        """Creates an assessment of type metric_type of each LULC class of the nomenclatures of the process."""
+        self.ops.append(("computed_assessments", process, metric, metric_type, doi))
+
+    def log(self, level, message):
+        """Message logged when the operations are applied (e.g. in a branch)."""
+        self.ops.append(("log", level, message))
+
+    def fail(self, error):
+        """The parsing stopped on error: apply_article raises it when it reaches this point."""
+        self.ops.append(("raise", error))
+
+    def if_single(self, entity, name):
+        """
+        Operations done if the property name of entity has exactly one value, and the ones done otherwise:
+        with ir.if_single(entity, name) as branch: branch.then(), operations, branch.otherwise(), operations.
+        """
+        return Branch(self, ("if_single", entity, name))
+
+    def block(self):
+        """
+        Operations that process_class can stop: with ir.block(): ...
+        An error in the block is raised by apply_article only if the block is not stopped before.
+        """
+        return Block(self)
+
+
+class Branch:
+    def __init__(self, ir, condition):
+        self.ir = ir
+        self.condition = condition
+
+    def __enter__(self):
+        self.outer_ops = self.ir.ops
+        self.then_ops = []
+        self.else_ops = []
+        return self
+
+    def then(self):
+        self.ir.ops = self.then_ops
+
+    def otherwise(self):
+        self.ir.ops = self.else_ops
+
+    def __exit__(self, exc_type, error, traceback):
+        if error is not None:
+            self.ir.fail(error)
+        self.ir.ops = self.outer_ops
+        self.ir.ops.append(("branch", self.condition, self.then_ops, self.else_ops))
+        return True
+
+
+class Block:
+    def __init__(self, ir):
+        self.ir = ir
+
+    def __enter__(self):
+        self.outer_ops = self.ir.ops
+        self.ir.ops = []
+
+    def __exit__(self, exc_type, error, traceback):
+        if error is not None:
+            self.ir.fail(error)
+        block_ops = self.ir.ops
+        self.ir.ops = self.outer_ops
+        self.ir.ops.append(("block", block_ops))
+        return True
+
+
+def process_lulc_classes(process):
+    """LULC classes of the nomenclatures of the inputs of the process."""
+    all_classes = [nomenclature.hasLULCClass for nomenclature in list(set([nomenclature for input_instance in process.hasInput for nomenclature in input_instance.hasNomenclature]))]
+    return [class_i for class_group in all_classes for class_i in class_group]
+
+
+class PropertyIndex:
+    """Values of a property of an individual, and the lowercase label of each one."""
+    def __init__(self, values):
+        self.values = list(values)
+        self.labels = [value.label[0].lower() for value in self.values]
+        self.by_label = {}
+        for label, value in zip(self.labels, self.values):
+            self.by_label.setdefault(label, []).append(value)
+
+
+class Writer:
+    """
+    Applies the operations of ArticleIRs to an ontology, the values of the properties being
+    inserted in bulk by batch. The lookups read the ontology after flushing the batch, or
+    the PropertyIndex built by index_process.
+    """
+    #Properties of the process indexed by index_process
+    INDEXED_PROPERTIES = ("hasAlgorithm", "hasStudyCase", "hasInput")
+
+    def __init__(self, onto, batch=None):
+        self.onto = onto
+        self.batch = batch if batch is not None else TripleBatch(onto.world)
+        self.values = {}
+        #(Entity, property name): PropertyIndex
+        self.indexes = {}
+
+    def read(self, value):
+        """Resolves value to read its properties."""
+        self.batch.flush()
+        return self.resolve(value)
+
+    def resolve(self, value):
+        if isinstance(value, (Entity, Var)):
+            return self.values[value]
+        if isinstance(value, OntoClass):
+            return self.onto[value.name]
+        return value
+
+    def run(self, ops):
+        for op in ops:
+            getattr(self, "op_" + op[0])(*op[1:])
+
+    def op_create(self, entity):
+        self.values[entity] = individual_index(self.onto).get(entity.class_name, entity.iri)
+
+    def op_set(self, entity, name, value):
+        entity, value = self.resolve(entity), self.resolve(value)
+        if not self.batch.set(entity, name, value):
+            self.batch.flush()
+            self.batch.forget(entity, name)
+            setattr(entity, name, value)
+
+    def op_append(self, entity, name, value):
+        entity, value = self.resolve(entity), self.resolve(value)
+        if name == "is_a" or not self.batch.append(entity, name, value):
+            self.batch.flush()
+            getattr(entity, name).append(value)
+
+    def op_extend(self, entity, name, values):
+        entity, values = self.resolve(entity), [self.resolve(value) for value in values]
+        if not self.batch.extend(entity, name, values):
+            self.batch.flush()
+            getattr(entity, name).extend(values)
+
+    def op_iadd(self, entity, name, values):
+        entity = self.read(entity)
+        self.batch.forget(entity, name)
+        value = getattr(entity, name)
+        value += values
+        setattr(entity, name, value)
+
+    def op_lulc_class(self, var, class_name, name):
+        self.values[var] = lulc_class_index(self.onto).create(self.onto[class_name], name)
+
+    def op_find_lulc_class(self, var, name, create_as):
+        lulc_class = lulc_class_index(self.onto).get(name)
+        if not lulc_class and create_as is not None:
+            logger.warning(f"LULC class {name} not found")
+            lulc_class = lulc_class_index(self.onto).create(self.onto[create_as], name)
+            self.op_set(lulc_class, "label", name)
+        self.values[var] = lulc_class
+
+    def op_index_process(self, process):
+        individual = self.read(process)
+        for name in self.INDEXED_PROPERTIES:
+            values = getattr(individual, name)
+            #As in op_find, an individual without label cannot be looked up by label
+            if all(value.label for value in values):
+                self.indexes[(process, name)] = PropertyIndex(values)
+
+    def op_find(self, var, entity, name, label, contains):
+        index = self.indexes.get((entity, name))
+        if index is not None:
+            if contains:
+                self.values[var] = next((value for value_label, value in zip(index.labels, index.values) if label in value_label), None)
+            else:
+                self.values[var] = index.by_label.get(label, [None])[0]
+        elif contains:
+            self.values[var] = next((x for x in getattr(self.read(entity), name) if label in x.label[0].lower()), None)
+        else:
+            self.values[var] = next((x for x in getattr(self.read(entity), name) if x.label[0].lower() == label), None)
+
+    def op_item(self, var, entity, name, index):
+        if (entity, name) in self.indexes:
+            self.values[var] = self.indexes[(entity, name)].values[index]
+        else:
+            self.values[var] = getattr(self.read(entity), name)[index]
+
+    def op_process_class(self, var, process, index, count, metric):
+        all_classes_flat = process_lulc_classes(self.read(process))
+        if len(all_classes_flat) == 1:
+            self.values[var] = all_classes_flat[0]
+        elif len(all_classes_flat) == count:
+            self.values[var] = all_classes_flat[index]
+        else:
+            logger.warning(f"class name not provided for {metric} and cannot be infered")
+            raise StopBlock()
+
+    def op_append_found(self, entity, name, var):
+        found = self.resolve(var)
+        if found is not None:
+            self.op_append(entity, name, found)
+
+    def op_append_matches(self, entity, name, source, source_name, label):
+        if (source, source_name) in self.indexes:
+            for x in self.indexes[(source, source_name)].by_label.get(label, ()):
+                self.op_append(entity, name, x)
+            return
+        for x in getattr(self.read(source), source_name):
+            if x.label[0].lower() == label:
+                self.op_append(entity, name, x)
+
+    def op_computed_assessments(self, process, metric, metric_type, doi):
+        process = self.read(process)
+        for lulc_class in process_lulc_classes(process):
+            algo_qual_assessment = individual_index(self.onto).get(metric_type, urllib.parse.quote(
+                metric.replace(" ", "_") + "_" + str(doi) + "_" + content_hash(process.name, lulc_class.name)
+                ))
+            self.op_append(algo_qual_assessment, "assessedOnClass", lulc_class)
+            self.op_append(process, "hasAccuracyAlgorithm", algo_qual_assessment)
+
+    def op_branch(self, condition, then_ops, else_ops):
+        kind, entity, name = condition
+        if (entity, name) in self.indexes:
+            count = len(self.indexes[(entity, name)].values)
+        else:
+            count = len(getattr(self.read(entity), name))
+        self.run(then_ops if count == 1 else else_ops)
+
+    def op_log(self, level, message):
+        logger.log(level, message)
+
+    def op_raise(self, error):
+        raise error
+
+    def op_block(self, ops):
+        try:
+            self.run(ops)
+        except StopBlock:
+            pass
+
+
+def apply_article(onto, ir, batch=None):
+    """
+    Applies the operations of an ArticleIR to onto, and returns the paper individual.
+    If a TripleBatch is given (e.g. for a chunk of rows), it is left to flush by the caller.
+    """
+    writer = Writer(onto, batch)
+    try:
+        writer.run(ir.ops)
+    finally:
+        if batch is None:
+            writer.batch.flush()
+    return writer.values.get(ir.article)
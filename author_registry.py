@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the authors resolved during the enrichment, shared by all the papers
+of a run and kept between the runs in a SQLite file, so that the first name and
+the affiliation of an author appearing in many papers are resolved only once:
+- the authors, by ORCID (or normalized name without ORCID), with the Crossref
+  affiliation they were resolved from, and the resulting first name and split affiliation,
+- the answers of ORCID (given names and affiliation), reused when the same author
+  comes with another Crossref affiliation.
+"""
+import os
+import logging
+import sqlite3
+import threading
+import time
+
+from geocoding import normalize_place
+
+logger = logging.getLogger("author_registry")
+
+
+def author_key(first_name, last_name, orcid):
+    """Key of an author: its ORCID, or its normalized name, or None if it has neither."""
+    if orcid:
+        return "orcid:" + orcid.rstrip("/").split("/")[-1]
+    name = " ".join(normalize_place(last_name or "")) + "|" + " ".join(normalize_place(first_name or ""))
+    return "name:" + name if name != "|" else None
+
+
+class AuthorRegistry:
+    def __init__(self, cache_dir, refresh=False, persist=True):
+        """
+        cache_dir: folder in which the SQLite file is created
+        refresh: if True, the authors resolved by the previous runs are ignored and replaced
+        persist: if False, the authors are only kept in memory for this run (e.g. from replayed responses)
+        """
+        self.path = os.path.join(cache_dir, "authors.sqlite")
+        self.lock = threading.Lock()
+        self.counts = {"authors resolved": 0, "authors reused": 0, "ORCID lookups saved": 0, "affiliation splits saved": 0}
+        if not persist:
+            self.connection = None
+            self.authors = {}
+            self.orcid_answers = {}
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS authors ("
+            "key TEXT PRIMARY KEY, affiliation TEXT NOT NULL, first_name TEXT, affiliation_name TEXT, "
+            "affiliation_address TEXT, orcid_lookups INTEGER NOT NULL, affiliation_splits INTEGER NOT NULL, "
+            "created REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS orcid (orcid TEXT PRIMARY KEY, first_name TEXT, affiliation TEXT, created REAL NOT NULL)"
+        )
+        self.connection.commit()
+        #The registry is small (one entry per author of the review): it is kept in memory too
+        if refresh:
+            self.authors = {}
+            self.orcid_answers = {}
+        else:
+            self.authors = {key: values for key, *values in self.connection.execute(
+                "SELECT key, affiliation, first_name, affiliation_name, affiliation_address, "
+                "orcid_lookups, affiliation_splits FROM authors")}
+            self.orcid_answers = {orcid: (first_name, affiliation) for orcid, first_name, affiliation in
+                                  self.connection.execute("SELECT orcid, first_name, affiliation FROM orcid")}
+
+    def get(self, key, affiliation):
+        """
+        (first name, affiliation name, affiliation address) of the author already resolved
+        from the same Crossref affiliation, or None.
+        """
+        entry = self.authors.get(key)
+        if entry is None or entry[0] != (affiliation or ""):
+            return None
+        affiliation, first_name, affiliation_name, affiliation_address, orcid_lookups, affiliation_splits = entry
+        with self.lock:
+            self.counts["authors reused"] += 1
+            self.counts["ORCID lookups saved"] += orcid_lookups
+            self.counts["affiliation splits saved"] += affiliation_splits
+        return first_name, affiliation_name, affiliation_address
+
+    def put(self, key, affiliation, resolved, orcid_lookups, affiliation_splits):
+        """
+        Records the author key resolved from the Crossref affiliation, with the number of
+        ORCID lookups and affiliation splits it took (the lookups saved when it is reused).
+        """
+        entry = ((affiliation or ""), *resolved, orcid_lookups, affiliation_splits)
+        with self.lock:
+            self.counts["authors resolved"] += 1
+            self.authors[key] = entry
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "INSERT OR REPLACE INTO authors VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, *entry, time.time())
+            )
+            self.connection.commit()
+
+    def get_orcid(self, orcid):
+        """(given names, affiliation) answered by ORCID for orcid, or None."""
+        answer = self.orcid_answers.get(orcid)
+        if answer is not None:
+            with self.lock:
+                self.counts["ORCID lookups saved"] += 1
+        return answer
+
+    def has_orcid(self, orcid):
+        return orcid in self.orcid_answers
+
+    def put_orcid(self, orcid, first_name, affiliation):
+        with self.lock:
+            self.orcid_answers[orcid] = (first_name, affiliation)
+            if self.connection is None:
+                return
+            self.connection.execute(
+                "INSERT OR REPLACE INTO orcid VALUES (?, ?, ?, ?)",
+                (orcid, first_name, affiliation, time.time())
+            )
+            self.connection.commit()
+
+    def summary(self):
+        """Number of authors resolved and reused, and of lookups saved, for the run report."""
+        return dict(self.counts)
+
+    def report(self):
+        logger.info("Authors: " + ", ".join(f"{count} {name}" for name, count in self.counts.items()))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
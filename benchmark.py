@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Offline micro-benchmarks of the instantiation and parsing hot paths of owl_filler.py,
+run on synthetic ontology_instanciation sheets.
+
+    python benchmark.py --papers 200 --output bench.json
+    python benchmark.py --papers 200 --baseline bench.json
+
+The metadata enrichment is not run and the geocoding is stubbed out, so no request is sent.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+
+import pandas as pd
+import owlready2 as or2
+
+import cell_parser
+import owl_filler
+from workbook_reader import iter_sheet_rows
+from row_records import prepare_rows
+from article_ir import ArticleIR, apply_article
+from ontology_index import schema_index
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.join(HERE, "LULC_Ontology_template.xlsm")
+OWL_FILE_PATH = os.path.join(HERE, "lulc_review.owl")
+DEFAULT_TOLERANCE = 0.1  # slowdown tolerated before reporting a regression
+
+LATEX_NAMES = ["M{\\\"u}ller", "Poup{\\'e}e", "G{\\'e}rard", "Smith", "Nguyen", "Garc{\\'\\i}a"]
+TOPICS = ["urban sprawl", "crop mapping", "deforestation", "wetlands", "land cover change"]
+
+
+def offline():
+    """Stubs out the geocoding, the only web service called during the instantiation."""
+    owl_filler.geocode_address = lambda address: False
+
+
+def nomenclature(classes, rng):
+    """Two level hierarchical nomenclature with about classes level 2 classes, and its level 2 class names."""
+    groups = max(1, classes // 3)
+    level1 = [f"class {g}" for g in range(groups)]
+    level2 = []
+    level2_cells = []
+    for g in range(groups):
+        names = [f"class {g}.{m}" for m in range(rng.randint(1, max(1, 2 * classes // groups - 1)))]
+        level2.extend(names)
+        if len(names) > 1:
+            names = [f"({names[0]}"] + names[1:-1] + [f"{names[-1]})"]
+        level2_cells.extend(names)
+    return " ; ".join(level1) + " | " + " ; ".join(level2_cells), level2
+
+
+def per_class_values(study_areas, class_names, metric_density, rng):
+    """Per class metric with extra information: "{area: class: value, ...};{...}"."""
+    blocks = []
+    for area in study_areas:
+        parts = [f"{area}: {name}: {rng.uniform(0.5, 1):.2f}" for name in class_names if rng.random() < metric_density]
+        blocks.append("{" + ", ".join(parts or [f"{area}: {class_names[0]}: 0.5"]) + "}")
+    return ";".join(blocks)
+
+
+def synthetic_sheet(papers=100, authors=5, inputs=3, classes=10, metric_density=0.5, seed=0):
+    """
+    DataFrame shaped like the ontology_instanciation sheet as create_article reads it
+    (one level of columns, without the guide row), with papers rows.
+    authors, inputs: number of authors and of input datasets of each paper
+    classes: approximate number of classes of the nomenclature of each paper
+    metric_density: share of the classes having a value in the per class metrics
+    """
+    rng = random.Random(seed)
+    columns = [name for block, name in next(iter_sheet_rows(TEMPLATE_PATH))]
+    rows = []
+    for i in range(papers):
+        row = dict.fromkeys(columns)
+        study_areas = [f"Area {i}A", f"Area {i}B"]
+        classes_cell, class_names = nomenclature(classes, rng)
+        author_names = [f"{rng.choice(LATEX_NAMES)}{a}, {chr(65 + a % 26)}." for a in range(authors)]
+        row.update({
+            "doi": f"10.5555/bench.{i}",
+            "Title": f"Synthetic paper {i} on {rng.choice(TOPICS)}",
+            "type of publication": "journal",
+            "Authors": " and ".join(author_names),
+            "Affiliation Name": " ; ".join(f"Laboratory {a % 7}, University {a % 5}" for a in range(authors)),
+            "Affiliation Address": " ; ".join(f"{a} street, City {a % 5}, Country {a % 3}" for a in range(authors)),
+            "journal": f"journal {i % 20}",
+            "Year": str(2000 + i % 25),
+            "Keywords": " ; ".join(rng.sample(TOPICS, 3)),
+            "Abstract": "Synthetic abstract. " * 20,
+            "number of citations": str(rng.randint(0, 500)),
+            "process type": rng.choice(["classification", "change_detection"]),
+            "procedure": "preprocessing ; classification ; validation",
+            "algorithms": "{Sen2Cor};{Random forest ; U-Net};{majority vote}",
+            "tool used names": "{QGIS};{PyTorch};{QGIS}",
+            "tool used types": "{storage};{other};{validation}",
+            "tool used is collaborative": "{no};{no};{yes}",
+            "input data names": " ; ".join(f"dataset {i}.{k}" for k in range(inputs)),
+            "input data natures and resolution": " ; ".join(["land_cover:10m", "satellite:10m", "land_use:5m"][k % 3] for k in range(inputs)),
+            "input data date": " ; ".join(["2018", "[2019, 2020]", "period(2015-2019)"][k % 3] for k in range(inputs)),
+            "Input  is VGI ": " ; ".join(rng.choice(["no", "yes"]) for k in range(inputs)),
+            "input data raster/points/lines/polygon": " ; ".join(rng.choice(["raster", "polygon"]) for k in range(inputs)),
+            "input is training, validation, both or neither": " ; ".join(["training", "validation", "both"][k % 3] for k in range(inputs)),
+            "training dataset size": " ; ".join(str(rng.randint(100, 10000)) for k in range(inputs)),
+            "validation dataset size": " ; ".join(str(rng.randint(100, 10000)) for k in range(inputs)),
+            "output data names": f"map {i}",
+            "output data natures and resolution": "land_cover:10m",
+            "output data raster/points/lines/polygon": "raster",
+            "operator type": "computer",
+            "operator description": "automatic",
+            "Study Area name": " ; ".join(study_areas),
+            "geographic extent type": "local ; local",
+            "belongs to country": "France ; [Spain, Italy]",
+            "if classification, nomenclature level": "1 ; 2",
+            "if classification, nomenclature classes": classes_cell,
+            "Number of classes": str(len(class_names)),
+            "OA": f"{rng.uniform(0.6, 1):.2f} ; {rng.uniform(60, 100):.1f} %",
+            "kappa": f"0,{rng.randint(50, 99)} ; 0,{rng.randint(50, 99)}",
+            "per class F1 score": per_class_values(study_areas, class_names, metric_density, rng),
+            "per class IoU": " ; ".join(f"{name}: {rng.uniform(0.3, 0.9):.2f}" for name in class_names if rng.random() < metric_density) or None,
+            "user defined algorithm quality assessment metrics": f"omission rate ({class_names[0]}) : {rng.randint(1, 30)}%",
+            "codeAvailability ": "no",
+            "dataAvailability": "yes",
+            "challenge": "synthetic challenge",
+            "strength": "synthetic strength ; fast",
+            "weakness": "synthetic weakness",
+        })
+        rows.append([row[column] for column in columns])
+    return pd.DataFrame(rows, columns=columns, dtype=object)
+
+
+def new_ontology():
+    return or2.World().get_ontology(OWL_FILE_PATH).load()
+
+
+def clear_caches():
+    """Clears the memoized cell parsers, so that each repeat parses the cells again."""
+    for function in vars(cell_parser).values():
+        if hasattr(function, "cache_clear"):
+            function.cache_clear()
+    cell_parser.parsed_numbers.clear()
+
+
+#Each benchmark prepares its data, and returns (number of calls, seconds spent in the timed calls)
+
+def bench_prepare_rows(sheet):
+    start = time.perf_counter()
+    prepare_rows(sheet)
+    return len(sheet), time.perf_counter() - start
+
+
+def bench_article_metadata(sheet):
+    onto = new_ontology()
+    rows = prepare_rows(sheet)
+    start = time.perf_counter()
+    for row in rows:
+        ir = ArticleIR()
+        owl_filler.article_metadata(ir, row)
+        apply_article(onto, ir)
+    return len(rows), time.perf_counter() - start
+
+
+def bench_parse_article(sheet):
+    onto = new_ontology()
+    rows = prepare_rows(sheet)
+    schema = schema_index(onto)
+    start = time.perf_counter()
+    for row in rows:
+        owl_filler.parse_article(row, schema)
+    return len(rows), time.perf_counter() - start
+
+
+def bench_create_article(sheet):
+    onto = new_ontology()
+    rows = prepare_rows(sheet)
+    start = time.perf_counter()
+    for row in rows:
+        owl_filler.create_article(onto, row)
+    return len(rows), time.perf_counter() - start
+
+
+def bench_instantiate_rows(sheet):
+    onto = new_ontology()
+    start = time.perf_counter()
+    owl_filler.instantiate_rows(onto, sheet)
+    return len(sheet), time.perf_counter() - start
+
+
+def bench_per_class_metric_with_extra_info(sheet):
+    onto = new_ontology()
+    rows = prepare_rows(sheet)
+    processes = [owl_filler.create_article(onto, row).hasProcess[-1] for row in rows]
+    metric = "per class F1 score"
+    start = time.perf_counter()
+    for row, process in zip(rows, processes):
+        ir = ArticleIR()
+        process = ir.create(process.is_a[0].name, process.name)
+        owl_filler.per_class_metric_with_extra_info(ir, row, owl_filler.MetricContext(row), metric, "f1_score", process, row["doi"])
+        apply_article(onto, ir)
+    return len(rows), time.perf_counter() - start
+
+
+def bench_parse_grouped_field(sheet):
+    cells = [cell for column in ["algorithms", "tool used names", "tool used types", "tool used is collaborative"]
+             for cell in sheet[column]]
+    start = time.perf_counter()
+    for cell in cells:
+        owl_filler.parse_grouped_field(cell)
+    return len(cells), time.perf_counter() - start
+
+
+def bench_get_group_hierarchy(sheet):
+    levels = [level for cell in sheet["if classification, nomenclature classes"] for level in cell.split("|")]
+    start = time.perf_counter()
+    for level in levels:
+        owl_filler.get_group_hierarchy(level)
+    return len(levels), time.perf_counter() - start
+
+
+def bench_decode_latex(sheet):
+    names = [name for cell in sheet["Authors"] for name in cell.split(" and ")]
+    start = time.perf_counter()
+    for name in names:
+        owl_filler.decode_latex(name)
+    return len(names), time.perf_counter() - start
+
+
+def bench_onto_save(sheet):
+    onto = new_ontology()
+    for row in prepare_rows(sheet):
+        owl_filler.create_article(onto, row)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        onto.save(os.path.join(tmp_dir, "instantiated.owl"))
+        return 1, time.perf_counter() - start
+
+
+BENCHMARKS = {
+    "prepare_rows": bench_prepare_rows,
+    "article_metadata": bench_article_metadata,
+    "parse_article": bench_parse_article,
+    "create_article": bench_create_article,
+    "instantiate_rows": bench_instantiate_rows,
+    "per_class_metric_with_extra_info": bench_per_class_metric_with_extra_info,
+    "parse_grouped_field": bench_parse_grouped_field,
+    "get_group_hierarchy": bench_get_group_hierarchy,
+    "decode_latex": bench_decode_latex,
+    "onto.save": bench_onto_save,
+}
+
+
+def run_benchmarks(sheet, names, repeats):
+    """Runs each benchmark repeats times, the output of the instantiation being discarded."""
+    results = {}
+    for name in names:
+        durations = []
+        for _ in range(repeats):
+            clear_caches()
+            logging.disable(logging.CRITICAL)
+            try:
+                calls, duration = BENCHMARKS[name](sheet)
+            finally:
+                logging.disable(logging.NOTSET)
+            durations.append(duration)
+        best = min(durations)
+        results[name] = {
+            "calls": calls,
+            "repeats": durations,
+            "best": best,
+            "median": statistics.median(durations),
+            "per_call_ms": best / calls * 1000,
+        }
+        print(f"{name}: {calls} calls, best {best:.4f}s, median {results[name]['median']:.4f}s, {results[name]['per_call_ms']:.3f} ms per call")
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Prints the ratio of the best times to the ones of the baseline, and returns the names of the regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<36}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        reference = baseline["results"][name]["best"]
+        ratio = result["best"] / reference if reference else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  slower"
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        print(f"{name:<36}{reference:>12.4f}{result['best']:>12.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the instantiation of the LULC ontology on synthetic papers.")
+    parser.add_argument("--papers", type=int, default=100, help="Number of synthetic papers (rows)")
+    parser.add_argument("--authors", type=int, default=5, help="Number of authors of each paper")
+    parser.add_argument("--inputs", type=int, default=3, help="Number of input datasets of each paper")
+    parser.add_argument("--classes", type=int, default=10, help="Approximate number of classes of the nomenclatures")
+    parser.add_argument("--metric-density", type=float, default=0.5, help="Share of the classes with a per class metric value")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs of each benchmark, the best one being kept")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--baseline", default=None, help="JSON file of previous results to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Slowdown ratio tolerated before reporting a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with an error status if a benchmark is slower than the baseline")
+    args = parser.parse_args()
+
+    offline()
+    config = {"papers": args.papers, "authors": args.authors, "inputs": args.inputs, "classes": args.classes,
+              "metric_density": args.metric_density, "seed": args.seed, "repeats": args.repeats}
+    sheet = synthetic_sheet(args.papers, args.authors, args.inputs, args.classes, args.metric_density, args.seed)
+    results = run_benchmarks(sheet, args.only, args.repeats)
+
+    report = {
+        "config": config,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "pandas": pd.__version__, "date": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("config") != config:
+            print("The baseline was run with another configuration:", baseline.get("config"))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
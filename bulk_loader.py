@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk insertion of the property values of individuals in the quadstore of an owlready2 world.
+
+Appending or setting a value through owlready2 (individual.hasAuthor.append(author),
+individual.label = label) goes through its property descriptors and list callbacks,
+and writes each triple with its own SQLite statement. A TripleBatch collects the triples
+of a paper or of a chunk of rows instead, and inserts them with executemany, in the
+current transaction of the world (committed with the world, as before).
+
+The appends have set semantics: a value already appended to the same property of an
+individual since the batch was created (e.g. the name of a journal, or the algorithm of a
+process, on each row of the paper) is skipped instead of being written again.
+
+The values cached by owlready2 on the individuals written (and on the individuals they
+refer to, for the inverse properties) are dropped when the batch is flushed, so that they
+are read back from the quadstore. The batch must therefore be flushed before the values
+of a property are read (see article_ir.Writer).
+
+The quadstore tables and the caches are internals of owlready2 (tested with 0.51, the version pinned in the README):
+tests/test_bulk_loader.py checks that the triples are the ones written through owlready2.
+"""
+import owlready2 as or2
+
+
+def inverse_python_name(prop):
+    """Name under which owlready2 caches the inverse values of an object property on the objects."""
+    if prop.inverse_property:
+        return prop.inverse_property.python_name
+    return "INVERSE_%s" % prop.python_name
+
+
+class TripleBatch:
+    """
+    Triples to insert in world, by (subject, property). append, extend and set return False
+    when the property cannot be written in bulk (undefined, or functional object property),
+    the caller then falls back to owlready2 after flushing the batch.
+    """
+    def __init__(self, world):
+        self.world = world
+        self.props = {}
+        self.inverse_names = {}
+        #(subject storid, property storid): [individual, property, object rows, data rows], the rows being dict keys
+        self.values = {}
+        #(subject storid, property storid): rows inserted by the previous flushes
+        self.written = {}
+        #(subject storid, property storid) whose previous values are deleted
+        self.cleared = set()
+        #(individual referred to, name of its cached inverse values)
+        self.referred = []
+        self.inserted = 0
+        self.skipped = 0
+
+    def prop(self, name):
+        if name not in self.props:
+            prop = self.props[name] = self.world._props.get(name)
+            if prop is not None and prop._owl_type == or2.owl_object_property:
+                self.inverse_names[prop] = inverse_python_name(prop)
+        return self.props[name]
+
+    def entry(self, entity, prop):
+        key = (entity.storid, prop.storid)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [entity, prop, {}, {}]
+        return entry
+
+    def add(self, entry, value):
+        entity, prop, objs, datas = entry
+        ontology = entity.namespace.ontology
+        if prop._owl_type == or2.owl_object_property:
+            #As in owlready2, a value which is not an individual cannot be appended
+            row, rows = (ontology.graph.c, entity.storid, prop.storid, value.storid), objs
+            self.referred.append((value, self.inverse_names[prop]))
+        elif prop._owl_type == or2.owl_annotation_property and hasattr(value, "storid"):
+            row, rows = (ontology.graph.c, entity.storid, prop.storid, value.storid), objs
+        else:
+            row, rows = (ontology.graph.c, entity.storid, prop.storid, *ontology._to_rdf(value)), datas
+        if row in rows or row in self.written.get((entity.storid, prop.storid), ()):
+            self.skipped += 1
+        else:
+            rows[row] = None
+
+    def clear(self, entry):
+        entity, prop, objs, datas = entry
+        self.forget(entity, prop.python_name)
+        self.cleared.add((entity.storid, prop.storid))
+        objs.clear()
+        datas.clear()
+
+    def forget(self, entity, name):
+        """The values of the property name of entity may have been deleted: they are not skipped anymore."""
+        prop = self.prop(name)
+        if prop is not None:
+            self.written.pop((entity.storid, prop.storid), None)
+
+    def append(self, entity, name, value):
+        return self.extend(entity, name, (value,))
+
+    def extend(self, entity, name, values):
+        prop = self.prop(name)
+        if prop is None or prop.is_functional_for(entity.__class__):
+            return False
+        entry = self.entry(entity, prop)
+        for value in values:
+            self.add(entry, value)
+        return True
+
+    def set(self, entity, name, value):
+        """entity.name = value, with the semantics of owlready2."""
+        prop = self.prop(name)
+        if prop is None:
+            return False
+        if prop.is_functional_for(entity.__class__):
+            if prop._owl_type == or2.owl_object_property:
+                return False
+            values = [] if value is None else [value]
+        elif isinstance(value, list):
+            values = value
+        elif prop._owl_type == or2.owl_annotation_property:
+            values = [] if value is None else [value]
+        else:
+            #owlready2 raises an error
+            return False
+        entry = self.entry(entity, prop)
+        self.clear(entry)
+        for value in values:
+            self.add(entry, value)
+        return True
+
+    def flush(self):
+        """Inserts the triples collected, and drops the values cached by owlready2 on the individuals written."""
+        if not self.values and not self.cleared:
+            return
+        execute = self.world.graph.db.executemany
+        if self.cleared:
+            execute("DELETE FROM objs WHERE s=? AND p=?", self.cleared)
+            execute("DELETE FROM datas WHERE s=? AND p=?", self.cleared)
+        objs = [row for entry in self.values.values() for row in entry[2]]
+        datas = [row for entry in self.values.values() for row in entry[3]]
+        #The rows already in the quadstore (e.g. added by a previous run) are ignored, and not counted
+        if objs:
+            self.inserted += execute("INSERT OR IGNORE INTO objs VALUES (?, ?, ?, ?)", objs).rowcount
+        if datas:
+            self.inserted += execute("INSERT OR IGNORE INTO datas VALUES (?, ?, ?, ?, ?)", datas).rowcount
+        for key, (entity, prop, entity_objs, entity_datas) in self.values.items():
+            self.written.setdefault(key, set()).update(entity_objs, entity_datas)
+            if hasattr(entity.__dict__, "pop"):
+                entity.__dict__.pop(prop.python_name, None)
+        for value, name in self.referred:
+            if hasattr(value.__dict__, "pop"):
+                value.__dict__.pop(name, None)
+        self.values = {}
+        self.cleared = set()
+        self.referred = []
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Parser of the mini-language used in the cells of the ontology_instanciation sheet:
+- lists separated by ";"
+- groups "{...};{...}" (one group per procedure step, or per study area)
+- nomenclatures separated by "|", the classes of a level being grouped with "( )"
+  under the classes of the previous level
+- "context:class:value" triples of the per class metrics
+- dates: a year, a list of years "[y1, y2]", or "period(a-b)"
+- "value (comment)" suffixes
+- numbers: decimals with a dot or a French decimal comma, percentages, fractions
+Each cell is parsed in a single pass with precompiled patterns. The results are
+immutable, and memoized by cell text since the same strings appear in many rows.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import pandas as pd
+
+LIST_SEPARATOR = re.compile(r"\s?;\s?")
+GROUP_SEPARATOR = re.compile(r"}\s*;\s*{")
+NOMENCLATURE_SEPARATOR = re.compile(r"\s?\|\s?")
+KEYWORD_SEPARATOR = re.compile(r"\s?;\s?|\s?,\s?")
+COMMA_SEPARATOR = re.compile(r"\s?,\s?")
+NAMED_VALUE_SEPARATOR = re.compile(r"\s?:\s?")
+COMMENT_SEPARATOR = re.compile(r"\s?\(\s?")
+BLOCK_PATTERN = re.compile(r"\{.*?\}")
+PART_SEPARATOR = re.compile(r",\s?")
+DATE_SEPARATOR = re.compile(r"\s?,\s?|\s?-\s?")
+USER_METRIC_SEPARATOR = re.compile(r"\s?:|=\s?")
+#Numeric literal: decimal (with a dot or a comma), optionally divided by another one, optionally in %
+NUMBER_LITERAL = (r"(?P<numerator>[+-]?(?:\d+(?:[.,]\d+)?|[.,]\d+))"
+                  r"(?:\s*/\s*(?P<denominator>\d+(?:[.,]\d+)?))?"
+                  r"(?:\s*(?P<percent>%))?")
+NUMBER_PATTERN = re.compile(rf"^\s*{NUMBER_LITERAL}\s*$")
+NUMBER_SEARCH = re.compile(rf"(?<![\w.,]){NUMBER_LITERAL}(?!\w)")
+PARENTHESES = str.maketrans("", "", "()")
+BRACKETS = str.maketrans("", "", "[]")
+
+CACHE_SIZE = 1 << 16
+
+#classes: names of the classes; groups: for each class, the index of its mother class in the previous level
+Nomenclature = namedtuple("Nomenclature", ["classes", "groups"])
+#period: years of a "period(a-b)", years: list of years "[y1, y2]", year: a single year (int)
+InputDate = namedtuple("InputDate", ["text", "period", "years", "year"])
+#context: study area, dataset, algorithm or date the value refers to (None if not given)
+ClassValue = namedtuple("ClassValue", ["context", "class_name", "value"])
+#values: the ClassValue of a block, unrecognized: the parts which are not "[context:]class:value"
+ClassValueBlock = namedtuple("ClassValueBlock", ["values", "unrecognized"])
+#"name (class) : value", the class and the value being optional
+UserMetric = namedtuple("UserMetric", ["name_and_class", "name", "class_name", "value"])
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_list(text):
+    """Items of a ";" separated list."""
+    return tuple(LIST_SEPARATOR.split(text))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_keywords(text):
+    """Keywords separated by "," or ";"."""
+    return tuple(keyword.strip() for keyword in KEYWORD_SEPARATOR.split(text))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def split_comma_list(text):
+    """Items of a "," separated list."""
+    return tuple(COMMA_SEPARATOR.split(text))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_bracket_list(text):
+    """Items of a "[a, b]" list, or the text alone if it is not a list."""
+    if "[" in text:
+        return tuple(COMMA_SEPARATOR.split(text.translate(BRACKETS)))
+    return (text,)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_grouped_field(field):
+    """Groups of a "{...};{...}" cell, or items of a ";" separated list."""
+    field = field.strip()
+    if field.startswith("{") and field.endswith("}"):
+        # Parse outermost groups
+        return tuple(item.strip("{} ") for item in GROUP_SEPARATOR.split(field[1:-1]))
+    else:
+        return tuple(item.strip() for item in LIST_SEPARATOR.split(field))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_named_value(text):
+    """Splits "name : value" into (name, value), or returns (text, None) without ":"."""
+    if ":" in text:
+        name, value = NAMED_VALUE_SEPARATOR.split(text, maxsplit=1)
+        return name, value
+    return text, None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_value_comment(text):
+    """Splits "value (comment)" into (value, comment), or returns (text, None) without comment."""
+    if "(" in text:
+        value, comment = COMMENT_SEPARATOR.split(text, maxsplit=1)
+        return value, comment.replace(")", "").strip()
+    return text, None
+
+
+def get_group_hierarchy(text):
+    """For each class of a nomenclature level, index of its group, i.e. of its mother class."""
+    return list(parse_nomenclature_level(text).groups)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_nomenclature_level(text):
+    """
+    Classes of a nomenclature level, and the group of each class.
+    A group is either a single class, or the classes written between parentheses.
+    """
+    classes = []
+    groups = []
+    current_group = 0
+    is_in_group = False
+    for element in LIST_SEPARATOR.split(text):
+        classes.append(element.translate(PARENTHESES))
+        groups.append(current_group)
+        is_in_group = (
+             "(" in element or (is_in_group and ")" not in element)
+        )
+        if not is_in_group:
+            current_group += 1
+    return Nomenclature(tuple(classes), tuple(groups))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_nomenclatures(text):
+    """Nomenclature levels of a "|" separated cell."""
+    return tuple(parse_nomenclature_level(level) for level in NOMENCLATURE_SEPARATOR.split(text))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_input_date(text):
+    """
+    Date of an input dataset (lowercase): a year, a list of years "[y1, y2]",
+    and/or a period "period(a-b)".
+    """
+    period = None
+    years = None
+    year = None
+    if "period" in text:
+        period = tuple(DATE_SEPARATOR.split(text.replace("period(", "").replace(")", "")))
+    if "[" in text:
+        years = tuple(COMMA_SEPARATOR.split(text.translate(BRACKETS)))
+    elif text.isnumeric():
+        year = int(text)
+    return InputDate(text, period, years, year)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_class_values(text):
+    """
+    Blocks of "[context:]class:value" parts of a per class metric,
+    e.g. "{Fairfax: Non-residential: 0.78, Fairfax: Residential: 0.9};{...}".
+    The blocks are between braces, or separated by ";" without braces.
+    """
+    blocks = BLOCK_PATTERN.findall(text)
+    if not blocks:  # fallback to simple semicolon split
+        blocks = LIST_SEPARATOR.split(text)
+    parsed_blocks = []
+    for block in blocks:
+        # Remove enclosing braces if present
+        block = block.strip("{} ")
+        values = []
+        unrecognized = []
+        for part in PART_SEPARATOR.split(block):
+            fields = [field.strip() for field in part.strip().split(":")]
+            if len(fields) == 3:
+                values.append(ClassValue(*fields))
+            elif len(fields) == 2:
+                values.append(ClassValue(None, *fields))
+            else:
+                unrecognized.append(part.strip())
+        parsed_blocks.append(ClassValueBlock(tuple(values), tuple(unrecognized)))
+    return tuple(parsed_blocks)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_user_metric(text):
+    """User defined metric "name (class) : value" or "name (class) = value", the class and the value being optional."""
+    if ":" in text or "=" in text:
+        name_and_class, value = USER_METRIC_SEPARATOR.split(text, maxsplit=1)
+    else:
+        name_and_class = text
+        value = None
+    if "(" in name_and_class:
+        name, class_name = COMMENT_SEPARATOR.split(name_and_class.replace(")", ""), maxsplit=1)
+        class_name = class_name.strip()
+    else:
+        name = name_and_class
+        class_name = None
+    return UserMetric(name_and_class, name, class_name, value)
+
+
+#Numbers already parsed, by stripped text (None if the text is not a number),
+#emptied when it would hold more than CACHE_SIZE of them
+parsed_numbers = {}
+
+def number_value(numerator, denominator, percent):
+    value = float(numerator.replace(",", "."))
+    if denominator is not None:
+        denominator = float(denominator.replace(",", "."))
+        if denominator == 0:
+            return None
+        value /= denominator
+    if percent:
+        value /= 100
+    return value
+
+
+def parse_number(text):
+    """
+    Value of a numeric literal such as "0.78", "78%", "78 %", "0,78" or "3/4",
+    or None if text is not a number.
+    """
+    text = text.strip()
+    if text not in parsed_numbers:
+        if len(parsed_numbers) >= CACHE_SIZE:
+            parsed_numbers.clear()
+        match = NUMBER_PATTERN.match(text)
+        parsed_numbers[text] = None if match is None else number_value(*match.group("numerator", "denominator", "percent"))
+    return parsed_numbers[text]
+
+
+def is_number(text):
+    return parse_number(text) is not None
+
+
+def split_by_decimal_token(text):
+    """Splits a text containing a number, e.g. "0.85 of urban areas", into (number, rest of the text)."""
+    match = NUMBER_SEARCH.search(text)
+    if match is None:
+        return text, ""
+    return match.group(), (text[:match.start()] + " " + text[match.end():]).strip()
+
+
+def preparse_numbers(cells):
+    """
+    Parses at once all the numeric literals found in a pandas Series of cells,
+    with vectorized string operations, and stores them in parsed_numbers so that
+    parse_number only has to look them up.
+    """
+    literals = cells.dropna().astype(str).str.extractall(rf"(?P<literal>{NUMBER_LITERAL})")
+    if literals.empty:
+        return
+    numerators = pd.to_numeric(literals["numerator"].str.replace(",", ".", regex=False))
+    denominators = pd.to_numeric(literals["denominator"].str.replace(",", ".", regex=False)).fillna(1)
+    values = numerators / denominators.where(denominators != 0)
+    values = values.where(literals["percent"].isna(), values / 100)
+    numbers = dict(zip(literals["literal"].str.strip(), values))
+    if len(parsed_numbers) + len(numbers) > CACHE_SIZE:
+        parsed_numbers.clear()
+    for literal, value in numbers.items():
+        parsed_numbers.setdefault(literal, None if pd.isna(value) else float(value))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Checks whether a string is a place name (used to split the affiliations and to
+disambiguate the labels of the metrics) with as few Nominatim requests as possible:
+1. a persistent memo of the addresses already checked,
+2. an optional offline gazetteer (GeoNames dump or Natural Earth table exported to CSV),
+3. the online geocoder, only for the addresses found in neither of them.
+"""
+import os
+import sys
+import csv
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+#Tokens of an address which are not part of a place name
+IGNORED_TOKEN_PATTERN = re.compile(r"^(\d.*|.*\d|cedex|bp|cs|po|box)$")
+
+#Columns of a Natural Earth table containing place names
+NATURAL_EARTH_NAME_COLUMNS = {"NAME", "NAME_EN", "NAMEASCII", "NAME_LONG", "ADMIN",
+                              "SOVEREIGNT", "GEOUNIT", "NAME_ALT", "FORMAL_EN"}
+
+logger = logging.getLogger("geocoding")
+
+
+def normalize_place(text):
+    """Returns the tokens of text, lowercased and without accents or punctuation."""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return tuple(token for token in re.split(r"[^a-z0-9]+", text) if token)
+
+
+class GeocodeMemo:
+    """Persistent memo of the address -> is a place results, stored in a SQLite file."""
+    def __init__(self, cache_dir, refresh=False):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "geocoding.sqlite")
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocoding ("
+            "address TEXT PRIMARY KEY, found INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        self.connection.commit()
+        #The memo is small (a few thousand addresses): it is kept in memory too
+        if refresh:
+            self.results = {}
+        else:
+            self.results = {address: bool(found) for address, found in
+                            self.connection.execute("SELECT address, found FROM geocoding")}
+
+    @staticmethod
+    def key(address):
+        return " ".join(normalize_place(address))
+
+    def get(self, address):
+        return self.results.get(self.key(address))
+
+    def put(self, address, found):
+        key = self.key(address)
+        with self.lock:
+            self.results[key] = found
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocoding VALUES (?, ?, ?)",
+                (key, int(found), time.time())
+            )
+            self.connection.commit()
+
+
+class Gazetteer:
+    """
+    Token trie of place names. Each node is a dict from a token to the child node,
+    the key None marking the end of a name.
+    """
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, name):
+        tokens = normalize_place(name)
+        if not tokens:
+            return
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(sys.intern(token), {})
+        if None not in node:
+            node[None] = True
+            self.size += 1
+
+    def longest_prefix(self, tokens):
+        """Returns the number of tokens of the longest place name starting tokens (0 if none)."""
+        node = self.root
+        longest = 0
+        for i, token in enumerate(tokens):
+            node = node.get(token)
+            if node is None:
+                break
+            if None in node:
+                longest = i + 1
+        return longest
+
+    def contains_part(self, part):
+        """
+        Returns True if the part of an address (between two commas) is a place name,
+        possibly with postal codes or a short code (state, country) around it.
+        """
+        tokens = [token for token in normalize_place(part) if not IGNORED_TOKEN_PATTERN.match(token)]
+        if not tokens:
+            return False
+        length = self.longest_prefix(tokens)
+        return length > 0 and all(len(token) <= 3 for token in tokens[length:])
+
+    def contains_address(self, address):
+        """Returns True if every part of the address is a known place name."""
+        parts = [part for part in address.split(",") if normalize_place(part)]
+        return len(parts) > 0 and all(self.contains_part(part) for part in parts)
+
+    def load(self, path):
+        """Adds the names of a GeoNames dump (.txt) or of a Natural Earth table (.csv)."""
+        with open(path, encoding="utf-8", newline="") as file:
+            if path.lower().endswith(".csv"):
+                reader = csv.DictReader(file)
+                columns = [column for column in reader.fieldnames if column.upper() in NATURAL_EARTH_NAME_COLUMNS]
+                for record in reader:
+                    for column in columns:
+                        if record[column]:
+                            self.add(record[column])
+            else:
+                country_info = os.path.basename(path).startswith("countryInfo")
+                for line in file:
+                    if line.startswith("#"):
+                        continue
+                    fields = line.rstrip("\n").split("\t")
+                    if country_info:
+                        if len(fields) > 4:
+                            self.add(fields[4])
+                    elif len(fields) > 3:
+                        #name, ascii name and alternate names
+                        self.add(fields[1])
+                        self.add(fields[2])
+                        for alternate_name in fields[3].split(","):
+                            if alternate_name and not any(c.isdigit() for c in alternate_name):
+                                self.add(alternate_name)
+        return self
+
+    @classmethod
+    def from_files(cls, paths):
+        gazetteer = cls()
+        for path in paths:
+            gazetteer.load(path)
+        logger.info(f"Gazetteer: {gazetteer.size} place names loaded")
+        return gazetteer
+
+
+class PlaceChecker:
+    """
+    Answers whether an address is a place, from the memo, then the gazetteer,
+    and finally the online geocoder.
+    online_geocode(address) must return True, False, or None if the geocoder failed.
+    is_place returns None too in this case (falsy, but not to be recorded as an answer).
+    """
+    def __init__(self, memo, gazetteer, online_geocode):
+        self.memo = memo
+        self.gazetteer = gazetteer
+        self.online_geocode = online_geocode
+        self.counts = {"memo": 0, "gazetteer": 0, "online": 0}
+
+    def is_place(self, address):
+        found = self.memo.get(address)
+        if found is not None:
+            self.counts["memo"] += 1
+            return found
+        if self.gazetteer is not None and self.gazetteer.contains_address(address):
+            self.counts["gazetteer"] += 1
+            self.memo.put(address, True)
+            return True
+        self.counts["online"] += 1
+        found = self.online_geocode(address)
+        if found is None:
+            #The geocoder failed: the address will be checked again next time
+            return None
+        self.memo.put(address, found)
+        return found
+
+    def summary(self):
+        """Number of addresses answered by each source, for the run report."""
+        return dict(self.counts)
+
+    def report(self):
+        logger.info("Geocoding: " + ", ".join(f"{count} answered by {source}" for source, count in self.counts.items()))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP session of the metadata web services: keep-alive connection pool,
+timeouts, rate limit per host, retries with exponential backoff, and
+statistics of the requests sent to each host.
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import host_rate_limiters
+
+DEFAULT_TIMEOUT = (5, 30)  # seconds to connect, seconds to read
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 1  # seconds, doubled at each retry
+MAX_RETRY_DELAY = 120
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger("http_session")
+
+
+def retry_after_delay(response):
+    """Returns the delay (in seconds) asked by the Retry-After header of the response, or None."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    if retry_after.strip().isdigit():
+        return int(retry_after)
+    try:
+        date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+def percentile(values, p):
+    """p-th percentile of values (nearest rank)."""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+class HttpSession:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, pool_size=20, rate_scale=1, transport=None):
+        """
+        timeout: timeout of each request, in seconds, or (connect, read) tuple
+        retries: number of retries after a network error or a 429/5xx status
+        backoff: delay before the first retry, doubled at each retry
+        pool_size: number of connections kept alive for each host
+        rate_scale: factor applied to the rate limits of the hosts (e.g. 1/n for n processes)
+        transport: requests adapter sending the requests (e.g. replaying recorded responses, see replay.py),
+            instead of a pool of pool_size connections to each host
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = transport or HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.rate_limiters = host_rate_limiters(rate_scale=rate_scale)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _host_stats(self, host):
+        if host not in self.stats:
+            self.stats[host] = {"requests": 0, "retries": 0, "errors": 0, "latencies": []}
+        return self.stats[host]
+
+    def _update_rate_limit(self, host, response):
+        """Follows the X-Rate-Limit-Limit and X-Rate-Limit-Interval headers sent by Crossref."""
+        limit = response.headers.get("X-Rate-Limit-Limit")
+        interval = response.headers.get("X-Rate-Limit-Interval")
+        if limit is None or interval is None or host not in self.rate_limiters:
+            return
+        try:
+            rate = int(limit) / float(interval.rstrip("s"))
+        except (ValueError, ZeroDivisionError):
+            return
+        bucket = self.rate_limiters[host]
+        if rate < bucket.rate:
+            bucket.rate = rate
+            bucket.capacity = max(1, min(bucket.capacity, int(limit)))
+
+    def get(self, url, headers=None):
+        """
+        GET request on url, retried on network errors and on 429/5xx status.
+        The delay before a retry is the one asked by the Retry-After header if any,
+        otherwise an exponential backoff. Raises the last network error if all the retries failed,
+        and returns the last response otherwise (raise_for_status is left to the caller).
+        """
+        host = urllib.parse.urlparse(url).hostname
+        for attempt in range(self.retries + 1):
+            if host in self.rate_limiters:
+                self.rate_limiters[host].acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                with self.lock:
+                    stats = self._host_stats(host)
+                    stats["requests"] += 1
+                    stats["errors"] += 1
+                if attempt == self.retries:
+                    raise
+                delay = None
+            else:
+                with self.lock:
+                    stats = self._host_stats(host)
+                    stats["requests"] += 1
+                    stats["latencies"].append(time.perf_counter() - start)
+                self._update_rate_limit(host, response)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return response
+                delay = retry_after_delay(response)
+            if delay is None:
+                delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            with self.lock:
+                self._host_stats(host)["retries"] += 1
+            time.sleep(min(delay, MAX_RETRY_DELAY))
+
+    def summary(self):
+        """Number of requests, retries and errors, and latency percentiles of each host, for the run report."""
+        with self.lock:
+            return {
+                host: {"requests": stats["requests"], "retries": stats["retries"], "errors": stats["errors"],
+                       **{f"p{p}": percentile(stats["latencies"], p) for p in (50, 90, 99)}}
+                for host, stats in sorted(self.stats.items())
+            }
+
+    def report(self):
+        """Logs the number of requests, retries and errors, and the latency percentiles of each host."""
+        for host, stats in self.summary().items():
+            logger.info(f"{host}: {stats['requests']} requests, {stats['retries']} retries, {stats['errors']} errors, "
+                        f"latency p50 {stats['p50']:.3f}s p90 {stats['p90']:.3f}s p99 {stats['p99']:.3f}s")
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental instantiation: a manifest of the rows already instantiated, kept next
+to the instantiated ontology, so that a run only instantiates the rows added or
+modified since the previous run, and retracts the individuals of the rows removed.
+
+The rows are identified by a hash of their content, and grouped by paper (DOI):
+when a row of a paper changes, all the rows of this paper are retracted and
+instantiated again. The individuals of a row are the ones it created. Those still
+referred to by the individuals of other papers (authors, journals, LULC classes...)
+are kept when the row is retracted.
+"""
+import os
+import json
+import hashlib
+
+import owlready2 as or2
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(*values):
+    """Short hash of values, used to name the individuals after their content."""
+    return hashlib.sha1("\x1f".join(str(value) for value in values).encode("utf-8")).hexdigest()[:16]
+
+
+def row_hash(values):
+    """Hash of the values of a row as read from the Excel file, the empty cells being None or NaN."""
+    return content_hash(*("" if value is None or value != value else value for value in values))
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_empty_cell(value):
+    """Empty cell, as tested by metadata_enrichment.is_empty."""
+    return not value or value != value
+
+
+def paper_key(doi, row_hash):
+    """Key grouping the rows of a paper: its DOI, or the row itself for a row without DOI."""
+    if doi is None or doi != doi or not str(doi).strip():
+        return "row:" + row_hash
+    return "doi:" + str(doi).strip().replace("https://doi.org/", "").lower()
+
+
+class PaperKeys:
+    """
+    Paper keys of the rows of a sheet, given in order (possibly over several chunks).
+    As in metadata_enrichment.paper_rows, a row without DOI continues the paper of the row
+    above, unless it is the first row of the sheet or it has a title different from the one above.
+    """
+    def __init__(self):
+        #(paper key, title) of the previous row
+        self.previous = None
+
+    def key(self, doi, title, row_hash):
+        if is_empty_cell(doi) and self.previous is not None and (is_empty_cell(title) or title == self.previous[1]):
+            key = self.previous[0]
+        else:
+            key = paper_key(doi, row_hash)
+        self.previous = (key, title)
+        return key
+
+
+class RunManifest:
+    """
+    Workbooks and rows instantiated by the previous runs, saved as JSON:
+    for each workbook, the hash of the file, and for each row hash, its paper key
+    and the IRIs of the individuals it created.
+    """
+    def __init__(self, path, owl_file_signature=None):
+        """
+        path: JSON file of the manifest
+        owl_file_signature: signature of the ontology file; a manifest made with another one is discarded
+        """
+        self.path = path
+        self.owl_file_signature = owl_file_signature
+        self.workbooks = {}
+        try:
+            with open(path, encoding="utf-8") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") == MANIFEST_VERSION and saved.get("owl_file") == owl_file_signature:
+            self.workbooks = saved.get("workbooks", {})
+
+    def is_empty(self):
+        return not self.workbooks
+
+    def is_unchanged(self, workbook_path, workbook_hash):
+        """True if the workbook was instantiated from the same file content."""
+        workbook = self.workbooks.get(os.path.abspath(workbook_path))
+        return workbook is not None and workbook["hash"] == workbook_hash
+
+    def rows(self, workbook_path):
+        """Rows instantiated from the workbook: {row hash: {"paper": key, "individuals": [IRIs]}}."""
+        return self.workbooks.get(os.path.abspath(workbook_path), {}).get("rows", {})
+
+    def update_workbook(self, workbook_path, workbook_hash, rows):
+        self.workbooks[os.path.abspath(workbook_path)] = {"hash": workbook_hash, "rows": rows}
+
+    def remove_workbook(self, workbook_path):
+        return self.workbooks.pop(os.path.abspath(workbook_path), {}).get("rows", {})
+
+    def missing_workbooks(self):
+        """Workbooks of the manifest which do not exist anymore."""
+        return [path for path in self.workbooks if not os.path.exists(path)]
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"version": MANIFEST_VERSION, "owl_file": self.owl_file_signature,
+                       "workbooks": self.workbooks}, file)
+        os.replace(tmp_path, self.path)
+
+
+class WorkbookDiff:
+    """Rows of a workbook to retract and to instantiate, compared to the previous run."""
+    def __init__(self, previous_rows, current_rows):
+        """
+        previous_rows: rows of the manifest, {row hash: {"paper": key, "individuals": [IRIs]}}
+        current_rows: (row hash, paper key) of each row of the workbook
+        """
+        current_hashes = {hash_ for hash_, paper in current_rows}
+        self.changed_papers = {paper for hash_, paper in current_rows if hash_ not in previous_rows}
+        self.changed_papers |= {row["paper"] for hash_, row in previous_rows.items() if hash_ not in current_hashes}
+        self.retracted_rows = {hash_: row for hash_, row in previous_rows.items() if row["paper"] in self.changed_papers}
+        self.kept_rows = {hash_: row for hash_, row in previous_rows.items()
+                          if row["paper"] not in self.changed_papers and hash_ in current_hashes}
+
+    def is_changed(self, paper):
+        return paper in self.changed_papers
+
+    def retracted_individuals(self):
+        return [iri for row in self.retracted_rows.values() for iri in row["individuals"]]
+
+
+class EntityTracker:
+    """Finds the individuals created in a world since a given point, from the rdf:type triples added."""
+    def __init__(self, world):
+        self.world = world
+
+    def start(self):
+        return self.world.graph.execute("SELECT COALESCE(MAX(rowid), 0) FROM objs").fetchone()[0]
+
+    def created_since(self, start):
+        """IRIs of the individuals typed since start (the value returned by self.start())."""
+        created = self.world.graph.execute(
+            "SELECT DISTINCT resources.iri FROM objs JOIN resources ON resources.storid = objs.s "
+            "WHERE objs.rowid > ? AND objs.p = ? AND objs.s > 0",
+            (start, or2.rdf_type)
+        )
+        return [iri for (iri,) in created if isinstance(self.world[iri], or2.Thing)]
+
+
+def retract_individuals(world, iris):
+    """
+    Destroys the individuals of iris, except those still referred to by other individuals
+    (e.g. an author or a LULC class shared with other papers), and the ones they refer to.
+    Returns the number of individuals destroyed.
+    """
+    graph = world.graph
+    candidates = {}
+    for iri in set(iris):
+        entry = graph.execute("SELECT storid FROM resources WHERE iri=?", (iri,)).fetchone()
+        if entry is not None:
+            candidates[entry[0]] = iri
+    kept = set()
+    to_check = list(candidates)
+    while to_check:
+        storid = to_check.pop()
+        if storid in kept:
+            continue
+        referrers = {s for (s,) in graph.execute("SELECT s FROM objs WHERE o=? AND p!=?", (storid, or2.rdf_type))}
+        if any(referrer in kept or referrer not in candidates for referrer in referrers):
+            kept.add(storid)
+            #what a kept individual refers to is kept too
+            to_check.extend(o for (o,) in graph.execute("SELECT o FROM objs WHERE s=?", (storid,)) if o in candidates)
+    destroyed = 0
+    for storid, iri in candidates.items():
+        if storid not in kept:
+            entity = world[iri]
+            if entity is not None:
+                or2.destroy_entity(entity)
+                destroyed += 1
+    return destroyed
@@ -1,5 +1,6 @@
 import os
-import sys
+import argparse
+import logging
 import numpy as np
 import pandas as pd
 import requests
@@ -7,32 +8,237 @@ import html  # To handle HTML entities in abstracts
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 import re
+import json
 import time
+import urllib.parse
 import xml.etree.ElementTree as ET # Import ElementTree
-from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from response_cache import ResponseCache, DEFAULT_CACHE_DIR
+from geocoding import GeocodeMemo, Gazetteer, PlaceChecker
+from http_session import HttpSession, DEFAULT_TIMEOUT, DEFAULT_RETRIES
+from incremental import content_hash
+from run_report import run_report, configure_logging
+from replay import Fixtures
+from author_registry import AuthorRegistry, author_key
+from workbook_writer import changed_cells, write_cells, save_patch
+
+logger = logging.getLogger("metadata_enrichment")
 
 # Initialize the Nominatim geocoder
 geolocator = Nominatim(user_agent="affiliation_splitter")
+# Nominatim accepts at most one request per second
+NOMINATIM_DELAY = 1
+last_nominatim_request = 0
+# multiprocessing.Value holding the time of the last Nominatim request, shared by the
+# worker processes of owl_filler --jobs (see share_nominatim_clock)
+nominatim_clock = None
 
-def geocode_address(address):
+# Memo and gazetteer answering the geocoding requests before Nominatim, created on first use
+place_checker = None
+
+# Cache of the responses of Crossref, DOAJ, arXiv and ORCID, created on first use
+response_cache = None
+
+# Authors already resolved (first name and split affiliation), by ORCID or name, created on first use
+author_registry = None
+
+# Pooled session shared by all the requests to the web services, with rate limits and retries
+http_session = HttpSession()
+
+# Record or replay of the responses of the web services (see configure_fixtures), None to query them
+fixtures = None
+
+# Responses fetched concurrently by prefetch_metadata, waiting to be used by the enrichment
+prefetched_responses = {}
+
+# Number of DOIs resolved by each Crossref batch request
+CROSSREF_BATCH_SIZE = 50
+
+# "Paper metadata" columns that each source can fill
+CROSSREF_FIELDS = ["Title", "type of publication", "journal", "Year", "Keywords", "Abstract",
+                   "number of citations", "Authors", "Affiliation Name", "Affiliation Address"]
+DOAJ_FIELDS = ["Title", "Abstract", "Keywords"]
+ARXIV_FIELDS = ["Title", "Abstract", "Authors"]
+
+def configure_cache(cache_dir=DEFAULT_CACHE_DIR, refresh=False, **kwargs):
+    """
+    Opens the response cache stored in cache_dir.
+    If refresh is True, the cached responses are ignored and replaced.
+    """
+    global response_cache
+    response_cache = ResponseCache(cache_dir, refresh=refresh, **kwargs)
+    return response_cache
+
+def configure_authors(cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    """
+    Opens the registry of the authors resolved by the previous runs, stored in cache_dir.
+    If refresh is True, they are resolved again. With fixtures (see configure_fixtures),
+    the authors resolved from recorded or replayed responses are not saved in cache_dir.
+    """
+    global author_registry
+    author_registry = AuthorRegistry(cache_dir, refresh=refresh, persist=fixtures is None)
+    return author_registry
+
+def configure_http(timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, **kwargs):
+    """
+    Replaces the HTTP session by one with the given timeout (in seconds) and number of retries.
+    rate_scale can divide the rate limits between several processes.
+    """
+    global http_session
+    if fixtures is not None:
+        kwargs.setdefault("transport", fixtures.transport())
+    http_session = HttpSession(timeout=timeout, retries=retries, **kwargs)
+    return http_session
+
+def configure_fixtures(record=None, replay=None, server=None, latency=0, error_rate=0, seed=None):
+    """
+    Records the responses of the web services and of the geocoder in the fixture file record,
+    or answers the requests from the fixture file replay, or from the fixture server at the URL server,
+    with latency seconds of delay and a share error_rate of failed requests (see replay.py).
+    Must be called before configure_http, configure_geocoder and configure_authors.
+    """
+    global fixtures
+    fixtures = Fixtures(record, replay, server, latency, error_rate, seed)
+    return fixtures
+
+def cached_get(source, key, url, headers=None):
+    """
+    GET request on url, served from the response cache when the same key
+    was already queried to the same source.
+    Returns a requests.Response, so that raise_for_status, json and content can be used as usual.
+    """
+    if (source, key) in prefetched_responses:
+        return prefetched_responses[(source, key)]
+    if response_cache is None:
+        configure_cache()
+    cached = response_cache.get(source, key)
+    if cached is not None:
+        return make_response(*cached, url)
+    response = http_session.get(url, headers=headers)
+    response_cache.put(source, key, response.status_code, response.content)
+    return response
+
+def make_response(status_code, content, url):
+    """Builds a requests.Response from a stored status code and body."""
+    response = requests.models.Response()
+    response.status_code = status_code
+    response._content = content
+    response.url = url
+    return response
+
+def fetch_crossref_batch(dois):
     """
-    Tries to geocode the address using Nominatim API.
-    Returns True if the address is valid, otherwise False.
+    Resolves several DOIs with a single request to Crossref /works?filter=doi:...,doi:...
+    Each record found is stored as if it was the response of /works/{doi}, in the
+    response cache and in prefetched_responses, so that crossref_record uses it unchanged.
+    Returns the DOIs found.
     """
-    time.sleep(1)  # Add a delay of 1 second between requests
+    url = "https://api.crossref.org/works?" + urllib.parse.urlencode({
+        "filter": ",".join(f"doi:{doi}" for doi in dois),
+        "rows": len(dois),
+    })
+    response = http_session.get(url)
+    response.raise_for_status()
+    found = set()
+    for item in response.json().get('message', {}).get('items', []):
+        key = item.get('DOI', '').lower()
+        content = json.dumps({"status": "ok", "message-type": "work", "message": item}).encode()
+        response_cache.put("crossref", key, 200, content)
+        prefetched_responses[("crossref", key)] = make_response(200, content, f"https://api.crossref.org/works/{key}")
+        found.add(key)
+    return found
+
+def prefetch_crossref_batches(dois):
+    """
+    Gathers the DOIs (normalized, see paper_rows) which are not in the response cache,
+    and resolves them with Crossref batch requests of CROSSREF_BATCH_SIZE DOIs.
+    The DOIs not found in the batches (e.g. not registered by Crossref) are queried one by one later.
+    """
+    if response_cache is None:
+        configure_cache()
+    unresolved = []
+    for doi in dois:
+        key = doi.lower()
+        if ("crossref", key) in prefetched_responses or key in unresolved:
+            continue
+        cached = response_cache.get("crossref", key)
+        if cached is not None:
+            prefetched_responses[("crossref", key)] = make_response(*cached, f"https://api.crossref.org/works/{key}")
+        elif "," not in key:#a comma would split the filter
+            unresolved.append(key)
+
+    found = set()
+    for start in range(0, len(unresolved), CROSSREF_BATCH_SIZE):
+        chunk = unresolved[start:start+CROSSREF_BATCH_SIZE]
+        try:
+            found |= fetch_crossref_batch(chunk)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Error fetching Crossref batch: {e}")
+    if unresolved:
+        logger.info(f"Crossref batches: {len(found)} of {len(unresolved)} DOIs resolved in {-(-len(unresolved)//CROSSREF_BATCH_SIZE)} requests")
+
+def configure_geocoder(cache_dir=DEFAULT_CACHE_DIR, gazetteer_paths=(), refresh=False):
+    """
+    Opens the memo of the geocoded addresses stored in cache_dir,
+    and loads the gazetteer files (GeoNames .txt dumps or Natural Earth .csv tables) if any.
+    """
+    global place_checker
+    gazetteer = Gazetteer.from_files(gazetteer_paths) if gazetteer_paths else None
+    online_geocode = fixtures.geocoder(nominatim_geocode) if fixtures is not None else nominatim_geocode
+    place_checker = PlaceChecker(GeocodeMemo(cache_dir, refresh=refresh), gazetteer, online_geocode)
+    return place_checker
+
+def nominatim_geocode(address):
+    """
+    Geocodes the address using Nominatim API.
+    Returns True if the address is found, False if not, and None if the request failed.
+    """
+    wait_for_nominatim()
     try:
-        location = geolocator.geocode(address)
+        location = geolocator.geocode(address, timeout=10)
         return location is not None
     except (GeocoderTimedOut, GeocoderServiceError):
-        return False
+        return None
+
+def share_nominatim_clock(clock):
+    """Uses the multiprocessing.Value clock to space the Nominatim requests of several processes."""
+    global nominatim_clock
+    nominatim_clock = clock
+
+def wait_for_nominatim():
+    """Waits until NOMINATIM_DELAY seconds have passed since the previous Nominatim request."""
+    global last_nominatim_request
+    if nominatim_clock is None:
+        delay = NOMINATIM_DELAY - (time.time() - last_nominatim_request)
+        if delay > 0:
+            time.sleep(delay)
+        last_nominatim_request = time.time()
+    else:
+        with nominatim_clock.get_lock():
+            delay = NOMINATIM_DELAY - (time.time() - nominatim_clock.value)
+            if delay > 0:
+                time.sleep(delay)
+            nominatim_clock.value = time.time()
+
+def geocode_address(address):
+    """
+    Tries to geocode the address, from the memo of the addresses already checked,
+    the gazetteer, and finally Nominatim API.
+    Returns True if the address is valid, False if not, and None if the geocoder failed.
+    """
+    if place_checker is None:
+        configure_geocoder()
+    return place_checker.is_place(address)
 
 def separate_affiliation(affiliation):
     """
     Separates the affiliation into two parts:
     1. Affiliation Name: The name of the research team and university.
     2. Affiliation Address: The address part, validated via geocoding.
+    Also returns whether the geocoder failed on one of the parts tried, the split being then possibly incomplete.
     """
-    print(affiliation)
+    logger.debug(f"Affiliation: {affiliation}")
     affiliation = affiliation.replace(";", " ")
     parts = affiliation.split(',')
 
@@ -41,23 +247,26 @@ def separate_affiliation(affiliation):
                                       r"lab|laboratory|division|research|unit|corporation)", re.IGNORECASE)
 
     # Try to separate based on geocoding the latter part of the affiliation
+    failed = False
     for i in range(1, len(parts)):
         potential_address = ','.join(parts[i:]).strip()
         potential_name = ','.join(parts[:i]).strip()
         # Check if the potential address contains any keywords typically found in a name
         if not name_keywords_pattern.search(potential_address):
-            if geocode_address(potential_address):
-                return potential_name, potential_address
+            found = geocode_address(potential_address)
+            if found:
+                return potential_name, potential_address, failed
+            failed = failed or found is None
 
     # If geocoding fails, return the full affiliation as name and empty address
-    return affiliation, ""
+    return affiliation, "", failed
 
 def get_orcid_data(orcid_id):
     url = f"https://pub.orcid.org/v3.0/{orcid_id}/person"
     headers = {'Accept': 'application/json'}
 
     try:
-        response = requests.get(url, headers=headers)
+        response = cached_get("orcid", orcid_id, url, headers=headers)
         response.raise_for_status()
         data = response.json()
 
@@ -95,203 +304,443 @@ def map_publication_type(crossref_type):
     }
     return type_mapping.get(crossref_type, "other")
 
-def fetch_crossref_metadata(doi, excel_ontology_file, index):
+def resolve_author(author):
+    """
+    Returns the first name, affiliation name and affiliation address of a Crossref author.
+    If the first name is abbreviated or the affiliation lacks an address, they are completed with ORCID.
+    An author is resolved once, and then found in the author registry by ORCID (or by name),
+    as long as it comes with the same Crossref affiliation.
+    """
+    if author_registry is None:
+        configure_authors()
+    first_name = author.get('given', '')
+    last_name = author.get('family', '')
+    ORCID = author.get('ORCID', '')
+    affiliation = author.get('affiliation', [{'name': ''}])
+    affiliation_text = affiliation[0].get('name', '') if affiliation else None
+    key = author_key(first_name, last_name, ORCID)
+    if key is not None:
+        resolved = author_registry.get(key, affiliation_text)
+        if resolved is not None:
+            return resolved
+    orcid_lookups = affiliation_splits = 0
+    #An author resolved with a failed lookup is not recorded, so that it is resolved again next time
+    failed = False
+    if affiliation_text is None:
+        affiliation_name = ""
+        affiliation_address = ""
+    else:
+        affiliation_name, affiliation_address, failed = separate_affiliation(affiliation_text)
+        affiliation_splits += 1
+
+    #if ORCID provided and if it lacks one part of the affiliation or if the first name is abbreviated, use orcid API to complete the information
+    if ORCID and (not first_name or '.' in first_name or not affiliation_address):
+        logger.debug(f"ORCID: {ORCID}")
+        orcid_id = ORCID.split('/')[-1]
+        orcid_answer = author_registry.get_orcid(orcid_id)
+        if orcid_answer is None:
+            orcid_answer = get_orcid_data(orcid_id)
+            orcid_lookups += 1
+            #A failed lookup is not recorded, so that it is tried again
+            if orcid_answer == (None, None):
+                failed = True
+            else:
+                author_registry.put_orcid(orcid_id, *orcid_answer)
+        orcid_first_name, orcid_affiliation = orcid_answer
+        first_name = orcid_first_name if (orcid_first_name and (not first_name or '.' in first_name)) else first_name
+        if orcid_affiliation and not affiliation_address:
+            affiliation_name, affiliation_address, orcid_split_failed = separate_affiliation(orcid_affiliation)
+            failed = failed or orcid_split_failed
+            affiliation_splits += 1
+
+    resolved = (first_name, affiliation_name, affiliation_address)
+    if key is not None and not failed:
+        author_registry.put(key, affiliation_text, resolved, orcid_lookups, affiliation_splits)
+    return resolved
+
+def metadata_record(**fields):
+    """Record of the metadata found for a DOI: the fields with a value, the empty ones being left out."""
+    return {field: value for field, value in fields.items() if value is not None and value != ""}
+
+def crossref_record(doi, missing=CROSSREF_FIELDS):
+    """
+    Returns the metadata of a DOI found by Crossref, as a record {field: value}
+    (empty if the request failed). The authors are only resolved if one of their
+    fields (Authors, Affiliation Name, Affiliation Address) is missing.
+    """
     url = f"https://api.crossref.org/works/{doi}"
     try:
-        response = requests.get(url)
+        response = cached_get("crossref", doi.lower(), url)
         response.raise_for_status()  # Raise exception for HTTP errors
         data = response.json().get('message', {})
-
-        # Extracting metadata
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Title")] or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Title")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Title")] = data.get('title', [''])[0]
-        if not excel_ontology_file.loc[index, ("Paper metadata", "type of publication")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "type of publication")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "type of publication")] = map_publication_type( data.get('type', '') )
-        if not excel_ontology_file.loc[index, ("Paper metadata", "journal")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "journal")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "journal")] = data.get('container-title', [''])[0]
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Year")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Year")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Year")] = data.get('created', {}).get('date-parts', [['']])[0][0]
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Keywords")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Keywords")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Keywords")] =  " ; ".join(data.get('subject', []))
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Abstract")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Abstract")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Abstract")] = html.unescape(data.get('abstract', '')) if data.get('abstract') else ''
-        if not excel_ontology_file.loc[index, ("Paper metadata", "number of citations")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "number of citations")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "number of citations")] = data.get('is-referenced-by-count', '')
-
-        # Extracting authors
-        authors_data = data.get('author', [])
-        authors_names = []
-        authors_affiliation_names = []
-        authors_affiliation_addresses = []
-        for author in authors_data:
-            first_name = author.get('given', '')
-            last_name = author.get('family', '')
-            ORCID = author.get('ORCID', '')
-            affiliation = author.get('affiliation', [{'name': ''}])
-            if not affiliation or len(affiliation)==0:
-                affiliation_name = ""
-                affiliation_address = ""
-            else:
-                affiliation_name, affiliation_address = separate_affiliation(affiliation[0].get('name', ''))
-
-            #if ORCID provided and if it lacks one part of the affiliation or if the first name is abbreviated, use orcid API to complete the information
-            if ORCID and (not first_name or '.' in first_name or not affiliation_address):
-                print(ORCID)
-                orcid_first_name, orcid_affiliation = get_orcid_data(ORCID.split('/')[-1])
-                first_name = orcid_first_name if (orcid_first_name and (not first_name or '.' in first_name)) else first_name
-                if orcid_affiliation and not affiliation_address:
-                    affiliation_name, affiliation_address = separate_affiliation(orcid_affiliation)
-
-            authors_affiliation_names.append(affiliation_name)
-            authors_affiliation_addresses.append(affiliation_address)
-            print(first_name, last_name)
-            if first_name:
-                authors_names.append(last_name+", "+first_name)
-            else:
-                authors_names.append(last_name)
-        print(authors_names)
-        print(" and ".join(authors_names))
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Authors")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Authors")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Authors")] = " and ".join(authors_names)
-            print("crossref1", excel_ontology_file.loc[index, ("Paper metadata", "Authors")])
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Affiliation Name")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Affiliation Name")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Affiliation Name")] = " ; ".join(authors_affiliation_names)
-        if not excel_ontology_file.loc[index, ("Paper metadata", "Affiliation Address")]  or pd.isna(excel_ontology_file.loc[index, ("Paper metadata", "Affiliation Address")]):
-            excel_ontology_file.loc[index, ("Paper metadata", "Affiliation Address")] = " ; ".join(authors_affiliation_addresses)
-        return excel_ontology_file
-
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching DOI data: {e}")
-        return excel_ontology_file
-
-def fetch_doaj_metadata(doi, excel_ontology_file, index):
-    """
-    Fetch metadata from the DOAJ API and update the Excel ontology file.
-    Only updates fields that are currently empty.
-    """
+        logger.error(f"Error fetching DOI data: {e}")
+        return {}
+
+    # Extracting metadata
+    record = metadata_record(**{
+        "Title": data.get('title', [''])[0],
+        "type of publication": map_publication_type(data.get('type', '')),
+        "journal": data.get('container-title', [''])[0],
+        "Year": data.get('created', {}).get('date-parts', [['']])[0][0],
+        "Keywords": " ; ".join(data.get('subject', [])),
+        "Abstract": html.unescape(data.get('abstract', '')) if data.get('abstract') else '',
+        "number of citations": data.get('is-referenced-by-count', ''),
+    })
+    if not set(missing).intersection(["Authors", "Affiliation Name", "Affiliation Address"]):
+        return record
+
+    # Extracting authors
+    authors_names = []
+    authors_affiliation_names = []
+    authors_affiliation_addresses = []
+    for author in data.get('author', []):
+        last_name = author.get('family', '')
+        first_name, affiliation_name, affiliation_address = resolve_author(author)
+
+        authors_affiliation_names.append(affiliation_name)
+        authors_affiliation_addresses.append(affiliation_address)
+        logger.debug(f"Author: {first_name} {last_name}")
+        if first_name:
+            authors_names.append(last_name+", "+first_name)
+        else:
+            authors_names.append(last_name)
+    logger.debug(f"Authors from Crossref: {' and '.join(authors_names)}")
+    record.update(metadata_record(**{
+        "Authors": " and ".join(authors_names),
+        "Affiliation Name": " ; ".join(authors_affiliation_names),
+        "Affiliation Address": " ; ".join(authors_affiliation_addresses),
+    }))
+    return record
+
+def doaj_record(doi):
+    """Returns the metadata of a DOI found by DOAJ, as a record {field: value} (empty if not found)."""
     doaj_url = f"https://doaj.org/api/v2/search/articles/doi:{doi}"
 
     try:
-        response = requests.get(doaj_url)
+        response = cached_get("doaj", doi.lower(), doaj_url)
         response.raise_for_status()
         data = response.json()
-
-        if data.get('total', 0) > 0:
-            article = data['results'][0]
-            title = article['bibjson'].get('title', '')
-            abstract = article['bibjson'].get('abstract', '')
-            keywords = article['bibjson'].get('keywords', [])
-
-            # Update the Excel file only if fields are empty
-            if not excel_ontology_file.loc[index, ("Paper metadata", "Title")]:
-                excel_ontology_file.loc[index, ("Paper metadata", "Title")] = title
-            if not excel_ontology_file.loc[index, ("Paper metadata", "Abstract")]:
-                excel_ontology_file.loc[index, ("Paper metadata", "Abstract")] = abstract
-            if not excel_ontology_file.loc[index, ("Paper metadata", "Keywords")]:
-                excel_ontology_file.loc[index, ("Paper metadata", "Keywords")] = " ; ".join(keywords)
-
-        return excel_ontology_file
-
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching from DOAJ: {e}")
-        return excel_ontology_file
-
-
-def fetch_arxiv_metadata(doi, excel_ontology_file, index):
-    """
-    Fetch metadata from the arXiv API and update the Excel ontology file.
-    Only updates fields that are currently empty.
-    """
+        logger.error(f"Error fetching from DOAJ: {e}")
+        return {}
+
+    if data.get('total', 0) == 0:
+        return {}
+    article = data['results'][0]
+    return metadata_record(**{
+        "Title": article['bibjson'].get('title', ''),
+        "Abstract": article['bibjson'].get('abstract', ''),
+        "Keywords": " ; ".join(article['bibjson'].get('keywords', [])),
+    })
+
+def arxiv_record(doi):
+    """Returns the metadata of a DOI found by arXiv, as a record {field: value} (empty if not found)."""
     arxiv_url = f"http://export.arxiv.org/api/query?search_query=doi:{doi}&max_results=1"
 
     try:
-        response = requests.get(arxiv_url)
+        response = cached_get("arxiv", doi.lower(), arxiv_url)
         response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error fetching from arXiv: {e}")
+        return {}
+
+    # Parse the XML response
+    root = ET.fromstring(response.content)
+
+    # Namespace for arXiv metadata
+    ns = {'arxiv': 'http://www.w3.org/2005/Atom'}
+
+    # Extract the entry
+    entry = root.find('arxiv:entry', ns)
+    if entry is None:
+        return {}
+    return metadata_record(**{
+        "Title": entry.find('arxiv:title', ns).text.strip() if entry.find('arxiv:title', ns) is not None else '',
+        "Abstract": entry.find('arxiv:summary', ns).text.strip() if entry.find('arxiv:summary', ns) is not None else '',
+        "Authors": " and ".join(author.text.strip() for author in entry.findall('arxiv:author/arxiv:name', ns)),
+    })
+
+def fetch_metadata_record(doi, missing):
+    """
+    Returns the record of a DOI from Crossref, completed by DOAJ and arXiv for the fields
+    of missing (the fields empty in the file) that Crossref does not provide.
+    """
+    record = crossref_record(doi, missing)
+    run_report.count("DOIs enriched")
+    #The other sources are only queried if they can fill an empty field
+    if (set(missing) - record.keys()).intersection(DOAJ_FIELDS):
+        record = {**doaj_record(doi), **record}
+        run_report.count("DOAJ lookups")
+    if (set(missing) - record.keys()).intersection(ARXIV_FIELDS):
+        record = {**arxiv_record(doi), **record}
+        run_report.count("arXiv lookups")
+    return record
+
+def is_empty(value):
+    return (not value) or pd.isna(value)
+
+def empty_cells(excel_ontology_file, fields):
+    """
+    Returns the fields of the "Paper metadata" block among fields which are columns of the
+    file, and the boolean array (rows x fields) of their cells which are empty (NaN or "").
+    """
+    fields = [field for field in fields if ("Paper metadata", field) in excel_ontology_file.columns]
+    block = excel_ontology_file.loc[:, [("Paper metadata", field) for field in fields]]
+    return fields, block.isna().to_numpy() | (block.to_numpy(dtype=object) == "")
 
-        # Parse the XML response
-        root = ET.fromstring(response.content)
-
-        # Namespace for arXiv metadata
-        ns = {'arxiv': 'http://www.w3.org/2005/Atom'}
-
-        # Extract the entry
-        entry = root.find('arxiv:entry', ns)
-
-        if entry is not None:
-            title = entry.find('arxiv:title', ns).text.strip() if entry.find('arxiv:title', ns) is not None else ''
-            abstract = entry.find('arxiv:summary', ns).text.strip() if entry.find('arxiv:summary', ns) is not None else ''
-            authors = [author.text.strip() for author in entry.findall('arxiv:author/arxiv:name', ns)]
-
-            # Update the Excel file only if fields are empty
-            if not excel_ontology_file.loc[index, ("Paper metadata", "Title")]:
-                excel_ontology_file.loc[index, ("Paper metadata", "Title")] = title
-            if not excel_ontology_file.loc[index, ("Paper metadata", "Abstract")]:
-                excel_ontology_file.loc[index, ("Paper metadata", "Abstract")] = abstract
-            if not excel_ontology_file.loc[index, ("Paper metadata", "Authors")]:
-                excel_ontology_file.loc[index, ("Paper metadata", "Authors")] = " and ".join(authors)
+def missing_fields(excel_ontology_file, dois, fields=CROSSREF_FIELDS):
+    """Returns, for each DOI of dois ({doi: rows}), the set of fields empty in one of its rows."""
+    fields, empty = empty_cells(excel_ontology_file, fields)
+    return {doi: {field for field, missing in zip(fields, empty[rows].any(axis=0)) if missing}
+            for doi, rows in dois.items()}
 
-        return excel_ontology_file
+#Columns rewritten by paper_rows with working values of the enrichment (normalized DOIs,
+#names of the papers without DOI), which are not written back to the Excel file
+WORKING_COLUMNS = [("Paper metadata", "doi")]
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching from arXiv: {e}")
-        return excel_ontology_file
+def filled_cells(original_excel_ontology_file, excel_ontology_file):
+    """Cells filled by the enrichment to write back to the Excel file (see changed_cells), the working columns being left out."""
+    return changed_cells(original_excel_ontology_file, excel_ontology_file, WORKING_COLUMNS)
 
-def enrich_metadata(excel_ontology_file):
+def paper_rows(excel_ontology_file, continued=False):
+    """
+    Normalizes the DOIs of the file, names the papers without DOI, and returns
+    the rows of each DOI ({doi: rows}) and the rows which continue the paper of the row above.
+    The row 0 is the guide row, or if continued, the last row of the previous chunk of the sheet.
+    """
+    doi_values = excel_ontology_file[("Paper metadata", "doi")].tolist()
+    titles = excel_ontology_file[("Paper metadata", "Title")].tolist()
+    dois = {}
+    same_paper = []
     for i in range(1, len(excel_ontology_file)):
-        doi = excel_ontology_file.loc[i, ("Paper metadata", "doi")]
-
-        if (doi=="") or pd.isna(doi):
+        doi = doi_values[i]
+        if is_empty(doi):
             #It is either the same paper as the row above, or a paper without doi
             #If there is a title which is not the same as above, or that it is the first row, we can suppose it is a paper without doi
-            title_i = excel_ontology_file.loc[i, ("Paper metadata", "Title")]
-
-            if (i==1) or ( not ((title_i=="") or pd.isna(title_i)) and (excel_ontology_file.loc[i-1, ("Paper metadata", "Title")]!=title_i)):
+            title_i = titles[i]
+            if (i==1 and not continued) or (not is_empty(title_i) and titles[i-1]!=title_i):
                 #It is an article without doi. Thus, we don't try to get the metatada
-                excel_ontology_file.loc[i, ("Paper metadata", "doi")] = "NoDoi_"+str(time.time())
+                #Named after its title (or its content), so that it keeps the same IRI on each run
+                no_doi_content = (title_i,) if not is_empty(title_i) else tuple(excel_ontology_file.loc[i].fillna(""))
+                doi_values[i] = "NoDoi_"+content_hash(*no_doi_content)
+                run_report.count("papers without DOI")
             else:
                 #It is likely to be the same article as above
-                #We may copy all the previous row paper metadata
-                excel_ontology_file.loc[i]["Paper metadata"] = excel_ontology_file.loc[i-1, "Paper metadata"]
-            continue
+                same_paper.append(i)
         else:
-            doi = doi.replace("https://doi.org/", "")
-            excel_ontology_file.loc[i, ("Paper metadata", "doi")] = doi
-        print("already existing names", excel_ontology_file.loc[i, ("Paper metadata", "Authors")])
-        excel_ontology_file = fetch_crossref_metadata(doi, excel_ontology_file, i)
-        print("crossref2", excel_ontology_file.loc[i, ("Paper metadata", "Authors")])
-        excel_ontology_file = fetch_doaj_metadata(doi, excel_ontology_file, i)
-        print("doaj", excel_ontology_file.loc[i, ("Paper metadata", "Authors")])
-        excel_ontology_file = fetch_arxiv_metadata(doi, excel_ontology_file, i)
-        print("arxiv", excel_ontology_file.loc[i, ("Paper metadata", "Authors")])
+            doi_values[i] = doi.replace("https://doi.org/", "")
+            dois.setdefault(doi_values[i], []).append(i)
+    excel_ontology_file[("Paper metadata", "doi")] = doi_values
+    return dois, same_paper
+
+def fill_paper_metadata(excel_ontology_file, rows, values):
+    """
+    Fills the empty cells of the "Paper metadata" block of rows with values, a DataFrame
+    with one row per row of rows and some of the fields of the block as columns, in one update.
+    The cells already filled, and the missing values (NaN), are left unchanged.
+    """
+    fields, empty = empty_cells(excel_ontology_file, values.columns)
+    if not rows or not fields:
+        return
+    columns = [("Paper metadata", field) for field in fields]
+    current = excel_ontology_file.loc[rows, columns].to_numpy(dtype=object)
+    new = values[fields].to_numpy(dtype=object)
+    fill = empty[rows] & pd.notna(new)
+    excel_ontology_file.loc[rows, columns] = np.where(fill, new, current)
+
+def crossref_provided_fields(data):
+    """Returns the fields that crossref_record fills from a Crossref message."""
+    provided = set()
+    if data.get('title', [''])[0]:
+        provided.add("Title")
+    if data.get('abstract'):
+        provided.add("Abstract")
+    if data.get('subject'):
+        provided.add("Keywords")
+    if data.get('author'):
+        provided.add("Authors")
+    return provided
+
+def orcid_needed(author):
+    """True if crossref_record will certainly query ORCID for this Crossref author."""
+    first_name = author.get('given', '')
+    if author_registry is not None and author_registry.has_orcid(author.get('ORCID', '').split('/')[-1]):
+        return False
+    return bool(author.get('ORCID')) and (not first_name or '.' in first_name or not author.get('affiliation'))
+
+def prefetch_doi(doi, source, missing):
+    """
+    Fetches the response of one source for one DOI, and stores it in prefetched_responses.
+    missing is the set of fields still empty for this DOI: it is updated with the Crossref response,
+    so that DOAJ and arXiv, fetched after it, are skipped when Crossref already provides all their fields.
+    Returns the ORCID ids of the authors of the Crossref response who need an ORCID lookup.
+    """
+    orcid_ids = []
+    try:
+        if source == "crossref":
+            response = cached_get("crossref", doi.lower(), f"https://api.crossref.org/works/{doi}")
+            prefetched_responses[("crossref", doi.lower())] = response
+            if response.status_code == 200:
+                data = response.json().get('message', {})
+                missing.difference_update(crossref_provided_fields(data))
+                for author in data.get('author', []):
+                    if orcid_needed(author):
+                        orcid_ids.append(author['ORCID'].split('/')[-1])
+        elif source == "doaj":
+            if missing.intersection(DOAJ_FIELDS):
+                url = f"https://doaj.org/api/v2/search/articles/doi:{doi}"
+                prefetched_responses[("doaj", doi.lower())] = cached_get("doaj", doi.lower(), url)
+        elif source == "arxiv":
+            if missing.intersection(ARXIV_FIELDS):
+                url = f"http://export.arxiv.org/api/query?search_query=doi:{doi}&max_results=1"
+                prefetched_responses[("arxiv", doi.lower())] = cached_get("arxiv", doi.lower(), url)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        #The request will be done again by the serial enrichment, which reports the error
+        logger.warning(f"Error prefetching {source} data for {doi}: {e}")
+    return orcid_ids
+
+def prefetch_orcid(orcid_id):
+    """Fetches the ORCID record of an author, and stores it in prefetched_responses."""
+    url = f"https://pub.orcid.org/v3.0/{orcid_id}/person"
+    try:
+        prefetched_responses[("orcid", orcid_id)] = cached_get("orcid", orcid_id, url, headers={'Accept': 'application/json'})
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Error prefetching ORCID data for {orcid_id}: {e}")
+
+def prefetch_metadata(missing, jobs):
+    """
+    Queries Crossref, DOAJ and arXiv concurrently for all the DOIs of missing ({doi: fields empty
+    in the file}, and ORCID for the authors who need it), with jobs threads and a rate limit per host.
+    The DOIs are queried in parallel. DOAJ, arXiv and ORCID are queried once the Crossref
+    response of the DOI is there, DOAJ and arXiv being skipped if their fields are already
+    filled in the file or provided by Crossref, so that the requests do not depend on the timing.
+    """
+    if response_cache is None:
+        configure_cache()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        #Each DOI gets its own set, updated by its Crossref response
+        crossref_futures = {}
+        for doi, fields in missing.items():
+            fields = set(fields)
+            crossref_futures[executor.submit(prefetch_doi, doi, "crossref", fields)] = (doi, fields)
+        orcid_ids = set()
+        for future in as_completed(crossref_futures):
+            doi, fields = crossref_futures[future]
+            for source in ["doaj", "arxiv"]:
+                executor.submit(prefetch_doi, doi, source, fields)
+            for orcid_id in future.result():
+                if orcid_id not in orcid_ids:
+                    orcid_ids.add(orcid_id)
+                    executor.submit(prefetch_orcid, orcid_id)
+    logger.info(f"{len(prefetched_responses)} responses prefetched for {len(missing)} DOIs")
+
+def enrich_metadata(excel_ontology_file, jobs=1, continued=False):
+    """
+    Completes the "Paper metadata" of each row from its DOI.
+    Each DOI is looked up once, the sources returning a record of the metadata found, and
+    the empty cells of the block are then filled from the records in a single update;
+    the rows continuing the paper of the row above are completed from it in a second one.
+    The DOIs not cached yet are first resolved with Crossref batch requests.
+    If continued, the row 0 is the last row of the previous chunk instead of the guide row (see paper_rows).
+    If jobs > 1, the web services are queried concurrently beforehand, so that the
+    result is the same as with jobs=1.
+    """
+    dois, same_paper = paper_rows(excel_ontology_file, continued)
+    missing = missing_fields(excel_ontology_file, dois)
+    prefetch_crossref_batches(dois)
+    if jobs > 1:
+        prefetch_metadata(missing, jobs)
+    records = {doi: fetch_metadata_record(doi, missing[doi]) for doi in dois}
+    rows = [row for rows in dois.values() for row in rows]
+    fill_paper_metadata(excel_ontology_file, rows,
+                        pd.DataFrame([records[doi] for doi, rows in dois.items() for row in rows],
+                                     columns=CROSSREF_FIELDS, dtype=object))
+
+    #Rows of the same paper as above: the cells still empty are copied from the first row of the paper
+    first_rows = {}
+    for i in same_paper:
+        first_rows[i] = first_rows.get(i-1, i-1)
+    if first_rows:
+        block = excel_ontology_file["Paper metadata"]
+        fill_paper_metadata(excel_ontology_file, list(first_rows),
+                            block.loc[list(first_rows.values())].reset_index(drop=True))
+    prefetched_responses.clear()
     return excel_ontology_file
 
 #%%
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Completes the metadata of the papers of an Excel file from their DOI.")
+    parser.add_argument("input", nargs="?", default="LULC_Ontology_example.xlsm", help="Excel file to enrich")
+    parser.add_argument("output", nargs="?", default=None, help="Output Excel file (default: the input file)")
+    parser.add_argument("--patch", default=None, help="Save the cells filled in this patch file (JSON) instead of writing the Excel file, see workbook_writer.py")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Folder of the response cache")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cached responses and query the web services again")
+    parser.add_argument("--gazetteer", action="append", default=[], help="GeoNames (.txt) or Natural Earth (.csv) file of place names, to geocode offline (can be repeated)")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of concurrent requests to the web services")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT[1], help="Timeout of the requests to the web services, in seconds")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Number of retries of a failed request")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the messages logged")
+    parser.add_argument("--report", default=None, help="JSON file in which the report of the run (timings, counters, cache and requests statistics) is saved")
+    fixture_group = parser.add_mutually_exclusive_group()
+    fixture_group.add_argument("--record", default=None, help="Fixture file in which the responses of the web services are recorded")
+    fixture_group.add_argument("--replay", default=None, help="Fixture file from which the requests are answered, without network access")
+    fixture_group.add_argument("--replay-server", default=None, help="URL of a fixture server (python replay.py FIXTURES) answering the requests")
+    parser.add_argument("--latency", type=float, default=0, help="With --replay, delay added to each request, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="With --replay, share of the requests failing")
+    parser.add_argument("--seed", type=int, default=None, help="With --replay, seed of the injected errors")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
     #input path
-    if len(sys.argv)>1:
-        excel_ontology_file_path = os.path.join(sys.argv[1])
-    else:
-        excel_ontology_file_path = os.path.join(
-                "LULC_Ontology_example.xlsm"
-                )
+    excel_ontology_file_path = os.path.join(args.input)
 
     #output path
-    if len(sys.argv)>2:
-        output_path = os.path.join(sys.argv[1])
+    if args.output is not None:
+        output_path = os.path.join(args.output)
     else:
         output_path = excel_ontology_file_path
 
-    excel_ontology_file = pd.read_excel(excel_ontology_file_path, dtype=str, sheet_name="ontology_instanciation", header=[0, 1])
-    excel_ontology_file = enrich_metadata(excel_ontology_file)
-
-    #saving the excel file with the same display
-    wb = load_workbook(file_path, keep_vba=True)
-    ws = wb["ontology_instanciation"]
-
-    # write values manually (preserves layout)
-    for i, row in enumerate(df.values, start=3):
-        for j, val in enumerate(row, start=1):
-            ws.cell(row=i, column=j, value=val)
-
-    wb.save(output_path)
+    if args.record or args.replay or args.replay_server:
+        configure_fixtures(args.record, args.replay, args.replay_server, args.latency, args.error_rate, args.seed)
+        #The cached responses are ignored, so that every request is recorded or replayed
+        args.refresh = True
+    configure_cache(args.cache_dir, refresh=args.refresh)
+    configure_http((DEFAULT_TIMEOUT[0], args.timeout), args.retries, pool_size=max(10, args.jobs))
+    configure_geocoder(args.cache_dir, args.gazetteer, refresh=args.refresh)
+    configure_authors(args.cache_dir, refresh=args.refresh)
+
+    with run_report.stage("read"):
+        #object columns, as the enrichment fills some cells with numbers (year, number of citations)
+        excel_ontology_file = pd.read_excel(excel_ontology_file_path, dtype=str, sheet_name="ontology_instanciation", header=[0, 1]).astype(object)
+    run_report.expect_rows(len(excel_ontology_file) - 1)
+    original_excel_ontology_file = excel_ontology_file.copy()
+    with run_report.stage("enrichment"):
+        excel_ontology_file = enrich_metadata(excel_ontology_file, jobs=args.jobs)
+    run_report.rows_done(len(excel_ontology_file) - 1)
+
+    #Only the cells filled by the enrichment are written, the layout and the macros are kept
+    cells = filled_cells(original_excel_ontology_file, excel_ontology_file)
+    run_report.count("cells filled", len(cells))
+    with run_report.stage("write"):
+        if args.patch is not None:
+            save_patch(args.patch, excel_ontology_file_path, cells)
+            logger.info(f"{len(cells)} cells filled, saved in {args.patch}")
+        else:
+            write_cells(excel_ontology_file_path, output_path, cells)
+            logger.info(f"{len(cells)} cells filled in {output_path}")
+
+    response_cache.report()
+    http_session.report()
+    place_checker.report()
+    author_registry.report()
+    run_report.log_summary()
+    if args.report is not None:
+        run_report.add_section("response cache", response_cache.summary())
+        run_report.add_section("requests", http_session.summary())
+        run_report.add_section("geocoding", place_checker.summary())
+        run_report.add_section("authors", author_registry.summary())
+        if fixtures is not None:
+            run_report.add_section("fixtures", fixtures.summary())
+        run_report.save(args.report)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory indexes of an ontology, built once and kept up to date during the
+instantiation, to avoid searching the whole quadstore for each lookup.
+"""
+import os
+import json
+import logging
+import urllib.parse
+
+logger = logging.getLogger("ontology_index")
+
+LULC_CLASS_PREFIX = "lulc_class_"
+
+
+def lulc_class_key(class_name):
+    """Normalized class name, as used in the IRIs of the LULC classes."""
+    return class_name.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+class LULCClassIndex:
+    """Index of the LULC classes (lulc_class, lu_class, lc_class) of an ontology by normalized name."""
+    def __init__(self, onto):
+        self.onto = onto
+        self.classes = {}
+        for lulc_class in onto["lulc_class"].instances():
+            name = urllib.parse.unquote(lulc_class.name)
+            if name.startswith(LULC_CLASS_PREFIX):
+                self.classes.setdefault(name[len(LULC_CLASS_PREFIX):], lulc_class)
+
+    def get(self, class_name):
+        """Returns the LULC class named class_name, or None."""
+        return self.classes.get(lulc_class_key(class_name))
+
+    def create(self, onto_class, class_name):
+        """Creates (or gets, if it exists) the LULC class named class_name, of type onto_class, and indexes it."""
+        key = lulc_class_key(class_name)
+        lulc_class = individual_index(self.onto).get(onto_class.name, urllib.parse.quote(LULC_CLASS_PREFIX + key))
+        self.classes[key] = lulc_class
+        return lulc_class
+
+
+#One index per loaded ontology
+lulc_class_indexes = {}
+
+def lulc_class_index(onto):
+    """Returns the LULCClassIndex of onto, built on first use."""
+    if onto not in lulc_class_indexes:
+        lulc_class_indexes[onto] = LULCClassIndex(onto)
+    return lulc_class_indexes[onto]
+
+
+class IndividualIndex:
+    """
+    Individuals of an ontology by class name and IRI, as created (or got) by onto[class_name](iri).
+    For an existing individual, owlready2 checks its classes on each call, which queries the
+    quadstore: the individuals shared by many rows (authors, journals, keywords, algorithms,
+    tools, LULC classes...) are only built once for each class here.
+    """
+    def __init__(self, onto):
+        self.onto = onto
+        self.individuals = {}
+        self.reused = 0
+
+    def get(self, class_name, iri):
+        """Returns onto[class_name](iri), built on first use."""
+        key = (class_name, iri)
+        individual = self.individuals.get(key)
+        if individual is None:
+            individual = self.individuals[key] = self.onto[class_name](iri)
+        else:
+            self.reused += 1
+        return individual
+
+
+#One index per loaded ontology
+individual_indexes = {}
+
+def individual_index(onto):
+    """Returns the IndividualIndex of onto, built on first use."""
+    if onto not in individual_indexes:
+        individual_indexes[onto] = IndividualIndex(onto)
+    return individual_indexes[onto]
+
+
+def schema_key(name):
+    """Case-insensitive key of a class name, the spaces being replaced by underscores."""
+    return str(name).strip().replace(" ", "_").lower()
+
+
+class SchemaIndex:
+    """
+    Names of the classes of the ontology used to type the individuals, computed once:
+    for each category, a map from the case-insensitive key of a class name to the class name.
+    """
+    #category: root class of the category
+    CATEGORIES = {
+        "process": "process",
+        "nature": "spatial_data",
+        "extent": "geographic_extent",
+        "tool": "tool",
+        "operator": "operator",
+        "nomenclature": "nomenclature",
+    }
+
+    def __init__(self, names):
+        self.names = names
+
+    @classmethod
+    def from_ontology(cls, onto):
+        names = {}
+        for category, root in cls.CATEGORIES.items():
+            names[category] = {}
+            for classe in onto[root].descendants():
+                names[category][schema_key(classe.name)] = classe.name
+                if category == "tool" and classe.name.endswith("_tool"):
+                    #The Excel file uses "annotation" for annotation_tool, etc.
+                    names[category].setdefault(schema_key(classe.name[:-len("_tool")]), classe.name)
+        return cls(names)
+
+    def name(self, category, name):
+        """Returns the name of the class of category matching name (case-insensitive), or None."""
+        if name is None:
+            return None
+        return self.names[category].get(schema_key(name))
+
+    def descendants(self, category):
+        """Returns the set of the names of the classes of category."""
+        return set(self.names[category].values())
+
+    def nomenclature_class_name(self, level, lu_or_lc):
+        """
+        Returns the name of the nomenclature class of level for "lu", "lc" or "lulc"
+        (e.g. level1_lu_nomenclature), or of the generic nomenclature class if this level is not defined.
+        """
+        kind = "mixed_lu_and_lc" if lu_or_lc == "lulc" else lu_or_lc
+        return (self.name("nomenclature", f"level{level}_{kind}_nomenclature")
+                or self.name("nomenclature", f"{kind}_nomenclature"))
+
+    def save(self, path, owl_file_path):
+        """Saves the index to path, with the signature of the ontology file it was built from."""
+        #Written to a temporary file first, as several worker processes may save it at the same time
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"owl_file": owl_file_signature(owl_file_path), "names": self.names}, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, owl_file_path):
+        """Loads the index saved at path, or returns None if it is missing or if the ontology file changed."""
+        try:
+            with open(path, encoding="utf-8") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if saved.get("owl_file") != owl_file_signature(owl_file_path) or set(saved.get("names", {})) != set(cls.CATEGORIES):
+            return None
+        return cls(saved["names"])
+
+
+def owl_file_signature(owl_file_path):
+    stat = os.stat(owl_file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+#One index per loaded ontology
+schema_indexes = {}
+
+def schema_index(onto):
+    """Returns the SchemaIndex of onto, built on first use."""
+    if onto not in schema_indexes:
+        schema_indexes[onto] = SchemaIndex.from_ontology(onto)
+    return schema_indexes[onto]
+
+def load_schema_index(onto, owl_file_path):
+    """
+    Returns the SchemaIndex of onto, loaded from the file saved next to owl_file_path
+    if the ontology file did not change since, and built and saved otherwise.
+    """
+    path = owl_file_path + ".schema.json"
+    index = SchemaIndex.load(path, owl_file_path)
+    if index is None:
+        index = SchemaIndex.from_ontology(onto)
+        try:
+            index.save(path, owl_file_path)
+        except OSError as e:
+            logger.warning(f"Cannot save the schema index: {e}")
+    schema_indexes[onto] = index
+    return index
@@ -5,17 +5,83 @@ Created on Fri Nov 24 11:58:31 2023
 @author: MCubaud
 """
 import os
+import argparse
+import logging
+import multiprocessing
+import functools
 import pandas as pd
 import owlready2  as or2
 import re
+import urllib.parse
 import pylatexenc.latex2text
 
-from metadata_enrichment import enrich_metadata
+from metadata_enrichment import enrich_metadata, configure_cache, configure_geocoder, configure_http, configure_fixtures, configure_authors, geocode_address, share_nominatim_clock
+from http_session import DEFAULT_TIMEOUT, DEFAULT_RETRIES
+from response_cache import DEFAULT_CACHE_DIR
+from ontology_index import lulc_class_indexes, individual_indexes, schema_index, load_schema_index, owl_file_signature
+from workbook_reader import iter_sheet_rows, iter_sheet_chunks, sheet_row_count, DEFAULT_CHUNK_SIZE
+from quadstore import open_quadstore, commit
+from serializers import FORMATS, SHARD_KEYS, shards_of_individuals, save_ontology, report_outputs
+from run_report import run_report, configure_logging
+from incremental import (content_hash, row_hash, file_hash, PaperKeys, RunManifest, WorkbookDiff,
+                         EntityTracker, retract_individuals)
+import cell_parser
+from row_records import prepare_rows
+from article_ir import ArticleIR, apply_article
+from bulk_loader import TripleBatch
+from cell_parser import (split_list, split_keywords, split_comma_list, parse_bracket_list,
+                         parse_named_value, parse_value_comment, parse_nomenclatures,
+                         parse_input_date, parse_class_values, parse_user_metric, get_group_hierarchy,
+                         parse_number, is_number, split_by_decimal_token, preparse_numbers)
 
 TRUE_VALUES = ["yes", "true", "1", "t", "y", "0b1", "√", "☑", "✔", "oui", "si"]
 FALSE_VALUES = ["", None, "no", "false", "0", "f", "n", "w", "non"]
 
+logger = logging.getLogger("owl_filler")
+
+#Quality metric columns, and the class of their assessments
+GLOBAL_QUALITY_METRICS = [
+    'OA',
+    'mF1',
+    'mIoU',
+    'kappa',
+    'global recall (producer accuracy)',
+    'global precision (user accuracy)'
+    ]
+GLOBAL_QUALITY_METRICS_TYPES = [
+    "overall_accuracy",
+    "f1_score",
+    "intersection_over_union",
+    "separated_kappa",
+    "producer_accuracy",
+    "user_accuracy"
+    ]
+PER_CLASS_QUALITY_METRICS = [
+    'per class binary accuracy',
+    'per class F1 score',
+    'per class IoU',
+    'per class recall (producer accuracy)',
+    'per class precision (user accuracy)'
+    ]
+PER_CLASS_QUALITY_METRICS_TYPES = [
+    "algorithm_quality_assessment",
+    "f1_score",
+    "intersection_over_union",
+    "producer_accuracy",
+    "user_accuracy"
+    ]
+USER_DEFINED_QUALITY_METRICS = "user defined algorithm quality assessment metrics"
+
+#Pool of processes parsing the rows into ArticleIRs (see configure_parse_pool), None to parse them in this process
+parse_pool = None
+
+#Dates recognized without pandas: a year, a year and a month, or a day, in ISO format
+DATE_PATTERN = re.compile(r"(19|20)\d{2}(-(0[1-9]|1[0-2])(-(0[1-9]|1\d|2[0-8]))?)?")
+
+@functools.lru_cache(maxsize=cell_parser.CACHE_SIZE)
 def is_date(string):
+    if DATE_PATTERN.fullmatch(string):
+        return True
     try:
         pd.to_datetime(string, errors='raise')
         return True
@@ -23,13 +89,65 @@ def is_date(string):
         return False
 
 def is_place_name(name):
-    geolocator = Nominatim(user_agent="place_checker")
-    try:
-        location = geolocator.geocode(name, timeout=10)
-        return location is not None
-    except GeocoderUnavailable:
-        print("error")
-        return False
+    #Shares the memo and the gazetteer of the affiliation splitting
+    return geocode_address(name)
+
+class MetricContext:
+    """
+    What the text qualifier of a metric value (e.g. "random forest: 0.8") can refer to in a row:
+    its algorithms, study areas and input datasets, with the lowercase text of their cells,
+    and their lowercase names to recognize an exact name without searching the text.
+    Built once for each row, the geocoder being only queried when nothing else matches.
+    places are the texts already geocoded, {text: is a place name}, or None to geocode them here:
+    the texts missing from places are then not place names, and recorded in unknown_places.
+    """
+    COLUMNS = {"algorithm": "algorithms", "study area": "Study Area name", "input": "input data names"}
+
+    def __init__(self, row, places=None):
+        self.texts = {kind: row.text(column).lower() for kind, column in self.COLUMNS.items()}
+        algorithms = [name for group in parse_grouped_field(row.get("algorithms", "")) for name in split_list(group)]
+        study_areas = row.split("Study Area name") if not row.isna("Study Area name") else ()
+        inputs = row.split("input data names") if not row.isna("input data names") else ()
+        self.names = {
+            "algorithm": {name.strip().lower() for name in algorithms},
+            "study area": {name.strip().lower() for name in study_areas},
+            "input": {name.strip().lower() for name in inputs},
+        }
+        self.places = places
+        self.unknown_places = set()
+
+    def refers_to(self, kind, label):
+        """Whether the lowercase label is (a part of) the cell of the algorithms, study areas or inputs."""
+        return label in self.names[kind] or label in self.texts[kind]
+
+    def resolve(self, label, text=None, special=()):
+        """
+        What the lowercase label refers to, in this order: "algorithm", "date", "study area",
+        one of the special labels, "input", "place", or None. text is the label as written, for
+        the dates and place names.
+        """
+        text = label if text is None else text
+        if self.refers_to("algorithm", label):
+            return "algorithm"
+        if is_date(text):
+            return "date"
+        if self.refers_to("study area", label):
+            return "study area"
+        if label in special:
+            return label
+        if self.refers_to("input", label):
+            return "input"
+        if self.is_place_name(text):
+            return "place"
+        return None
+
+    def is_place_name(self, text):
+        if self.places is None:
+            return is_place_name(text)
+        if text not in self.places:
+            self.unknown_places.add(text)
+            return False
+        return self.places[text]
 
 def decode_latex(latex_string):
     try:
@@ -40,235 +158,228 @@ def decode_latex(latex_string):
             decoded_string = pylatexenc.latex2text.latex2text(latex_string)
             return decoded_string
         except Exception as e2:
-          print("Error:", e, e2)
+          logger.warning(f"Cannot decode the LaTeX of {latex_string!r}: {e}, {e2}")
           return latex_string
 
 # --- Utility to parse grouped fields ---
 def parse_grouped_field(field):
     if pd.isna(field): return []
-    field = str(field).strip()
-    if field.startswith("{") and field.endswith("}"):
-        # Parse outermost groups
-        return [item.strip("{} ") for item in re.split(r"}\s*;\s*{", field[1:-1])]
-    else:
-        return [item.strip() for item in re.split(r"\s?;\s?", field)]
-
-def get_group_hierarchy(text):
-    elements = re.split(r"\s?;\s?", text)
-    group_numbers = []
-    current_group = 0
-    is_in_group = False
-    for element in elements:
-        group_numbers.append(current_group)
-        is_in_group = (
-             "(" in element or (is_in_group and ")" not in element)
-        )
-        if not is_in_group:
-            current_group += 1
-
-    return group_numbers
+    return list(cell_parser.parse_grouped_field(str(field)))
 
 
-def article_metadata(onto, row):
+def article_metadata(ir, row):
     doi = row["doi"]
-    article = onto["paper"](urllib.parse.quote(doi))
-    article.doi = doi
+    article = ir.create("paper", urllib.parse.quote(doi))
+    ir.article = article
+    ir.set(article, "doi", doi)
 
-    article.title = row["Title"]
-    article.label = row["Title"]
+    ir.set(article, "title", row["Title"])
+    ir.set(article, "label", row["Title"])
 
-    if not row.isna()["journal"]:
-        journal = onto[row["type of publication"]](urllib.parse.quote(
+    if not row.isna("journal"):
+        journal = ir.create(row["type of publication"], urllib.parse.quote(
             row["type of publication"]+
             "_"+
             row["journal"].replace(" ","_")
             ))
-        journal.namePublisher.append(row["journal"])
-        journal.label = row["journal"]
-        article.isPublishedIn.append(journal)
+        ir.append(journal, "namePublisher", row["journal"])
+        ir.set(journal, "label", row["journal"])
+        ir.append(article, "isPublishedIn", journal)
 
     #affiliations
     affiliation_instances = []
-    if not row.isna()["Affiliation Name"]:
-        list_affiliation_names = re.split(r"\s?;\s?", row["Affiliation Name"])
-        list_affiliation_addresses = re.split(r"\s?;\s?", row["Affiliation Address"])
+    if not row.isna("Affiliation Name"):
+        list_affiliation_names = row.split("Affiliation Name")
+        list_affiliation_addresses = row.split("Affiliation Address")
         for i, affiliation_name in enumerate(list_affiliation_names):
             if affiliation_name not in ["", " "]:
-                affiliation = onto["affiliation"](urllib.parse.quote(
+                affiliation = ir.create("affiliation", urllib.parse.quote(
                     affiliation_name.replace(" ","_").replace(",","")+"_"+
                     list_affiliation_addresses[i].replace(" ","_").replace(",","")
                     ))
-                affiliation.label = affiliation_name
-                affiliation.affiliationName.append(affiliation_name)
-                affiliation.affiliationAddress.append(list_affiliation_addresses[i])
+                ir.set(affiliation, "label", affiliation_name)
+                ir.append(affiliation, "affiliationName", affiliation_name)
+                ir.append(affiliation, "affiliationAddress", list_affiliation_addresses[i])
                 affiliation_instances.append(affiliation)
             else:
                 affiliation_instances.append(None)
 
-    if not row.isna()["Authors"]:
+    if not row.isna("Authors"):
         list_authors = row["Authors"].split(" and ")
         if len(affiliation_instances)==1:
             #Then we suppose all the authors have the same affiliation
             affiliation_instances = affiliation_instances * len(list_authors)
         for i, name_author in enumerate(list_authors):
             name_author = decode_latex(name_author)
-            print(name_author)
-            author = onto["author"](urllib.parse.quote(re.sub(r"\s?,\s?", "_", name_author)))
-            author.label = name_author
-            list_author_names = re.split(r"\s?,\s?", name_author)
+            logger.debug("Author: %s", name_author)
+            list_author_names = split_comma_list(name_author)
+            author = ir.create("author", urllib.parse.quote("_".join(list_author_names)))
+            ir.set(author, "label", name_author)
             if len(list_author_names)==1:
-                author.lastName = list_author_names[0]
+                ir.set(author, "lastName", list_author_names[0])
             elif len(list_author_names)==2:
                 if "." in list_author_names[1]:
                     #The order may not be what it is supposed to be
-                    author.firstName = list_author_names[0]
-                    author.lastName = list_author_names[1]
+                    ir.set(author, "firstName", list_author_names[0])
+                    ir.set(author, "lastName", list_author_names[1])
                 else:
-                    author.firstName = list_author_names[1]
-                    author.lastName = list_author_names[0]
+                    ir.set(author, "firstName", list_author_names[1])
+                    ir.set(author, "lastName", list_author_names[0])
             else:
                 name0 = list_author_names[0]
                 name1 = " ".join(list_author_names[1:])
                 if "." in name0:
-                    author.firstName = name0
-                    author.lastName = name1
+                    ir.set(author, "firstName", name0)
+                    ir.set(author, "lastName", name1)
                 else:
-                    author.firstName = name1
-                    author.lastName = name0
+                    ir.set(author, "firstName", name1)
+                    ir.set(author, "lastName", name0)
             if len(affiliation_instances)!=0:
                 if affiliation_instances[i] is not None:
-                    author.hasAffiliation.append(affiliation_instances[i])
-            article.hasAuthor.append(author)
+                    ir.append(author, "hasAffiliation", affiliation_instances[i])
+            ir.append(article, "hasAuthor", author)
 
-    if not row.isna()["Year"]:
-        article.year_date.append(int(row["Year"]))
+    if not row.isna("Year"):
+        ir.append(article, "year_date", int(row["Year"]))
 
-    if not row.isna()["Keywords"]:
+    if not row.isna("Keywords"):
     #separated on , or ; with optional whitespaces around
-        list_keywords = re.split("\s?;\s?|\s?,\s?", row["Keywords"])
+        list_keywords = split_keywords(row["Keywords"])
         for keyword_name in list_keywords:
-            keyword_name = keyword_name.strip()
-            keyword = onto["keyword"](urllib.parse.quote("keyword_"+keyword_name.replace(" ","_")))
-            keyword.label = keyword_name
-            article.hasKeyword.append(keyword)
+            keyword = ir.create("keyword", urllib.parse.quote("keyword_"+keyword_name.replace(" ","_")))
+            ir.set(keyword, "label", keyword_name)
+            ir.append(article, "hasKeyword", keyword)
 
-    if not row.isna()["Abstract"]:
-        article.abstract = row["Abstract"]
+    if not row.isna("Abstract"):
+        ir.set(article, "abstract", row["Abstract"])
     return article, doi
 
-def per_class_metric_with_extra_info(row, metric, metric_type, process, doi, onto):
-    # First split by study area blocks
-    study_area_blocks = re.findall(r"\{.*?\}", row.fillna("")[metric])
-    if not study_area_blocks:  # fallback to simple semicolon split
-        study_area_blocks = re.split(r"\s?;\s?", row.fillna("")[metric])
+def per_class_metric_with_extra_info(ir, row, context, metric, metric_type, process, doi):
+    # Blocks by study area, of "[context:]class:value" parts
+    # e.g. "{Fairfax: Non-residential: 0.78, ...}"
+    study_area_blocks = parse_class_values(row.text(metric))
 
     for j, block in enumerate(study_area_blocks):
-        # Remove enclosing braces if present
-        block = block.strip("{} ")
-        parts = [part.strip() for part in re.split(r",\s?", block)]
+        for part in block.unrecognized:
+            ir.log(logging.WARNING, f"Unrecognized format: {part}")
         context_entity = None  # could be study area, dataset, algorithm, date
-        # Try to detect the study area from the first part
-        # e.g. "Fairfax: Non-residential: 0.78"
-        for part in parts:
-            fields = [f.strip() for f in part.split(":")]
-
-            if len(fields) == 3:
-                context_label, class_name, value = fields
-            elif len(fields) == 2:
-                class_name, value = fields
-                context_label = None
-            else:
-                print(f"Unrecognized format: {part}")
-                continue
-
+        for context_label, class_name, value in block.values:
             # Disambiguate context_label (study area, dataset, etc.)
             if context_label:
                 context_label_lower = context_label.lower()
-                if context_label_lower in row.fillna("")["algorithms"].lower():
-                    context_entity = next(
-                        (algo for algo in process.hasAlgorithm if algo.label[0].lower() == context_label_lower),
-                        None
-                    )
-                elif is_date(context_label):
+                reference = context.resolve(context_label_lower, context_label)
+                if reference == "algorithm":
+                    #The algorithm and the study case are looked up when the row is applied
+                    context_entity = ("applyAccuracyAssessmentOn", ir.find(process, "hasAlgorithm", context_label_lower))
+                elif reference == "date":
                     context_entity = context_label
-                elif context_label_lower in row.fillna("")["Study Area name"].lower():
-                    context_entity = next(
-                        (sc for sc in process.hasStudyCase if context_label_lower in sc.label[0].lower()),
-                        None
-                    )
-                elif context_label_lower in row.fillna("")["input data names"].lower():
+                elif reference == "study area":
+                    context_entity = ("hasStudyCase", ir.find(process, "hasStudyCase", context_label_lower, contains=True))
+                elif reference == "input":
                     context_entity = context_label  # you can further resolve to dataset object
-                elif is_place_name(context_label):
+                elif reference == "place":
                     context_entity = context_label  # maybe a subregion string
                 else:
-                    print(f"Cannot disambiguate '{context_label}' — storing as comment.")
+                    ir.log(logging.WARNING, f"Cannot disambiguate '{context_label}' — storing as comment.")
 
             # Create metric
-            algo_qual_assessment = onto[metric_type](
-                metric.replace(" ", "_") + f"_{j}_{class_name}_{doi}_{int(time.time())}"
+            algo_qual_assessment = ir.create(metric_type,
+                metric.replace(" ", "_") + f"_{j}_{class_name}_{doi}_{content_hash(process.iri, context_label, value)}"
             )
 
             # Class and value
-            lulc_class = onto.search_one(iri = f'*lulc_class_{class_name.strip().lower().replace(" ", "_").replace("-", "_")}')
-            value = re.sub(r'(?<=\d),(?=\d)', '.', value)
-            value = eval(value.replace("%", "/100"))
-            algo_qual_assessment.assessedOnClass.append(lulc_class)
-            algo_qual_assessment.value.append(value)
+            lulc_class = ir.find_lulc_class(class_name)
+            ir.append(algo_qual_assessment, "assessedOnClass", lulc_class)
+            if is_number(value):
+                ir.append(algo_qual_assessment, "value", parse_number(value))
+            else:
+                logger.warning(f"Cannot read the value '{value}' of {metric}")
 
             # Link context_entity
-            if hasattr(context_entity, "label"):  # likely an ontology object
-                if context_entity in process.hasAlgorithm:
-                    algo_qual_assessment.applyAccuracyAssessmentOn.append(context_entity)
-                elif context_entity in process.hasStudyCase:
-                    algo_qual_assessment.hasStudyCase.append(context_entity)
+            if isinstance(context_entity, tuple):  # an algorithm or a study case of the process
+                name, found = context_entity
+                ir.append_found(algo_qual_assessment, name, found)
             elif isinstance(context_entity, str):
                 if is_date(context_entity):
-                    algo_qual_assessment.year_date.append(context_entity)
+                    ir.append(algo_qual_assessment, "year_date", context_entity)
                 elif context_entity in row["input data names"]:
-                    algo_qual_assessment.hasValidationDataset.append(context_entity)
+                    ir.append(algo_qual_assessment, "hasValidationDataset", context_entity)
                 else:
-                    algo_qual_assessment.comment = context_entity
+                    ir.set(algo_qual_assessment, "comment", context_entity)
 
 
-            process.hasAccuracyAlgorithm.append(algo_qual_assessment)
+            ir.append(process, "hasAccuracyAlgorithm", algo_qual_assessment)
 
 
+def metric_text_reference(ir, metric_text, reference, algo_qual_assessment, process):
+    """Links a global metric to the dataset or the place its text refers to (see MetricContext.resolve), or keeps the text as comment."""
+    if reference == "input":
+        ir.log(logging.INFO, f"{metric_text} is assumed to be the dataset")
+        ir.append_matches(algo_qual_assessment, "hasValidationDataset", process, "hasInput", metric_text)
+    elif reference == "place":
+        ir.log(logging.INFO, f"{metric_text} is assumed to be a subpart of the study area")
+        #we have to create an object study area
+        study_case = ir.create("geographic_extent", urllib.parse.quote(
+            "study_case_"+metric_text.replace(" ","_")
+            ))
+        ir.set(study_case, "label", metric_text)
+        ir.append(algo_qual_assessment, "hasStudyCase", study_case)
+    else:
+        ir.log(logging.WARNING, f"Can't guess what '{metric_text}' refers to")
+        ir.set(algo_qual_assessment, "comment", metric_text)
+
+
+def parse_article(row, schema, places=None):
+    """
+    Parses a row into the ArticleIR of its instantiation (see article_ir.py), without touching
+    the ontology: it can run in another process. schema is the SchemaIndex of the ontology.
+    If places is given, the texts are not geocoded (see MetricContext): the texts missing from it
+    are recorded in the unknown_places of the ArticleIR, and the row must be parsed again once they are.
+    If the row cannot be parsed, the error is raised when the ArticleIR is applied.
+    """
+    ir = ArticleIR()
+    try:
+        article_operations(ir, row, schema, places)
+    except Exception as e:
+        ir.fail(e)
+    return ir
 
 def create_article(onto, row):
-    print(row)
-    article, doi = article_metadata(onto, row)
+    """Instantiates the article of a row in onto, and returns it."""
+    return apply_article(onto, parse_article(row, schema_index(onto)))
+
+def article_operations(ir, row, schema, places=None):
+    logger.debug("Row:\n%s", row)
+    article, doi = article_metadata(ir, row)
 
 
     #Process
     #We suppose there is one and only one process by row
-    defined_processes = [classe.name for classe in onto["process"].descendants()]
-    if row["process type"].strip() in defined_processes:
-        process = onto[row["process type"].strip()](urllib.parse.quote(
-            "process_"+
-            row["process type"].strip().replace(" ","_")+
-            "_"+doi
-            ))
-    else:
-        print(f"Unknown process type {row['process type']}")
-        process = onto["process"](urllib.parse.quote(
-            "process_"+
-            row["process type"].strip().replace(" ","_")+
-            "_"+doi
-            ))
-    process.label = f'{row["process type"].strip()} {row["Title"]}'
-    print("\n________________\n",process.label,"\n________________\n")
+    process_class_name = schema.name("process", row["process type"])
+    if process_class_name is None:
+        logger.warning(f"Unknown process type {row['process type']}")
+        process_class_name = "process"
+    process = ir.create(process_class_name, urllib.parse.quote(
+        "process_"+
+        row["process type"].strip().replace(" ","_")+
+        "_"+doi
+        ))
+    ir.process = process
+    process_label = f'{row["process type"].strip()} {row["Title"]}'
+    ir.set(process, "label", process_label)
+    logger.info(f"Process: {process_label}")
 
     # --- Procedure ---
-    if not row.isna()["procedure"]:
+    if not row.isna("procedure"):
         list_procedure = [p.strip() for p in row["procedure"].split(";")]
         procedure_instances = []
         for i, procedure_name in enumerate(list_procedure):
-            procedure_instance = onto["procedure"](urllib.parse.quote(
+            procedure_instance = ir.create("procedure", urllib.parse.quote(
                 "procedure_" + procedure_name.replace(" ","_") + "_" + doi
             ))
-            procedure_instance.label = procedure_name
-            procedure_instance.stepNumber.append(i + 1)
-            process.hasProcedure.append(procedure_instance)
+            ir.set(procedure_instance, "label", procedure_name)
+            ir.append(procedure_instance, "stepNumber", i + 1)
+            ir.append(process, "hasProcedure", procedure_instance)
             procedure_instances.append(procedure_instance)
     else:
         procedure_instances = []
@@ -279,17 +390,17 @@ def create_article(onto, row):
     algorithms = parse_grouped_field(row.get("algorithms", ""))
     if len(algorithms) == len(procedure_instances):  # Match per step
         for i, algo_group in enumerate(algorithms):
-            for algorithm_name in [a.strip() for a in re.split(r"\s?;\s?", algo_group) if a.strip()]:
-                algorithm = onto["algorithm"](urllib.parse.quote(algorithm_name.replace(" ","_")))
-                algorithm.label = algorithm_name
-                procedure_instances[i].hasAlgorithm.append(algorithm)
-                process.hasAlgorithm.append(algorithm)  # optional global link
+            for algorithm_name in [a.strip() for a in split_list(algo_group) if a.strip()]:
+                algorithm = ir.create("algorithm", urllib.parse.quote(algorithm_name.replace(" ","_")))
+                ir.set(algorithm, "label", algorithm_name)
+                ir.append(procedure_instances[i], "hasAlgorithm", algorithm)
+                ir.append(process, "hasAlgorithm", algorithm)  # optional global link
     else:  # Global fallback
-        for algorithm_name in re.split(r"\s?;\s?", str(row.get("algorithms", ""))):
+        for algorithm_name in split_list(str(row.get("algorithms", ""))):
             if algorithm_name.strip():
-                algorithm = onto["algorithm"](urllib.parse.quote(algorithm_name.replace(" ","_")))
-                algorithm.label = algorithm_name
-                process.hasAlgorithm.append(algorithm)
+                algorithm = ir.create("algorithm", urllib.parse.quote(algorithm_name.replace(" ","_")))
+                ir.set(algorithm, "label", algorithm_name)
+                ir.append(process, "hasAlgorithm", algorithm)
 
     # --- Tools ---
     tool_names = parse_grouped_field(row.get("tool used names", ""))
@@ -304,355 +415,303 @@ def create_article(onto, row):
 
     if len(tool_names) == len(procedure_instances):  # Match per step
         for i in range(len(procedure_instances)):
-            tools_step = [t.strip() for t in re.split(r"\s;\s?", tool_names[i]) if t.strip()]
-            types_step = [t.strip() for t in re.split(r"\s;\s?", tool_types[i])] if tool_types[i] else []
-            collab_step = [t.strip() for t in re.split(r"\s;\s?", tool_collab[i])] if tool_collab[i] else []
+            tools_step = [t.strip() for t in split_list(tool_names[i]) if t.strip()]
+            types_step = [t.strip() for t in split_list(tool_types[i])] if tool_types[i] else []
+            collab_step = [t.strip() for t in split_list(tool_collab[i])] if tool_collab[i] else []
 
             for j, tool_name in enumerate(tools_step):
                 tool_type = types_step[j] if j < len(types_step) else "tool"
                 collab = collab_step[j] if j < len(collab_step) else None
 
-                onto_class = onto[tool_type] if tool_type in ["annotation", "storage", "validation"] else onto["tool"]#(No class other tool)
+                tool_class_name = schema.name("tool", tool_type) or "tool"#(No class other tool)
                 label = tool_name if tool_type in ["annotation", "storage", "validation", "other"] else f"{tool_name} ({tool_type})"
 
-                tool = onto_class(urllib.parse.quote(f"tool_{tool_name.replace(' ','_')}"))
-                tool.label = label
+                tool = ir.create(tool_class_name, urllib.parse.quote(f"tool_{tool_name.replace(' ','_')}"))
+                ir.set(tool, "label", label)
                 if collab and collab.lower() in TRUE_VALUES:
-                    tool.collaborativeTool.append(True)
+                    ir.append(tool, "collaborativeTool", True)
 
-                procedure_instances[i].isUsingTool.append(tool)
-                process.isUsingTool.append(tool)  # optional global link
+                ir.append(procedure_instances[i], "isUsingTool", tool)
+                ir.append(process, "isUsingTool", tool)  # optional global link
     else:
-        for i, tool_name in enumerate(re.split(r"\s?;\s?", str(row.get("tool used names", "")))):
+        for i, tool_name in enumerate(split_list(str(row.get("tool used names", "")))):
             if tool_name.strip():
                 tool_type = tool_types[i] if i < len(tool_types) else "tool"
                 collab = tool_collab[i] if i < len(tool_collab) else None
 
-                onto_class = onto[tool_type] if tool_type in ["annotation", "storage", "validation"] else onto["tool"]
+                tool_class_name = schema.name("tool", tool_type) or "tool"
                 label = tool_name if tool_type in ["annotation", "storage", "validation", "other"] else f"{tool_name} ({tool_type})"
 
-                tool = onto_class(urllib.parse.quote(f"tool_{tool_name.replace(' ','_')}"))
-                tool.label = label
+                tool = ir.create(tool_class_name, urllib.parse.quote(f"tool_{tool_name.replace(' ','_')}"))
+                ir.set(tool, "label", label)
                 if collab and collab.lower() in TRUE_VALUES:
-                    tool.collaborativeTool.append(True)
+                    ir.append(tool, "collaborativeTool", True)
 
-                process.isUsingTool.append(tool)
+                ir.append(process, "isUsingTool", tool)
 
 
     #INPUT DATA
-    defined_natures = [classe.name for classe in onto["spatial_data"].descendants()]
-
     list_inputs_is_training = None
     list_inputs_instances = []
-    if not row.isna()["input data names"]:
+    if not row.isna("input data names"):
         #Names
-        list_inputs = re.split(r"\s?;\s?", row["input data names"])
+        list_inputs = row.split("input data names")
         #Natures
-        if not row.isna()["input data natures and resolution"]:
-            list_inputs_nature = re.split(r"\s?;\s?", row["input data natures and resolution"])
-            list_inputs_resolution = []
-            for i in range(len(list_inputs_nature)):
-                if ":" in list_inputs_nature[i]:
-                    list_inputs_nature[i], resolution = re.split(r"\s?:\s?", list_inputs_nature[i])
-                    list_inputs_resolution.append(resolution)
-                else:
-                    list_inputs_resolution.append(None)
+        if not row.isna("input data natures and resolution"):
+            #"nature : resolution" or "nature"
+            natures_and_resolutions = [parse_named_value(nature) for nature in row.split("input data natures and resolution")]
+            list_inputs_nature = [nature for nature, resolution in natures_and_resolutions]
+            list_inputs_resolution = [resolution for nature, resolution in natures_and_resolutions]
         else:
             list_inputs_nature = [None] * len(list_inputs)
             list_inputs_resolution = [None] * len(list_inputs)
         #Date
-        if not row.isna()["input data date"]:
-                list_inputs_date = re.split(r"\s?;\s?",
-                                           (row["input data date"]).lower()
-                                           )
+        if not row.isna("input data date"):
+                list_inputs_date = [parse_input_date(date) for date in row.split("input data date")]
         else:
             list_inputs_date = [None] * len(list_inputs)
         #Is VGI?
-        if not row.isna()["Input  is VGI "]:
-            list_inputs_vgi = re.split(r"\s?;\s?",
-                                       (row["Input  is VGI "]).lower()
-                                       )
+        if not row.isna("Input is VGI"):
+            list_inputs_vgi = row.split("Input is VGI")
         else:
             list_inputs_vgi = ["None"] * len(list_inputs)
         #raster/vecter
-        if not row.isna()["input data raster/points/lines/polygon"]:
-            list_inputs_raster_vector = re.split("\s?;\s?",
-                                       (row["input data raster/points/lines/polygon"]).lower()
-                                       )
+        if not row.isna("input data raster/points/lines/polygon"):
+            list_inputs_raster_vector = row.split("input data raster/points/lines/polygon")
         else:
             list_inputs_raster_vector = [""] * len(list_inputs)
 
         #training, validation
-        if not row.isna()["input is training, validation, both or neither"]:
-            list_inputs_is_training = re.split(r"\s?;\s?",
-                                       (row["input is training, validation, both or neither"]).lower()
-                                       )
+        if not row.isna("input is training, validation, both or neither"):
+            list_inputs_is_training = row.split("input is training, validation, both or neither")
         else:
             list_inputs_is_training = [""] * len(list_inputs)
         #training size
-        if not row.isna()["training dataset size"]:
-            list_inputs_training_size = re.split(r"\s?;\s?",
-                                       row["training dataset size"]
-                                       )
+        if not row.isna("training dataset size"):
+            list_inputs_training_size = row.split("training dataset size")
         else:
             list_inputs_training_size = []
         #validation size
-        if not row.isna()["validation dataset size"]:
-            list_inputs_validation_size = re.split(r"\s?;\s?",
-                                       row["validation dataset size"]
-                                       )
+        if not row.isna("validation dataset size"):
+            list_inputs_validation_size = row.split("validation dataset size")
         else:
             list_inputs_validation_size = []
-        print(list_inputs_nature)
+        logger.debug("Natures of the inputs: %s", list_inputs_nature)
         index_training_dataset = 0
         index_validation_dataset = 0
         for i, input_name in enumerate(list_inputs):
-            if list_inputs_nature[i].replace(" ", "_").lower() in [nature.lower() for nature in defined_natures]:
-                n_defined_nature = [nature.lower() for nature in defined_natures].index(list_inputs_nature[i].replace(" ", "_").lower())
-                nature = defined_natures[n_defined_nature]
-            else:
-                nature = "data"#Is it possible that non spatial data can be used ?
-            print(nature)
-            input_instance = onto[nature](urllib.parse.quote(
+            nature = schema.name("nature", list_inputs_nature[i]) or "data"#Is it possible that non spatial data can be used ?
+            logger.debug("Nature: %s", nature)
+            input_instance = ir.create(nature, urllib.parse.quote(
                 input_name.replace(" ","_") + "_" + nature + "_" + doi
                 ))
-            input_instance.is_a.append(onto["input_data"])
-            input_instance.label = input_name
+            ir.is_a(input_instance, "input_data")
+            ir.set(input_instance, "label", input_name)
             if list_inputs_resolution[i] is not None:
-                input_instance.resolution.append(list_inputs_resolution[i])
+                ir.append(input_instance, "resolution", list_inputs_resolution[i])
             if list_inputs_vgi[i] is not None:
-                input_instance.volunteered_geographic_information.append(
+                ir.append(input_instance, "volunteered_geographic_information",
                     list_inputs_vgi[i].lower() in TRUE_VALUES
                     )
             if len(list_inputs_raster_vector)>i and list_inputs_raster_vector[i] is not None:
-                input_instance.pixelGeometricRepresentation.append(
+                ir.append(input_instance, "pixelGeometricRepresentation",
                     ("raster" in list_inputs_raster_vector[i]) or ("pixel" in list_inputs_raster_vector[i])
                     )
-                input_instance.pointGeometricRepresentation.append(
+                ir.append(input_instance, "pointGeometricRepresentation",
                     "point" in list_inputs_raster_vector[i]
                     )
-                input_instance.polygonGeometricRepresentation.append(
+                ir.append(input_instance, "polygonGeometricRepresentation",
                     "polygon" in list_inputs_raster_vector[i]
                     )
-                input_instance.lineGeometricRepresentation.append(
+                ir.append(input_instance, "lineGeometricRepresentation",
                     "line" in list_inputs_raster_vector[i]
                     )
-            if len(list_inputs_date)>i and list_inputs_date[i] is not None and list_inputs_date[i]!='':
-                if "period" in list_inputs_date[i]:
-                    period = onto["period"](urllib.parse.quote(list_inputs_date[i].strip().replace(" ", "_").replace("-", "_").replace(",", "_")))
-                    dates = re.split(r"\s?,\s?|\s?-\s?", list_inputs_date[i].replace("period(", "").replace(")", "") )
-                    period.year_date.extend(dates)
-                    input_instance.interval_date.append(
+            if len(list_inputs_date)>i and list_inputs_date[i] is not None and list_inputs_date[i].text!='':
+                input_date = list_inputs_date[i]
+                if input_date.period is not None:
+                    period = ir.create("period", urllib.parse.quote(input_date.text.strip().replace(" ", "_").replace("-", "_").replace(",", "_")))
+                    ir.extend(period, "year_date", input_date.period)
+                    ir.append(input_instance, "interval_date",
                         period
                         )
-                if "[" in list_inputs_date[i]:
-                    dates = re.split(r"\s?,\s?", list_inputs_date[i].replace("[", "").replace("]", "") )
-                    input_instance.year_date.extend(dates)
-                elif list_inputs_date[i].isnumeric():
-                    input_instance.year_date.append(int(list_inputs_date[i]))
+                if input_date.years is not None:
+                    ir.extend(input_instance, "year_date", input_date.years)
+                elif input_date.year is not None:
+                    ir.append(input_instance, "year_date", input_date.year)
 
-            process.hasInput.append(input_instance)
+            ir.append(process, "hasInput", input_instance)
             list_inputs_instances.append(input_instance)
             if list_inputs_is_training[i] in ["training", "both"]:
-                input_instance.is_a.append(onto["training_dataset"])
-                process.hasTrainingDataset.append(input_instance)
+                ir.is_a(input_instance, "training_dataset")
+                ir.append(process, "hasTrainingDataset", input_instance)
                 if(len(list_inputs_training_size)>index_training_dataset):
-                    input_instance.datasetSize.append( list_inputs_training_size[index_training_dataset] )
+                    ir.append(input_instance, "datasetSize", list_inputs_training_size[index_training_dataset])
                 else:
-                    print("It lacks a training dataset size")
+                    logger.warning(f"{input_name}: it lacks a training dataset size")
                 index_training_dataset +=1
 
             if list_inputs_is_training[i] in ["validation", "both"]:
-                input_instance.is_a.append(onto["validation_dataset"])
-                process.hasValidationDataset.append(input_instance)
+                ir.is_a(input_instance, "validation_dataset")
+                ir.append(process, "hasValidationDataset", input_instance)
                 if(len(list_inputs_validation_size)>index_validation_dataset):
-                    input_instance.datasetSize.append( list_inputs_validation_size[index_validation_dataset] )
+                    ir.append(input_instance, "datasetSize", list_inputs_validation_size[index_validation_dataset])
                 else:
-                    print("It lacks a validation dataset size")
+                    logger.warning(f"{input_name}: it lacks a validation dataset size")
                 index_validation_dataset +=1
-            print(nature)
             if nature in ['land_use', 'land_cover', 'land_use_land_cover', 'building']:
-                if not row.isna()["if classification, nomenclature classes"] or not row.isna()["if classification, nomenclature level"]:
-                    if row.isna()["if classification, nomenclature level"]:
+                if not row.isna("if classification, nomenclature classes") or not row.isna("if classification, nomenclature level"):
+                    if row.isna("if classification, nomenclature level"):
                         #we have to infer it by counting the pipes "|" in "if classification, nomenclature classes"
                         number_nomenclatures = row["if classification, nomenclature classes"].count("|") + 1
                         levels = [1]*number_nomenclatures#we suppose that they are all 1 level nomenclatures
-                        print(levels)
+                        logger.debug("Nomenclature levels: %s", levels)
                     else:
-                        levels = re.split(r"\s?;\s?", row.fillna("")["if classification, nomenclature level"])
-                        print(levels)
+                        levels = row.split("if classification, nomenclature level")
+                        logger.debug("Nomenclature levels: %s", levels)
                         number_nomenclatures = len(levels)
                     lu_or_lc = {"land_use":"lu", "land_cover":"lc", "land_use_land_cover":"lulc", "building":"lu"}[nature]
-                    if row.isna()["if classification, nomenclature name"]:
+                    if row.isna("if classification, nomenclature name"):
                         nomenclature_names = [f"{doi}_{lu_or_lc}_nomenclature_level_{levels[k]}_{k}" for k in range(number_nomenclatures)]
                     else:
-                        nomenclature_names = re.split(r"\s?;\s?",  row.fillna("")["if classification, nomenclature name"])
+                        nomenclature_names = row.split("if classification, nomenclature name")
                         nomenclature_names = [name if name!="" else f"{doi}_{lu_or_lc}_nomenclature_level_{levels[k]}" for k, name in enumerate(nomenclature_names)]
-                    nomenclature_classes_groups = re.split(r"\s?\|\s?", row["if classification, nomenclature classes"])
-                    print(nomenclature_classes_groups)
+                    nomenclature_classes_groups = parse_nomenclatures(row["if classification, nomenclature classes"])
+                    logger.debug("Nomenclature classes: %s", nomenclature_classes_groups)
                     #We suppose that the nomenclature is hierarchical if there are two nomenclatures with increasing level
                     hierarchical_nomenclature = ( number_nomenclatures>1 and (int(levels[0])+1 == int(levels[1])) )
                     all_classes = []
                     for k in range(number_nomenclatures):
                         level = levels[k]
                         nomenclature_name = nomenclature_names[k]
-                        print(nomenclature_name, f"level{level}_{'mixed_lu_and_lc' if lu_or_lc == 'lulc' else lu_or_lc}_nomenclature")
-                        nomenclature_instance = onto[f"level{level}_{'mixed_lu_and_lc' if lu_or_lc == 'lulc' else lu_or_lc}_nomenclature"](urllib.parse.quote(
+                        nomenclature_class_name = schema.nomenclature_class_name(level, lu_or_lc)
+                        logger.debug("Nomenclature %s: %s", nomenclature_name, nomenclature_class_name)
+                        nomenclature_instance = ir.create(nomenclature_class_name, urllib.parse.quote(
                             nomenclature_name.replace(" ", "_") + "_" + doi
                             ))
-                        input_instance.hasNomenclature.append(nomenclature_instance)
-                        nomenclature_instance.label = nomenclature_name
+                        ir.append(input_instance, "hasNomenclature", nomenclature_instance)
+                        ir.set(nomenclature_instance, "label", nomenclature_name)
                         all_classes.append([])
-                        nomenclature_k_classes = re.split(r"\s?;\s?", nomenclature_classes_groups[k].replace("(", "").replace(")", "") )
-                        if hierarchical_nomenclature and k>0:
-                            group_hierarchy = get_group_hierarchy(nomenclature_classes_groups[k])
+                        nomenclature_k_classes = nomenclature_classes_groups[k].classes
+                        group_hierarchy = nomenclature_classes_groups[k].groups
                         for class_number, class_name in enumerate(nomenclature_k_classes):
-                            class_instance = onto[f"{lu_or_lc}_class"](urllib.parse.quote(
-                                "lulc_class_"+class_name.strip().lower().replace(" ", "_").replace("-", "_")))
-                            class_instance.label = class_name
-                            nomenclature_instance.hasLULCClass.append(class_instance)
+                            class_instance = ir.lulc_class(f"{lu_or_lc}_class", class_name)
+                            ir.set(class_instance, "label", class_name)
+                            ir.append(nomenclature_instance, "hasLULCClass", class_instance)
                             if hierarchical_nomenclature and k>0:
                                 mother_class = all_classes[k-1][group_hierarchy[class_number]]
-                                class_instance.isALandUseOrLandCoverSubclassOf.append(mother_class)
+                                ir.append(class_instance, "isALandUseOrLandCoverSubclassOf", mother_class)
                             all_classes[k].append(class_instance)
 
-    all_classes = [nomenclature.hasLULCClass for nomenclature in list(set([nomenclature for input_instance in process.hasInput for nomenclature in input_instance.hasNomenclature]))]
     #OUTPUT DATA
-    if not row.isna()["output data names"]:
+    if not row.isna("output data names"):
         #Names
-        list_outputs = re.split(r"\s?;\s?", row["output data names"])
+        list_outputs = row.split("output data names")
         #Natures
-        if not row.isna()["output data natures and resolution"]:
-            list_outputs_nature = re.split(r"\s?;\s?", row["output data natures and resolution"])
-            list_outputs_resolution = []
-            for i in range(len(list_outputs_nature)):
-                if ":" in list_outputs_nature[i]:
-                    list_outputs_nature[i], resolution = re.split(r"\s?:\s?", list_outputs_nature[i])
-                    list_outputs_resolution.append(resolution)
-                else:
-                    list_outputs_resolution.append(None)
+        if not row.isna("output data natures and resolution"):
+            #"nature : resolution" or "nature"
+            natures_and_resolutions = [parse_named_value(nature) for nature in row.split("output data natures and resolution")]
+            list_outputs_nature = [nature for nature, resolution in natures_and_resolutions]
+            list_outputs_resolution = [resolution for nature, resolution in natures_and_resolutions]
         else:
             list_outputs_nature = [None] * len(list_outputs)
+            list_outputs_resolution = [None] * len(list_outputs)
         #raster/vector
-        if not row.isna()["output data raster/points/lines/polygon"]:
-            list_outputs_raster_vector = re.split(r"\s?;\s?",
-                                       row["output data raster/points/lines/polygon"]
-                                       )
+        if not row.isna("output data raster/points/lines/polygon"):
+            list_outputs_raster_vector = row.split("output data raster/points/lines/polygon")
         else:
             list_outputs_raster_vector = [""] * len(list_outputs)
 
 
         for i, output_name in enumerate(list_outputs):
-            nature_i = list_outputs_nature[i]
-            if nature_i.replace(" ", "_").lower() not in [nature.lower() for nature in defined_natures]:
-                nature_i = "data"
-            else:
-                n_defined_nature = [nature.lower() for nature in defined_natures].index(nature_i.replace(" ", "_").lower())
-                nature_i = defined_natures[n_defined_nature]
-            output_instance = onto[nature_i](urllib.parse.quote(
+            nature_i = schema.name("nature", list_outputs_nature[i]) or "data"
+            output_instance = ir.create(nature_i, urllib.parse.quote(
                 output_name.replace(" ","_") + "_" + nature_i + "_" + doi
                 ))
-            output_instance.is_a.append(onto["output_data"])
-            output_instance.label = output_name
+            ir.is_a(output_instance, "output_data")
+            ir.set(output_instance, "label", output_name)
             if list_outputs_resolution[i] is not None:
-                output_instance.resolution.append(list_outputs_resolution[i])
-            output_instance.pixelGeometricRepresentation.append(
+                ir.append(output_instance, "resolution", list_outputs_resolution[i])
+            ir.append(output_instance, "pixelGeometricRepresentation",
                 "raster" in list_outputs_raster_vector[i]
                 )
-            output_instance.pointGeometricRepresentation.append(
+            ir.append(output_instance, "pointGeometricRepresentation",
                 "points" in list_outputs_raster_vector[i]
                 )
-            output_instance.polygonGeometricRepresentation.append(
+            ir.append(output_instance, "polygonGeometricRepresentation",
                 "polygon" in list_outputs_raster_vector[i]
                 )
-            output_instance.lineGeometricRepresentation.append(
+            ir.append(output_instance, "lineGeometricRepresentation",
                 "lines" in list_outputs_raster_vector[i]
                 )
-            process.hasOutput.append(output_instance)
+            ir.append(process, "hasOutput", output_instance)
 
 
     #operator
-    if not row.isna()["operator type"]:
-        operators_types = re.split(r"\s?;\s?", row["operator type"])
-        operators_infos = re.split(r"\s?;\s?", row["operator description"])
+    if not row.isna("operator type"):
+        operators_types = row.split("operator type")
+        operators_infos = row.split("operator description")
         for i, operator_type in enumerate(operators_types):
-            if operator_type.strip() not in ["person", "computer"]:
-                operator_type = "operator"
-            operator = onto[operator_type](urllib.parse.quote(
+            operator_type = schema.name("operator", operator_type) or "operator"
+            operator = ir.create(operator_type, urllib.parse.quote(
                 operator_type + str(i) + "_" + doi
                 ))
-            operator.label = operators_infos[i]
-            process.hasOperator.append(
+            ir.set(operator, "label", operators_infos[i])
+            ir.append(process, "hasOperator",
                 operator
                 )
 
     #Study case
     study_cases = []
     study_cases_instances = []
-    if not row.isna()["Study Area name"]:
-        study_cases = re.split(r"\s?;\s?", row["Study Area name"])
-        if not row.isna()["belongs to country"]:
-            countries = re.split(r"\s?;\s?", row["belongs to country"])
+    if not row.isna("Study Area name"):
+        study_cases = row.split("Study Area name")
+        if not row.isna("belongs to country"):
+            countries = row.split("belongs to country")
         else:
             countries = [""]*len(study_cases)
-        extents_types = re.split(r"\s?;\s?", row["geographic extent type"])
+        extents_types = row.split("geographic extent type")
         for i, study_area in enumerate(study_cases):
             extent_type = extents_types[i].lower()
             if extent_type == "state":
                 extent_type = "local"
-            elif extent_type not in ["local", "regional", "national", "global"]:
-                extent_type = "geographic_extent"
-            study_case = onto[extent_type](urllib.parse.quote(
+            extent_type = schema.name("extent", extent_type) or "geographic_extent"
+            study_case = ir.create(extent_type, urllib.parse.quote(
                 "study_case_"+study_area.replace(" ","_")
                 ))
-            study_case.label = study_area
-            if "[" in countries[i]:
-                list_countries_i = re.split(r"\s?,\s?", countries[i].replace("[","").replace("]","") )
-                study_case.belongsToCountry.extend(list_countries_i)
-            else :
-                study_case.belongsToCountry.append( countries[i] )
+            ir.set(study_case, "label", study_area)
+            ir.extend(study_case, "belongsToCountry", parse_bracket_list(countries[i]))
             study_cases_instances.append(study_case)
-            process.hasStudyCase.append(study_case)
+            ir.append(process, "hasStudyCase", study_case)
+
+    #What the text qualifiers of the metric values refer to: the algorithms, study cases and inputs
+    #of the process are indexed by label once, after their creation
+    context = MetricContext(row, places)
+    ir.unknown_places = context.unknown_places
+    ir.index_process(process)
 
     # Quality assessment
     computed = "computed"
     ## Global metrics
-    list_global_quality_metrics = [
-        'OA',
-        'mF1',
-        'mIoU',
-        'kappa',
-        'global recall (producer accuracy)',
-        'global precision (user accuracy)'
-        ]
-    metrics_type = [
-        "overall_accuracy",
-        "f1_score",
-        "intersection_over_union",
-        "separated_kappa",
-        "producer_accuracy",
-        "user_accuracy"
-        ]
+    list_global_quality_metrics = GLOBAL_QUALITY_METRICS
+    metrics_type = GLOBAL_QUALITY_METRICS_TYPES
 
     # Count the number of validation datasets and study areas
     num_validation_datasets = len(list_inputs_is_training) if list_inputs_is_training else 0
     num_study_areas = len(study_cases) if study_cases else 0
 
     for i, metric in enumerate(list_global_quality_metrics):
-        if not row.isna()[metric]:
-            metric_values = re.split(r"\s?;\s?", row[metric])
+        if not row.isna(metric):
+            metric_values = row.split(metric)
             for j, metric_value in enumerate(metric_values):
-                algo_qual_assessment = onto[metrics_type[i]](urllib.parse.quote(
-                    metric.replace(" ", "_")  + "_" + str(j) + "_" + str(doi) + "_" + str(int(time.time()))
+                algo_qual_assessment = ir.create(metrics_type[i], urllib.parse.quote(
+                    metric.replace(" ", "_")  + "_" + str(j) + "_" + str(doi) + "_" + content_hash(process.iri, metric_value)
                     ))
-                #verify if the decimal numbers are written with dots and not with commas like in French
-                metric_value = re.sub(r'(?<=\d),(?=\d)', '.', metric_value)
-                if not is_number(metric_value.replace("%", "").strip()):#It is not simply the value of the metric
-                    if "(" in metric_value:
-                        metric_value, comment = re.split(r"\s?\(\s?", metric_value)
-                        algo_qual_assessment.comment += comment.replace(")","").strip()
+                if not is_number(metric_value):#It is not simply the value of the metric
+                    metric_value, comment = parse_value_comment(metric_value)
+                    if comment is not None:
+                        ir.iadd(algo_qual_assessment, "comment", comment)
                     if ":" in metric_value:#if there are text: values
-                        print(metric_value)
+                        logger.debug("Metric value: %s", metric_value)
                         metric_text, metric_value = metric_value.split(":")
                         metric_text = metric_text.strip().lower()
                     else:#
@@ -661,204 +720,180 @@ def create_article(onto, row):
                         if metric_text.startswith("of"):
                             metric_text = metric_text[3:]
                     #In the excel filled by the other, metric_text can refer to a date, a study area, a dataset, an algorithm
-                    if metric_text in row.fillna("")["algorithms"].lower():
-                        print(metric_text,"is assumed to be the algorith used")
-                        for algo in process.hasAlgorithm:
-                            if algo.label[0].lower()==metric_text:
-                                algo_qual_assessment.applyAccuracyAssessmentOn.append(algo)
-                    elif is_date(metric_text):
-                        print(metric_text,"is assumed to be the date")
-                        algo_qual_assessment.year_date.append(metric_text)
-                    elif metric_text in row.fillna("")["Study Area name"].lower():
-                        print(metric_text,"is assumed to be the study case")
+                    reference = context.resolve(metric_text, special=("global",))
+                    if reference == "algorithm":
+                        logger.info(f"{metric_text} is assumed to be the algorithm used")
+                        ir.append_matches(algo_qual_assessment, "applyAccuracyAssessmentOn", process, "hasAlgorithm", metric_text)
+                    elif reference == "date":
+                        logger.info(f"{metric_text} is assumed to be the date")
+                        ir.append(algo_qual_assessment, "year_date", metric_text)
+                    elif reference == "study area":
+                        logger.info(f"{metric_text} is assumed to be the study case")
                         #find which study case it is
-                        for study_case in process.hasStudyCase:
-                            if study_case.label[0].lower() == metric_text:
-                                algo_qual_assessment.hasStudyCase.append(study_case)
-                    elif metric_text=="global" and len(process.hasStudyCase)==1:
-                        algo_qual_assessment.hasStudyCase.append(process.hasStudyCase[0])
-                    elif metric_text in row.fillna("")["input data names"].lower():
-                        print(metric_text,"is assumed to be the dataset")
-                        for input_data in process.hasInput:
-                            if input_data.label[0].lower() == metric_text:
-                                algo_qual_assessment.hasValidationDataset.append(input_data)
-                    elif is_place_name(metric_text):
-                        print(metric_text,"is assumed to be a subpart of the study area")
-                        #we have to create an object study area
-                        study_case = onto["geographic_extent"](urllib.parse.quote(
-                            "study_case_"+metric_text.replace(" ","_")
-                            ))
-                        study_case.label = metric_text
-                        algo_qual_assessment.hasStudyCase.append(study_case)
+                        ir.append_matches(algo_qual_assessment, "hasStudyCase", process, "hasStudyCase", metric_text)
+                    elif reference == "global":
+                        #The study cases of the process (of this row and the previous ones) are counted when the row is applied
+                        with ir.if_single(process, "hasStudyCase") as branch:
+                            branch.then()
+                            ir.append(algo_qual_assessment, "hasStudyCase", ir.item(process, "hasStudyCase", 0))
+                            branch.otherwise()
+                            metric_text_reference(ir, metric_text, context.resolve(metric_text), algo_qual_assessment, process)
                     else:
-                        print(f"Can't guess what '{metric_text}' refers to")
-                        algo_qual_assessment.comment = metric_text
+                        metric_text_reference(ir, metric_text, reference, algo_qual_assessment, process)
                 elif num_validation_datasets == num_study_areas and num_validation_datasets == len(metric_values):
                     # Assume each validation dataset corresponds to a study area
-                    algo_qual_assessment.hasValidationDataset.append(list_inputs_instances[j])
-                    algo_qual_assessment.hasStudyCase.append(process.hasStudyCase[j])
+                    ir.append(algo_qual_assessment, "hasValidationDataset", list_inputs_instances[j])
+                    ir.append(algo_qual_assessment, "hasStudyCase", ir.item(process, "hasStudyCase", j))
                 elif num_validation_datasets == len(metric_values):
                     # Assume each metric value corresponds to a validation dataset
-                    algo_qual_assessment.hasValidationDataset.append(list_inputs_instances[j])
+                    ir.append(algo_qual_assessment, "hasValidationDataset", list_inputs_instances[j])
                 elif num_study_areas == len(metric_values):
                     # Assume each metric value corresponds to a study area
-                    algo_qual_assessment.hasStudyCase.append(study_cases_instances[j])
+                    ir.append(algo_qual_assessment, "hasStudyCase", study_cases_instances[j])
                 else:
-                    print(f"Mismatch in the number of validation datasets, study areas, and metric values for {metric}")
+                    logger.warning(f"Mismatch in the number of validation datasets, study areas, and metric values for {metric}")
 
-                algo_qual_assessment.value.append(
-                    eval(metric_value.replace("%", "/100"))
-                    )
-                process.hasAccuracyAlgorithm.append(algo_qual_assessment)
+                if is_number(metric_value):
+                    ir.append(algo_qual_assessment, "value", parse_number(metric_value))
+                else:
+                    logger.warning(f"Cannot read the value '{metric_value}' of {metric}")
+                ir.append(process, "hasAccuracyAlgorithm", algo_qual_assessment)
 
     ## Per class metrics
-    list_per_class_quality_metrics = [
-        'per class binary accuracy',
-        'per class F1 score',
-        'per class IoU',
-        'per class recall (producer accuracy)',
-        'per class precision (user accuracy)'
-        ]
-    metrics_type = [
-        "algorithm_quality_assessment",
-        "f1_score",
-        "intersection_over_union",
-        "producer_accuracy",
-        "user_accuracy"
-        ]
-
-    all_classes_flat = [class_i  for class_group in all_classes for class_i in class_group]
+    list_per_class_quality_metrics = PER_CLASS_QUALITY_METRICS
+    metrics_type = PER_CLASS_QUALITY_METRICS_TYPES
+
+    #The classes of the nomenclatures of the process (of this row and the previous ones) are listed when the row is applied
     for i, metric in enumerate(list_per_class_quality_metrics):
-        if not row.isna()[metric]:
+        if not row.isna(metric):
           if row[metric].lower().strip() == "computed":
-            for lulc_class in all_classes_flat:
-                algo_qual_assessment = onto[metrics_type[i]](urllib.parse.quote(
-                    metric.replace(" ", "_") + "_" + str(doi) + "_" + str(int(time.time()))
-                    ))
-                algo_qual_assessment.assessedOnClass.append(lulc_class)
-                process.hasAccuracyAlgorithm.append(algo_qual_assessment)
+            ir.computed_assessments(process, metric, metrics_type[i], doi)
           else:
             if "{" in row[metric]:
-                per_class_metric_with_extra_info(row, metric, metrics_type[i], process, doi, onto)
+                per_class_metric_with_extra_info(ir, row, context, metric, metrics_type[i], process, doi)
             else:
-                metric_values = re.split(r"\s?;\s?", row[metric])
-                for j, metric_value in enumerate(metric_values):
-                    algo_qual_assessment = onto[metrics_type[i]](urllib.parse.quote(
-                        metric.replace(" ", "_") + "_" + str(j) + "_" + str(doi) + "_" + str(int(time.time()))
+                metric_values = row.split(metric)
+                #Stopped if the class of a value cannot be infered
+                with ir.block():
+                  for j, metric_value in enumerate(metric_values):
+                    algo_qual_assessment = ir.create(metrics_type[i], urllib.parse.quote(
+                        metric.replace(" ", "_") + "_" + str(j) + "_" + str(doi) + "_" + content_hash(process.iri, metric_value)
                         ))
                     if ":" not in metric_value:
-
-                        if len(all_classes_flat) == 1:
-                            lulc_class = all_classes_flat[0]
-                            value = metric_value
-                        elif len(all_classes_flat) == len(metric_values):
-                            lulc_class = all_classes_flat[j]
-                            value = metric_value
-                        else:
-                            print( f"class name not provided for {metric} and cannot be infered")
-                            break
+                        lulc_class = ir.process_class(process, j, len(metric_values), metric)
+                        value = metric_value
                     else:
-                        lulc_class_name, value = re.split(r"\s?:\s?", metric_value)
-                        print(lulc_class_name)
-                        lulc_class = onto.search_one(iri = "*lulc_class_" + lulc_class_name.strip().lower().replace(" ", "_").replace("-", "_"))
-                        if not lulc_class:
-                            print(f"LULC class {lulc_class_name} not found")
-                            lulc_class = onto["lulc_class"](urllib.parse.quote(
-                                "lulc_class_" + lulc_class_name.replace("-", "_").replace(" ", "_")))
-                            lulc_class.label = lulc_class_name
-                    #verify if the decimal numbers are written with dots and not with commas like in French
-                    value = re.sub(r'(?<=\d),(?=\d)', '.', value)
-                    if "(" in value:
-                        value, comment = re.split(r"\s?\(\s?", value)
-                        algo_qual_assessment.comment = comment.replace(")","").strip()
-                    print(lulc_class, type(lulc_class))
-                    algo_qual_assessment.assessedOnClass.append(lulc_class)
-                    algo_qual_assessment.value.append(
-                        eval(value.replace("%", "/100"))
-                        )
-                    print(num_validation_datasets, num_study_areas)
+                        lulc_class_name, value = parse_named_value(metric_value)
+                        lulc_class = ir.find_lulc_class(lulc_class_name, create_as="lulc_class")
+                    value, comment = parse_value_comment(value)
+                    if comment is not None:
+                        ir.set(algo_qual_assessment, "comment", comment)
+                    ir.append(algo_qual_assessment, "assessedOnClass", lulc_class)
+                    if is_number(value):
+                        ir.append(algo_qual_assessment, "value", parse_number(value))
+                    else:
+                        logger.warning(f"Cannot read the value '{value}' of {metric}")
                     if num_validation_datasets == num_study_areas:
                         # Assume each validation dataset corresponds to a study area
-                        algo_qual_assessment.hasValidationDataset.append(list_inputs_instances[j])
-                        algo_qual_assessment.hasStudyCase.append(study_cases_instances[j])
+                        ir.append(algo_qual_assessment, "hasValidationDataset", list_inputs_instances[j])
+                        ir.append(algo_qual_assessment, "hasStudyCase", study_cases_instances[j])
                     elif num_validation_datasets == len(metric_values):
                         # Assume each metric value corresponds to a validation dataset
-                        algo_qual_assessment.hasValidationDataset.append(list_inputs_instances[j])
+                        ir.append(algo_qual_assessment, "hasValidationDataset", list_inputs_instances[j])
                     elif num_study_areas == len(metric_values):
                         # Assume each metric value corresponds to a study area
-                        algo_qual_assessment.hasStudyCase.append(study_cases_instances[j])
+                        ir.append(algo_qual_assessment, "hasStudyCase", study_cases_instances[j])
                     else:
-                        print(f"Mismatch in the number of validation datasets, study areas, and metric values for {metric}")
-                    process.hasAccuracyAlgorithm.append(algo_qual_assessment)
+                        logger.warning(f"Mismatch in the number of validation datasets, study areas, and metric values for {metric}")
+                    ir.append(process, "hasAccuracyAlgorithm", algo_qual_assessment)
 
-    if not row.isna()["user defined algorithm quality assessment metrics"]:
-        other_metrics = re.split(r"\s?;\s?", row["user defined algorithm quality assessment metrics"])
+    if not row.isna(USER_DEFINED_QUALITY_METRICS):
+        other_metrics = row.split(USER_DEFINED_QUALITY_METRICS)
         for j, metric in enumerate(other_metrics):
-            if ":" in metric or "=" in metric:
-                metric_name_and_class, metric_value = re.split(r"\s?:|=\s?", metric)
-            else:
-                metric_name_and_class = metric
-                metric_value = None
-            if "(" in metric_name_and_class:
-                # Escape the parenthesis in the regex pattern
-                metric_name, lulc_class_name = re.split(r"\s?\(\s?", metric_name_and_class.replace(")", ""))
-                lulc_class_name = lulc_class_name.strip()
-                print("onto.lulc_class_" + lulc_class_name.replace("-", "_").replace(" ", "_"))
-                lulc_class = lulc_class = onto.search_one(iri = "*lulc_class_" + lulc_class_name.replace("-", "_").replace(" ", "_"))
-                if not lulc_class:
-                    print(f"LULC class {lulc_class_name} not found")
-                    lulc_class = onto["lulc_class"]("lulc_class_" + lulc_class_name.replace("-", "_").replace(" ", "_"))
-                    lulc_class.label = lulc_class_name
-            else:
-                metric_name = metric_name_and_class
-            algo_qual_assessment = onto["algorithm_quality_assessment"](urllib.parse.quote(
-                metric_name.replace(" ", "_") + "_" + str(j) + "_" + doi + "_" + str(int(time.time())))
+            metric_name_and_class, metric_name, lulc_class_name, metric_value = parse_user_metric(metric)
+            if lulc_class_name is not None:
+                lulc_class = ir.find_lulc_class(lulc_class_name, create_as="lulc_class")
+            algo_qual_assessment = ir.create("algorithm_quality_assessment", urllib.parse.quote(
+                metric_name.replace(" ", "_") + "_" + str(j) + "_" + doi + "_" + content_hash(process.iri, metric))
                 )
-            algo_qual_assessment.label = metric_name
-            if "(" in metric_name_and_class:
-                algo_qual_assessment.assessedOnClass.append(lulc_class)
+            ir.set(algo_qual_assessment, "label", metric_name)
+            if lulc_class_name is not None:
+                ir.append(algo_qual_assessment, "assessedOnClass", lulc_class)
             if metric_value is not None:
-                #verify if the decimal numbers are written with dots and not with commas like in French
-                metric_value = re.sub(r'(?<=\d),(?=\d)', '.', metric_value)
-                try:
-                    algo_qual_assessment.value.append(
-                            eval(metric_value.replace("%", "/100"))
-                            )
-                except:
-                    algo_qual_assessment.value.append(
-                            metric_value
-                            )
+                if is_number(metric_value):
+                    ir.append(algo_qual_assessment, "value", parse_number(metric_value))
+                else:
+                    ir.append(algo_qual_assessment, "value", metric_value)
             other_similar_metrics = [metric_name_and_class in metric for metric in other_metrics]
             if num_validation_datasets == num_study_areas:
                 # Assume each validation dataset corresponds to a study area
-                algo_qual_assessment.hasValidationDataset.append(list_inputs[j])
-                algo_qual_assessment.hasStudyCase.append(study_cases[j])
+                ir.append(algo_qual_assessment, "hasValidationDataset", list_inputs[j])
+                ir.append(algo_qual_assessment, "hasStudyCase", study_cases[j])
             elif num_validation_datasets == len(other_similar_metrics):
                 # Assume each metric value corresponds to a validation dataset
-                algo_qual_assessment.hasValidationDataset.append(list_inputs[j])
+                ir.append(algo_qual_assessment, "hasValidationDataset", list_inputs[j])
             elif num_study_areas == len(other_similar_metrics):
                 # Assume each metric value corresponds to a study area
-                algo_qual_assessment.hasStudyCase.append(study_cases_instances[j])
+                ir.append(algo_qual_assessment, "hasStudyCase", study_cases_instances[j])
             else:
-                print(f"Mismatch in the number of validation datasets, study areas, and metric values for {metric}")
-            process.hasAccuracyAlgorithm.append(algo_qual_assessment)
+                logger.warning(f"Mismatch in the number of validation datasets, study areas, and metric values for {metric}")
+            ir.append(process, "hasAccuracyAlgorithm", algo_qual_assessment)
 
     #criterions
-    if row.fillna("")["codeAvailability "].lower() not in(FALSE_VALUES):
-        process.codeAvailability.append(row["codeAvailability "])
-    if row.fillna("")["dataAvailability"].lower() not in(FALSE_VALUES):
-        process.dataAvailability.append(row["dataAvailability"])
-    if not row.isna()["challenge"]:
-        process.challenge.extend(re.split(r"\s?;\s?", row["challenge"]))
-    if not row.isna()["strength"]:
-        process.strength.extend(re.split(r"\s?;\s?", row["strength"]))
-    if not row.isna()["weakness"]:
-        process.weaknesses.extend(re.split(r"\s?;\s?", row["weakness"]))
-
-    article.hasProcess.append(process)
-
-
-    return article
+    if row.text("codeAvailability").lower() not in(FALSE_VALUES):
+        ir.append(process, "codeAvailability", row["codeAvailability"])
+    if row.text("dataAvailability").lower() not in(FALSE_VALUES):
+        ir.append(process, "dataAvailability", row["dataAvailability"])
+    if not row.isna("challenge"):
+        ir.extend(process, "challenge", row.split("challenge"))
+    if not row.isna("strength"):
+        ir.extend(process, "strength", row.split("strength"))
+    if not row.isna("weakness"):
+        ir.extend(process, "weaknesses", row.split("weakness"))
+
+    ir.append(article, "hasProcess", process)
+
+
+def preparse_metric_values(excel_ontology_file):
+    """
+    Parses the numbers of all the quality metric columns at once, column by column,
+    so that create_article only looks up the values of each row.
+    """
+    for metric in GLOBAL_QUALITY_METRICS + PER_CLASS_QUALITY_METRICS + [USER_DEFINED_QUALITY_METRICS]:
+        if metric in excel_ontology_file.columns:
+            preparse_numbers(excel_ontology_file[metric])
+
+def configure_parse_pool(jobs, initializer=None, initargs=()):
+    """
+    Parses the rows with jobs processes (in this process if jobs is 1), the ontology being
+    written by this process only. Returns the pool, to close at the end of the run.
+    """
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.close()
+        parse_pool.join()
+    parse_pool = multiprocessing.Pool(jobs, initializer=initializer, initargs=initargs) if jobs > 1 else None
+    return parse_pool
+
+def parse_articles(rows, schema):
+    """
+    ArticleIRs of rows, parsed by the parse pool if any, in the order of the rows.
+    The workers of the pool do not geocode: the texts they could not resolve otherwise are geocoded
+    by this process, all at once, and the rows which need them are parsed again.
+    """
+    if parse_pool is None or len(rows) < 2:
+        return [parse_article(row, schema) for row in rows]
+    irs = [None]*len(rows)
+    places = {}
+    pending = range(len(rows))
+    while pending:
+        parsed = parse_pool.map(functools.partial(parse_article, schema=schema, places=places), [rows[i] for i in pending])
+        for i, ir in zip(pending, parsed):
+            irs[i] = ir
+        for text in sorted({text for ir in parsed for text in ir.unknown_places}):
+            places[text] = is_place_name(text)
+        pending = [i for i, ir in zip(pending, parsed) if ir.unknown_places]
+    return irs
 
 def get_excel_files(path: str):
     if os.path.isdir(path):
@@ -871,44 +906,377 @@ def get_excel_files(path: str):
         # If it's neither a directory nor an Excel file, return an empty list
         return []
 
+def sheet_row_keys(excel_ontology_file_path):
+    """(row hash, paper key) of each row of the Excel file, computed without enriching nor instantiating it."""
+    rows = iter_sheet_rows(excel_ontology_file_path)
+    header = next(rows)
+    doi_column, title_column = header.index(("Paper metadata", "doi")), header.index(("Paper metadata", "Title"))
+    next(rows, None)#guide row
+    row_keys = []
+    paper_keys = PaperKeys()
+    for values in rows:
+        hash_ = row_hash(values)
+        row_keys.append((hash_, paper_keys.key(values[doi_column], values[title_column], hash_)))
+    return row_keys
+
+def retract_rows(onto, iris):
+    """Retracts the individuals created by the rows of a previous run."""
+    destroyed = retract_individuals(onto.world, iris)
+    #The indexes may refer to destroyed individuals
+    lulc_class_indexes.pop(onto, None)
+    individual_indexes.pop(onto, None)
+    run_report.count("individuals retracted", destroyed)
+    logger.info(f"{destroyed} individuals retracted")
+
+def instantiate_excel_file(onto, excel_ontology_file_path, enrichment_jobs=1, ignore_error=True, enriched_csv_path="enriched_excel.csv", chunk_size=DEFAULT_CHUNK_SIZE, manifest=None):
+    """
+    Enriches the metadata of the Excel file and instantiates its articles in onto.
+    The sheet is streamed by chunks of chunk_size rows, each chunk being enriched and
+    instantiated before the next one is read.
+    If ignore_error is True, an article which cannot be instantiated is reported and skipped.
+    If a RunManifest is given (incremental mode), only the papers added or modified since the
+    previous run are instantiated, after retracting the individuals of the papers modified or removed.
+    Returns the individuals created by each row: {row hash: {"paper": key, "individuals": [IRIs]}}.
+    """
+    logger.info(f"Instantiating {excel_ontology_file_path}")
+    diff = None
+    instantiated_rows = {}
+    if manifest is not None:
+        workbook_hash = file_hash(excel_ontology_file_path)
+        if manifest.is_unchanged(excel_ontology_file_path, workbook_hash):
+            logger.info("Unchanged since the previous run")
+            run_report.count("workbooks unchanged")
+            return manifest.rows(excel_ontology_file_path)
+        current_rows = sheet_row_keys(excel_ontology_file_path)
+        diff = WorkbookDiff(manifest.rows(excel_ontology_file_path), current_rows)
+        logger.info(f"{len(diff.changed_papers)} papers added, modified or removed")
+        run_report.count("papers changed", len(diff.changed_papers))
+        run_report.expect_rows(sum(diff.is_changed(paper) for hash_, paper in current_rows))
+        with run_report.stage("retraction"):
+            retract_rows(onto, diff.retracted_individuals())
+        instantiated_rows = dict(diff.kept_rows)
+    else:
+        run_report.expect_rows(sheet_row_count(excel_ontology_file_path))
+    run_report.count("workbooks")
+    for excel_ontology_file, row_keys in iter_enriched_chunks(excel_ontology_file_path, enrichment_jobs, enriched_csv_path, chunk_size, diff):
+        with run_report.stage("instantiation"):
+            preparse_metric_values(excel_ontology_file)
+            instantiate_rows(onto, excel_ontology_file, ignore_error, row_keys, diff, instantiated_rows)
+        #With a quadstore, each chunk is committed in one transaction
+        with run_report.stage("commit"):
+            commit(onto)
+    if manifest is not None:
+        manifest.update_workbook(excel_ontology_file_path, workbook_hash, instantiated_rows)
+    return instantiated_rows
+
+def iter_enriched_chunks(excel_ontology_file_path, enrichment_jobs=1, enriched_csv_path=None, chunk_size=DEFAULT_CHUNK_SIZE, diff=None):
+    """
+    Yields the chunks of chunk_size rows of the Excel file, enriched (and saved to enriched_csv_path
+    if given), with the (row hash, paper key) of their rows.
+    In incremental mode, the chunks without any row of the papers of diff which changed are skipped.
+    """
+    previous_row = None
+    csv_started = False
+    doi_column, title_column = ("Paper metadata", "doi"), ("Paper metadata", "Title")
+    #The rows without DOI continuing a paper get its key, also across the chunks
+    paper_keys = PaperKeys()
+    for excel_ontology_file in run_report.timed("read", iter_sheet_chunks(excel_ontology_file_path, chunk_size)):
+        hashes = [row_hash(values) for values in excel_ontology_file.iloc[1:].itertuples(index=False, name=None)]
+        row_keys = [(hash_, paper_keys.key(doi, title, hash_)) for hash_, doi, title
+                    in zip(hashes, excel_ontology_file[doi_column].iloc[1:], excel_ontology_file[title_column].iloc[1:])]
+        if diff is not None:
+            if not any(diff.is_changed(paper) for hash_, paper in row_keys):
+                #Nothing to instantiate: the chunk is not enriched, its last row only tells if the next one continues its paper
+                previous_row = excel_ontology_file.iloc[-1]
+                continue
+        #The row 0 of a chunk is the guide row, or the last row of the previous chunk, which has been enriched since
+        continued = previous_row is not None
+        if continued:
+            excel_ontology_file.loc[0] = previous_row
+        with run_report.stage("enrichment"):
+            excel_ontology_file = enrich_metadata(excel_ontology_file, jobs=enrichment_jobs, continued=continued)
+        if enriched_csv_path is not None:
+            #The header and the guide row, then the enriched rows of each chunk
+            written = excel_ontology_file.iloc[1:] if continued else excel_ontology_file
+            written.to_csv(enriched_csv_path, index=False, header=not csv_started, mode="a" if csv_started else "w")
+            csv_started = True
+        previous_row = excel_ontology_file.iloc[-1]
+        excel_ontology_file = excel_ontology_file.iloc[1:]
+        excel_ontology_file.columns = excel_ontology_file.columns.droplevel(0)
+        logger.debug("Chunk:\n%s", excel_ontology_file)
+        yield excel_ontology_file, row_keys
+
+def instantiate_rows(onto, excel_ontology_file, ignore_error=True, row_keys=None, diff=None, instantiated_rows=None):
+    """
+    Instantiates the article of each row of excel_ontology_file in onto.
+    If instantiated_rows is given, the individuals created by each row are recorded in it, by row hash.
+    In incremental mode, only the rows of the papers of diff which changed are instantiated.
+    The rows are prepared column by column beforehand (see row_records.py), and parsed into
+    ArticleIRs (see article_ir.py), possibly in parallel, before being applied to onto in order.
+    The values of the properties of the chunk are inserted in bulk (see bulk_loader.py).
+    """
+    apply_rows(onto, parse_rows(excel_ontology_file, schema_index(onto), row_keys, diff), ignore_error, instantiated_rows)
+
+def parse_rows(excel_ontology_file, schema, row_keys=None, diff=None):
+    """
+    Parses the rows of excel_ontology_file to instantiate (see instantiate_rows) into ArticleIRs,
+    without touching the ontology. Returns (row key, name of the article, ArticleIR) for each of them,
+    the row key being None without row_keys.
+    """
+    rows = prepare_rows(excel_ontology_file)
+    selected = [i for i in range(len(rows)) if diff is None or diff.is_changed(row_keys[i][1])]
+    with run_report.stage("parsing"):
+        irs = parse_articles([rows[i] for i in selected], schema)
+    return [(row_keys[i] if row_keys is not None else None, rows[i].get('Title') or rows[i].get('doi'), ir)
+            for i, ir in zip(selected, irs)]
+
+def apply_rows(onto, parsed_rows, ignore_error=True, instantiated_rows=None):
+    """
+    Applies the ArticleIRs of parse_rows to onto, in order, with a TripleBatch for all of them.
+    If instantiated_rows is given, the individuals created by each row are recorded in it, by row hash.
+    """
+    tracker = EntityTracker(onto.world) if instantiated_rows is not None else None
+    batch = TripleBatch(onto.world)
+    try:
+        for row_key, name, ir in parsed_rows:
+            if tracker is not None:
+                start = tracker.start()
+            try:
+                if ignore_error:#If the article cannot be instantiated, an error message is displayed, but the other papers of the folder can be instantiated
+                    try:
+                        article = apply_article(onto, ir, batch)
+                    except Exception as e:
+                        run_report.count("articles failed")
+                        logger.error(f"Cannot instantiate the article {name!r}: {e!r}", exc_info=logger.isEnabledFor(logging.DEBUG))
+                else:#Stop on error
+                    article = apply_article(onto, ir, batch)
+            finally:
+                #The individuals of a row which failed are recorded too, to be retracted when it is fixed
+                if tracker is not None:
+                    hash_, paper = row_key
+                    instantiated_row = instantiated_rows.setdefault(hash_, {"paper": paper, "individuals": []})
+                    created = tracker.created_since(start)
+                    instantiated_row["individuals"].extend(created)
+                    run_report.count("individuals created", len(created))
+                run_report.rows_done()
+            #visualize_instance(article)
+    finally:
+        batch.flush()
+        run_report.count("triples inserted", batch.inserted)
+        run_report.count("duplicate values skipped", batch.skipped)
+
+def init_worker(cache_dir, gazetteer_paths, refresh, timeout, retries, nominatim_clock, jobs, log_level, fixture_options):
+    """
+    Configures the logging and the metadata enrichment of a worker process of instantiate_in_processes.
+    fixture_options are the arguments of configure_fixtures, or None to query the web services.
+    """
+    configure_logging(log_level)
+    if fixture_options is not None:
+        configure_fixtures(**fixture_options)
+    configure_cache(cache_dir, refresh=refresh)
+    configure_geocoder(cache_dir, gazetteer_paths, refresh=refresh)
+    configure_authors(cache_dir, refresh=refresh)
+    #The rate limits of the web services are shared between the processes
+    configure_http(timeout, retries, rate_scale=1/jobs)
+    share_nominatim_clock(nominatim_clock)
+
+def parse_excel_file_in_worker(task):
+    """
+    Enriches the rows of one Excel file and parses them into ArticleIRs, in a worker process
+    of instantiate_in_processes, without touching the ontology.
+    Returns the parsed rows of each chunk (see parse_rows), and the report of the task.
+    """
+    excel_ontology_file_path, schema, chunk_size = task
+    #A worker process runs several tasks, each one reports its own timings and counters
+    run_report.reset()
+    run_report.count("workbooks")
+    parsed_chunks = []
+    for excel_ontology_file, row_keys in iter_enriched_chunks(excel_ontology_file_path, chunk_size=chunk_size):
+        with run_report.stage("parsing"):
+            preparse_metric_values(excel_ontology_file)
+        parsed_chunks.append(parse_rows(excel_ontology_file, schema, row_keys))
+    return parsed_chunks, run_report.to_dict()
+
+def fixture_options(args):
+    """Arguments of configure_fixtures given on the command line, or None if the web services are queried."""
+    if not (args.record or args.replay or args.replay_server):
+        return None
+    return {"record": args.record, "replay": args.replay, "server": args.replay_server,
+            "latency": args.latency, "error_rate": args.error_rate, "seed": args.seed}
+
+def worker_initargs(args, jobs):
+    """Arguments of init_worker for a pool of jobs processes."""
+    nominatim_clock = multiprocessing.Value("d", 0)
+    return (args.cache_dir, args.gazetteer, args.refresh, (DEFAULT_TIMEOUT[0], args.timeout),
+            args.retries, nominatim_clock, jobs, args.log_level, fixture_options(args))
+
+def instantiate_in_processes(onto, list_excel_files_path, jobs, args):
+    """
+    Enriches and parses each Excel file in a worker process, and applies their rows to onto in
+    this process, in the order of the files, so that the ontology is the same as in a serial run.
+    Returns the individuals created by the rows of each file.
+    """
+    for excel_ontology_file_path in list_excel_files_path:
+        run_report.expect_rows(sheet_row_count(excel_ontology_file_path))
+    tasks = [(excel_ontology_file_path, schema_index(onto), args.chunk_size) for excel_ontology_file_path in list_excel_files_path]
+    instantiated_workbooks = {}
+    with multiprocessing.Pool(jobs, initializer=init_worker, initargs=worker_initargs(args, jobs)) as pool:
+        #The files are applied as soon as they are parsed, while the next ones are parsed
+        for excel_ontology_file_path, (parsed_chunks, report) in zip(list_excel_files_path, pool.imap(parse_excel_file_in_worker, tasks)):
+            run_report.merge(report)
+            logger.info(f"Instantiating {excel_ontology_file_path}")
+            instantiated_rows = instantiated_workbooks[excel_ontology_file_path] = {}
+            for parsed_rows in parsed_chunks:
+                with run_report.stage("instantiation"):
+                    apply_rows(onto, parsed_rows, not args.stop_on_error, instantiated_rows)
+    return instantiated_workbooks
+
 #%%
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Instantiates the LULC ontology from an Excel file or a folder of Excel files.")
+    parser.add_argument("path", nargs="?", default="LULC_Ontology_example.xlsm", help="Excel file, or folder of Excel files, describing the articles")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Folder of the metadata response cache")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cached metadata responses and query the web services again")
+    parser.add_argument("--gazetteer", action="append", default=[], help="GeoNames (.txt) or Natural Earth (.csv) file of place names, to geocode offline (can be repeated)")
+    parser.add_argument("--enrichment-jobs", type=int, default=1, help="Number of concurrent requests to the metadata web services")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT[1], help="Timeout of the requests to the metadata web services, in seconds")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Number of retries of a failed request")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes instantiating the Excel files in parallel")
+    parser.add_argument("--parse-jobs", type=int, default=1, help="Number of processes parsing the rows, the ontology being written by a single process")
+    parser.add_argument("--stop-on-error", action="store_true", help="Stop at the first article which cannot be instantiated")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of rows of the Excel files read, enriched and instantiated at once")
+    parser.add_argument("--incremental", action="store_true", help="Only instantiate the papers added, modified or removed since the previous run")
+    parser.add_argument("--quadstore", default=None, help="SQLite quadstore file keeping the instantiated ontology between the runs")
+    parser.add_argument("--export", action="store_true", help="With --quadstore, also save the instantiated ontology as OWL")
+    parser.add_argument("--format", nargs="+", choices=list(FORMATS), default=["rdfxml"], help="Output formats of the instantiated ontology")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output files with gzip")
+    parser.add_argument("--shard-by", choices=SHARD_KEYS, default=None, help="Split the N-Triples or Turtle output in one file per Excel file or per paper")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the messages logged")
+    parser.add_argument("--report", default=None, help="JSON file in which the report of the run (timings, counters, cache and requests statistics) is saved")
+    fixture_group = parser.add_mutually_exclusive_group()
+    fixture_group.add_argument("--record", default=None, help="Fixture file in which the responses of the metadata web services are recorded")
+    fixture_group.add_argument("--replay", default=None, help="Fixture file from which the metadata requests are answered, without network access")
+    fixture_group.add_argument("--replay-server", default=None, help="URL of a fixture server (python replay.py FIXTURES) answering the metadata requests")
+    parser.add_argument("--latency", type=float, default=0, help="With --replay, delay added to each request, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="With --replay, share of the requests failing")
+    parser.add_argument("--seed", type=int, default=None, help="With --replay, seed of the injected errors")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    fixtures = None
+    if fixture_options(args) is not None:
+        fixtures = configure_fixtures(**fixture_options(args))
+        #The cached responses are ignored, so that every request is recorded or replayed
+        args.refresh = True
+    response_cache = configure_cache(args.cache_dir, refresh=args.refresh)
+    place_checker = configure_geocoder(args.cache_dir, args.gazetteer, refresh=args.refresh)
+    author_registry = configure_authors(args.cache_dir, refresh=args.refresh)
+    http_session = configure_http((DEFAULT_TIMEOUT[0], args.timeout), args.retries, pool_size=max(10, args.enrichment_jobs))
+
     #path to the owl file defining the ontology
     owl_file_path = os.path.join(
         "lulc_review.owl"
         )
-    
-    onto = or2.get_ontology(owl_file_path).load()
 
     #path to an excel file describing articles to instantiate, or a folder of excel files
-    excel_ontology_folder_path = "LULC_Ontology_example.xlsm" if len(sys.argv) <= 1 else sys.argv[1]
+    excel_ontology_folder_path = args.path
     
     list_excel_files_path = get_excel_files(excel_ontology_folder_path)
-    
-    for excel_ontology_file_path in list_excel_files_path:
-        print("\n______________________________\n",excel_ontology_file_path)
-        excel_ontology_file = pd.read_excel(excel_ontology_file_path, dtype=str, sheet_name="ontology_instanciation", header=[0,1])
-        excel_ontology_file = enrich_metadata(excel_ontology_file)
-        excel_ontology_file.to_csv("enriched_excel.csv", index=False)
-        #break
-        excel_ontology_file.columns = excel_ontology_file.columns.droplevel(0)
-        excel_ontology_file.drop(index=excel_ontology_file.index[0], axis=0, inplace=True)#The purpose of this row is to help the user on how to fill each column
-        display(excel_ontology_file)
-
-        for i in range(1, len(excel_ontology_file)):
-            row = excel_ontology_file.iloc[i]
-            if ignore_error:#If the article cannot be instantiated, an error message is displayed, but the other papers of the folder can be instantiated
-                try:
-                    article = create_article(onto, row)
-                except Exception as e:
-                    print("\n--------------------------------\n", "Exception:\n",e, "\n--------------------------------\n")
-            else:#Stop on error
-                article = create_article(onto, row)
-            #visualize_instance(article)
 
-    onto.save(
-        os.path.join(
-            "lulc_review_instantiated.owl"
-            )
+    #path to the instantiated ontology
+    output_path = os.path.join(
+        "lulc_review_instantiated.owl"
         )
+
+    #The instantiated ontology is kept between the runs in the quadstore if any, otherwise in the output file
+    instantiated_path = args.quadstore or output_path
+
+    #The rows kept in a quadstore are always listed in a manifest, so that the rows modified are
+    #retracted instead of being instantiated again over their previous values
+    if args.quadstore is not None:
+        args.incremental = True
+
+    #In incremental mode, the rows already instantiated are listed in a manifest next to the instantiated ontology
+    manifest = None
+    if args.incremental:
+        manifest = RunManifest(instantiated_path + ".manifest.json", owl_file_signature(owl_file_path))
+        if not os.path.exists(instantiated_path):
+            manifest.workbooks.clear()
+        elif args.quadstore is not None and not os.path.exists(manifest.path):
+            parser.error(f"the quadstore {args.quadstore} has no manifest of the rows it holds, delete it to instantiate them again")
+
+    serial = manifest is not None or args.quadstore is not None
+    if args.jobs > 1 and serial:
+        logger.warning("The incremental mode and the quadstore instantiate the Excel files in a single process")
+
+    with run_report.stage("load ontology"):
+        if args.quadstore is not None:
+            onto = open_quadstore(args.quadstore, owl_file_path)
+        elif manifest is not None and not manifest.is_empty():
+            #The previous run is updated
+            onto = or2.get_ontology(output_path).load()
+        else:
+            onto = or2.get_ontology(owl_file_path).load()
+        load_schema_index(onto, owl_file_path)
+
+    if args.jobs > 1 and len(list_excel_files_path) > 1 and not serial:
+        instantiated_workbooks = instantiate_in_processes(onto, list_excel_files_path, args.jobs, args)
+    else:
+        #The rows are parsed in parallel, and applied to the ontology by this process
+        #The parsing workers do not query the web services, they only log
+        configure_parse_pool(args.parse_jobs, configure_logging, (args.log_level,))
+        if manifest is not None:
+            for removed_file_path in manifest.missing_workbooks():
+                logger.info(f"{removed_file_path} was removed")
+                with run_report.stage("retraction"):
+                    retract_rows(onto, [iri for row in manifest.remove_workbook(removed_file_path).values() for iri in row["individuals"]])
+        instantiated_workbooks = {}
+        for excel_ontology_file_path in list_excel_files_path:
+            instantiated_workbooks[excel_ontology_file_path] = instantiate_excel_file(
+                onto, excel_ontology_file_path, args.enrichment_jobs, not args.stop_on_error, chunk_size=args.chunk_size, manifest=manifest)
+        if manifest is not None:
+            #The individuals of the previous runs too
+            instantiated_workbooks = manifest.workbooks
+        configure_parse_pool(1)
+
+    with run_report.stage("commit"):
+        commit(onto)
+    #With a quadstore, the output files are only written on demand
+    if args.quadstore is None or args.export:
+        shards = shards_of_individuals(instantiated_workbooks, args.shard_by) if args.shard_by else None
+        outputs = {}
+        for output_format in args.format:
+            if shards is not None and output_format != "rdfxml":
+                format_output_path = os.path.splitext(output_path)[0] + "_shards"
+            else:
+                format_output_path = os.path.splitext(output_path)[0] + FORMATS[output_format]
+            outputs[output_format] = save_ontology(onto, format_output_path, output_format, args.gzip, shards)
+            paths, size, duration = outputs[output_format]
+            run_report.add_time(f"save {output_format}", duration)
+        report_outputs(outputs)
+        run_report.add_section("outputs", {output_format: {"files": paths, "bytes": size, "seconds": duration}
+                                           for output_format, (paths, size, duration) in outputs.items()})
+    #In incremental mode without quadstore, the next run updates the uncompressed RDF/XML output, saved even if not asked for
+    if manifest is not None and args.quadstore is None and ("rdfxml" not in args.format or args.gzip):
+        with run_report.stage("save incremental state"):
+            save_ontology(onto, output_path, "rdfxml")
+    if args.quadstore is not None:
+        onto.world.close()
+    if manifest is not None:
+        manifest.save()
+
+    #In --jobs mode, the requests of the workers are not counted here
+    response_cache.report()
+    http_session.report()
+    place_checker.report()
+    author_registry.report()
+    run_report.log_summary()
+    if args.report is not None:
+        run_report.add_section("response cache", response_cache.summary())
+        run_report.add_section("requests", http_session.summary())
+        run_report.add_section("geocoding", place_checker.summary())
+        run_report.add_section("authors", author_registry.summary())
+        if fixtures is not None:
+            run_report.add_section("fixtures", fixtures.summary())
+        run_report.save(args.report)
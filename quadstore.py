@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent owlready2 SQLite quadstore holding the instantiated ontology.
+
+The ontology is parsed from its OWL file only when the quadstore is created. The
+next runs open the quadstore directly and add the new papers to it, the changes
+being committed by batches. The OWL/RDF file is only written when asked for.
+"""
+import json
+import logging
+
+import owlready2 as or2
+
+from ontology_index import owl_file_signature
+
+logger = logging.getLogger("quadstore")
+
+
+def open_quadstore(quadstore_path, owl_file_path):
+    """
+    Opens the world stored in quadstore_path, and returns its ontology.
+    When the quadstore is created, the ontology is loaded into it from owl_file_path.
+    """
+    world = or2.World(filename=quadstore_path)
+    graph = world.graph
+    graph.execute("CREATE TABLE IF NOT EXISTS lulc_quadstore (ontology_iri TEXT, owl_file TEXT)")
+    stored = graph.execute("SELECT ontology_iri, owl_file FROM lulc_quadstore").fetchone()
+    if stored is None:
+        onto = world.get_ontology(owl_file_path).load()
+        graph.execute("INSERT INTO lulc_quadstore VALUES (?, ?)",
+                      (onto.base_iri, json.dumps(owl_file_signature(owl_file_path))))
+        world.save()
+        logger.info(f"Quadstore {quadstore_path} created from {owl_file_path}")
+        return onto
+    ontology_iri, signature = stored
+    if json.loads(signature) != owl_file_signature(owl_file_path):
+        logger.warning(f"{owl_file_path} changed since the quadstore {quadstore_path} was created, delete it to start from the new ontology")
+    return world.get_ontology(ontology_iri)
+
+
+def commit(onto):
+    """Commits the changes made to the world of onto, if it is stored in a quadstore."""
+    if onto.world.filename not in (None, ":memory:"):
+        onto.world.save()
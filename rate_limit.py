@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Token buckets limiting the rate of the requests sent to each web service.
+"""
+import threading
+import time
+
+#host: (requests per second, burst)
+HOST_RATE_LIMITS = {
+    "api.crossref.org": (5, 5),
+    "doaj.org": (2, 2),
+    "export.arxiv.org": (1/3, 1),  # arXiv asks for one request every 3 seconds
+    "pub.orcid.org": (10, 10),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        """
+        rate: number of tokens added per second
+        capacity: maximal number of tokens, i.e. of requests sent in a burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a token is available, and consumes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def host_rate_limiters(rate_limits=HOST_RATE_LIMITS, rate_scale=1):
+    """
+    Returns a token bucket for each host.
+    rate_scale multiplies the rates, e.g. 1/n to share the limits between n processes.
+    """
+    return {host: TokenBucket(rate * rate_scale, max(1, int(capacity * rate_scale)))
+            for host, (rate, capacity) in rate_limits.items()}
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay of the responses of the web services used by the metadata
+enrichment (Crossref, DOAJ, arXiv, ORCID) and of the online geocoder (Nominatim).
+
+In record mode, the responses received are stored in a fixture file (SQLite, the
+bodies being compressed). In replay mode, the requests are answered from this file,
+in-process or by a local fixture server (python replay.py FIXTURES), without any
+network access, with an injected latency and share of failed requests, so that the
+enrichment can be run on an offline machine, reproduced and load tested.
+"""
+import json
+import zlib
+import random
+import sqlite3
+import argparse
+import logging
+import threading
+import time
+import http.client
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from http_session import DEFAULT_TIMEOUT, RETRY_STATUS
+from run_report import configure_logging
+
+logger = logging.getLogger("replay")
+
+#Headers of the responses kept in the fixtures, the ones read by HttpSession
+RECORDED_HEADERS = ["Content-Type", "X-Rate-Limit-Limit", "X-Rate-Limit-Interval"]
+#Header of the fixture server answers for which no response was recorded
+MISSING_FIXTURE_HEADER = "X-Fixture-Missing"
+DEFAULT_PORT = 8765
+
+
+class MissingFixture(requests.exceptions.RequestException):
+    """No response was recorded for the request (not retried by HttpSession)."""
+
+
+def fixture_key(url):
+    """Key of a request in the fixtures: its URL, with the query parameters sorted."""
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ""))
+
+
+class FixtureStore:
+    """Responses recorded by URL, and geocoding answers by address, stored in a SQLite file."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS geocoding (address TEXT PRIMARY KEY, found INTEGER)"
+        )
+        self.connection.commit()
+        self.counts = {"recorded": 0, "replayed": 0, "missing": 0}
+
+    def _count(self, name):
+        self.counts[name] += 1
+
+    def put_response(self, url, status, headers, body):
+        headers = {name: headers[name] for name in RECORDED_HEADERS if name in headers}
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (fixture_key(url), status, json.dumps(headers), zlib.compress(body or b""))
+            )
+            self.connection.commit()
+            self._count("recorded")
+
+    def get_response(self, url):
+        """(status, headers, body) recorded for url, or None."""
+        with self.lock:
+            recorded = self.connection.execute(
+                "SELECT status, headers, body FROM responses WHERE url=?", (fixture_key(url),)
+            ).fetchone()
+            self._count("missing" if recorded is None else "replayed")
+        if recorded is None:
+            return None
+        status, headers, body = recorded
+        return status, json.loads(headers), zlib.decompress(body)
+
+    def put_geocoding(self, address, found):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO geocoding VALUES (?, ?)", (address, int(found)))
+            self.connection.commit()
+            self._count("recorded")
+
+    def get_geocoding(self, address):
+        """Answer recorded for address (True or False), or None."""
+        with self.lock:
+            recorded = self.connection.execute("SELECT found FROM geocoding WHERE address=?", (address,)).fetchone()
+            self._count("missing" if recorded is None else "replayed")
+        return None if recorded is None else bool(recorded[0])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class FaultInjector:
+    """Latency and random failures added to the replayed requests."""
+    def __init__(self, latency=0, error_rate=0, seed=None):
+        """
+        latency: delay of each request, in seconds
+        error_rate: share of the requests failing (503 status, or geocoder failure)
+        seed: seed of the random failures, for a reproducible run
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.injected_errors = 0
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def fails(self):
+        if self.error_rate <= 0:
+            return False
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            self.injected_errors += failed
+        return failed
+
+
+def make_response(request, status, headers, body):
+    """Builds the requests.Response of request from a recorded status, headers and body."""
+    response = requests.models.Response()
+    response.status_code = status
+    response.reason = http.client.responses.get(status, "")
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class RecordingTransport(HTTPAdapter):
+    """Sends the requests to the web services, and records their responses in a FixtureStore."""
+    def __init__(self, store, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        #The transient errors are not recorded, the replay injects its own
+        if request.method == "GET" and response.status_code not in RETRY_STATUS:
+            self.store.put_response(request.url, response.status_code, response.headers, response.content)
+        return response
+
+
+class ReplayTransport(BaseAdapter):
+    """Answers the requests from a FixtureStore, without any network access."""
+    def __init__(self, store, faults):
+        super().__init__()
+        self.store = store
+        self.faults = faults
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.faults.wait()
+        if self.faults.fails():
+            return make_response(request, 503, {}, b"")
+        recorded = self.store.get_response(request.url)
+        if recorded is None:
+            raise MissingFixture(f"No response recorded for {request.url}", request=request)
+        return make_response(request, *recorded)
+
+    def close(self):
+        pass
+
+
+class ServerTransport(HTTPAdapter):
+    """Sends the requests to a fixture server (see FixtureServer) instead of the web services."""
+    def __init__(self, server_url, **kwargs):
+        super().__init__(**kwargs)
+        self.server_url = server_url.rstrip("/")
+
+    def send(self, request, **kwargs):
+        url = request.url
+        request.url = f"{self.server_url}/{urllib.parse.quote(url, safe='')}"
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            request.url = url
+        response.url = url
+        if MISSING_FIXTURE_HEADER in response.headers:
+            raise MissingFixture(f"No response recorded for {url}", request=request)
+        return response
+
+
+class RecordingGeocoder:
+    """Online geocoder recording its answers in a FixtureStore."""
+    def __init__(self, store, online_geocode):
+        self.store = store
+        self.online_geocode = online_geocode
+
+    def __call__(self, address):
+        found = self.online_geocode(address)
+        #A failure of the geocoder (None) is not recorded
+        if found is not None:
+            self.store.put_geocoding(address, found)
+        return found
+
+
+class ReplayGeocoder:
+    """Answers the geocoding requests from a FixtureStore (None for a failure, as the online geocoder)."""
+    def __init__(self, store, faults):
+        self.store = store
+        self.faults = faults
+
+    def __call__(self, address):
+        self.faults.wait()
+        if self.faults.fails():
+            return None
+        found = self.store.get_geocoding(address)
+        if found is None:
+            logger.warning(f"No geocoding recorded for {address!r}")
+        return found
+
+
+class ServerGeocoder:
+    """Sends the geocoding requests to a fixture server."""
+    def __init__(self, server_url, timeout=DEFAULT_TIMEOUT):
+        self.url = server_url.rstrip("/") + "/geocode"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __call__(self, address):
+        try:
+            response = self.session.get(self.url, params={"address": address}, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return response.json()["found"]
+
+
+class Fixtures:
+    """Record or replay mode of the web services: the transport of the HTTP session, and the online geocoder."""
+    def __init__(self, record=None, replay=None, server=None, latency=0, error_rate=0, seed=None):
+        """
+        record: fixture file in which the responses of the web services are recorded
+        replay: fixture file from which the requests are answered in-process
+        server: URL of a fixture server answering the requests
+        latency, error_rate, seed: faults injected by the in-process replay (see FaultInjector)
+        """
+        if sum(option is not None for option in (record, replay, server)) != 1:
+            raise ValueError("One of record, replay and server must be given")
+        self.server = server
+        self.record = record is not None
+        self.store = FixtureStore(record or replay) if server is None else None
+        self.faults = FaultInjector(latency, error_rate, seed)
+
+    def transport(self):
+        """requests adapter to mount on the HTTP session."""
+        if self.server is not None:
+            return ServerTransport(self.server)
+        if self.record:
+            return RecordingTransport(self.store)
+        return ReplayTransport(self.store, self.faults)
+
+    def geocoder(self, online_geocode):
+        """Replacement of the online geocoder online_geocode (see PlaceChecker)."""
+        if self.server is not None:
+            return ServerGeocoder(self.server)
+        if self.record:
+            return RecordingGeocoder(self.store, online_geocode)
+        return ReplayGeocoder(self.store, self.faults)
+
+    def summary(self):
+        """Number of responses recorded, replayed and missing, and of errors injected, for the run report."""
+        summary = dict(self.store.counts) if self.store is not None else {}
+        summary["injected errors"] = self.faults.injected_errors
+        return summary
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /<URL quoted>: response recorded for URL
+    GET /geocode?address=...: {"found": answer recorded for the address}
+    """
+    def do_GET(self):
+        server = self.server
+        server.faults.wait()
+        if server.faults.fails():
+            self.send_answer(503, {}, b"")
+            return
+        if self.path.startswith("/geocode?"):
+            address = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).get("address", [""])[0]
+            found = server.store.get_geocoding(address)
+            if found is None:
+                self.send_answer(404, {}, b"")
+            else:
+                self.send_answer(200, {"Content-Type": "application/json"}, json.dumps({"found": found}).encode())
+            return
+        recorded = server.store.get_response(urllib.parse.unquote(self.path[1:]))
+        if recorded is None:
+            self.send_answer(404, {MISSING_FIXTURE_HEADER: "1"}, b"")
+        else:
+            self.send_answer(*recorded)
+
+    def send_answer(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Local HTTP server answering the requests from a FixtureStore, standing in for the web services."""
+    daemon_threads = True
+
+    def __init__(self, store, faults, host="127.0.0.1", port=DEFAULT_PORT):
+        super().__init__((host, port), FixtureRequestHandler)
+        self.store = store
+        self.faults = faults
+
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serves the responses recorded in a fixture file, standing in for the metadata web services.")
+    parser.add_argument("fixtures", help="Fixture file recorded with --record")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the server listens on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port the server listens on")
+    parser.add_argument("--latency", type=float, default=0, help="Delay added to each request, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of the requests answered with a 503 error")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the injected errors")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the messages logged")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    server = FixtureServer(FixtureStore(args.fixtures), FaultInjector(args.latency, args.error_rate, args.seed), args.host, args.port)
+    logger.info(f"Serving {args.fixtures} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"{server.store.counts['replayed']} responses served, {server.store.counts['missing']} missing, "
+                    f"{server.faults.injected_errors} errors injected")
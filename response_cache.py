@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the responses of the web services used to enrich the
+metadata of the papers (Crossref, DOAJ, arXiv, ORCID).
+
+The responses are stored in a SQLite file, keyed by the source and the
+identifier queried (DOI or ORCID). Entries expire after a time to live, "not
+found" answers (404) are cached too with their own time to live, and the least
+recently used entries are evicted when the cache exceeds its size limit.
+"""
+import os
+import logging
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".metadata_cache"
+DEFAULT_TTL = 30 * 24 * 3600  # 30 days
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600  # 7 days, a missing DOI may be registered later
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024  # 200 MB
+
+#Status codes worth remembering: a success, or a definitive "not found"
+CACHEABLE_STATUS = {200: False, 404: True, 410: True}  # status: is it a negative answer
+
+logger = logging.getLogger("response_cache")
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, max_size=DEFAULT_MAX_SIZE,
+                 refresh=False):
+        """
+        cache_dir: folder in which the SQLite file is created
+        ttl: time to live (in seconds) of a successful response
+        negative_ttl: time to live (in seconds) of a "not found" response
+        max_size: maximal size (in bytes) of the cached bodies
+        refresh: if True, the cached responses are ignored (but updated)
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "source TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "status INTEGER NOT NULL, "
+            "body BLOB, "
+            "created REAL NOT NULL, "
+            "last_access REAL NOT NULL, "
+            "PRIMARY KEY (source, key))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, source, key):
+        """
+        Returns the cached (status, body) of the request on key to source,
+        or None if it is not cached, expired, or if the cache is refreshed.
+        """
+        with self.lock:
+            if not self.refresh:
+                entry = self.connection.execute(
+                    "SELECT status, body, created FROM responses WHERE source=? AND key=?",
+                    (source, key)
+                ).fetchone()
+                if entry is not None:
+                    status, body, created = entry
+                    ttl = self.negative_ttl if CACHEABLE_STATUS.get(status, True) else self.ttl
+                    if time.time() - created <= ttl:
+                        self.connection.execute(
+                            "UPDATE responses SET last_access=? WHERE source=? AND key=?",
+                            (time.time(), source, key)
+                        )
+                        self.connection.commit()
+                        self.hits[source] = self.hits.get(source, 0) + 1
+                        return status, body
+            self.misses[source] = self.misses.get(source, 0) + 1
+            return None
+
+    def put(self, source, key, status, body):
+        """Stores the response of the request on key to source, if it is cacheable."""
+        if status not in CACHEABLE_STATUS:
+            #Transient errors (429, 5xx...) must be retried on the next run
+            return
+        if CACHEABLE_STATUS[status]:
+            body = b""
+        now = time.time()
+        with self.lock:
+            previous = self.connection.execute(
+                "SELECT LENGTH(body) FROM responses WHERE source=? AND key=?",
+                (source, key)
+            ).fetchone()
+            if previous is not None and previous[0] is not None:
+                self.size -= previous[0]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (source, key, status, body, now, now)
+            )
+            self.size += len(body)
+            if self.size > self.max_size:
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits in max_size."""
+        entries = self.connection.execute(
+            "SELECT source, key, LENGTH(body) FROM responses ORDER BY last_access"
+        )
+        to_delete = []
+        for source, key, length in entries:
+            if self.size <= self.max_size:
+                break
+            to_delete.append((source, key))
+            self.size -= length or 0
+        self.connection.executemany(
+            "DELETE FROM responses WHERE source=? AND key=?", to_delete
+        )
+
+    def summary(self):
+        """Number of cache hits and misses for each source, for the run report."""
+        return {
+            source: {"hits": self.hits.get(source, 0), "misses": self.misses.get(source, 0)}
+            for source in sorted(set(self.hits) | set(self.misses))
+        }
+
+    def report(self):
+        """Logs the number of cache hits and misses for each source."""
+        logger.info(f"Response cache: {self.path}")
+        for source, counts in self.summary().items():
+            logger.info(f"  {source}: {counts['hits']} hits, {counts['misses']} misses")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
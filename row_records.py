@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar preparation of the rows of the ontology_instanciation sheet, before their instantiation.
+
+The cells of a chunk are read once as a whole, with the null mask of the chunk computed
+as a single NumPy array, and the ";" separated list columns are split with vectorized
+string operations. The columns are resolved to positions once, by name or by name with
+normalized whitespace (the sheet has headers such as "Input  is VGI " or "codeAvailability ").
+create_article then reads each row from a RowRecord, instead of building a pandas Series
+(row.isna(), row.fillna("")) for each lookup.
+"""
+from cell_parser import LIST_SEPARATOR, split_list
+
+#Columns holding ";" separated lists, split at once for all the rows: name, and whether it is lowercased before
+LIST_COLUMNS = {
+    "Affiliation Name": False,
+    "Affiliation Address": False,
+    "input data names": False,
+    "input data natures and resolution": False,
+    "input data date": True,
+    "Input is VGI": True,
+    "input data raster/points/lines/polygon": True,
+    "input is training, validation, both or neither": True,
+    "training dataset size": False,
+    "validation dataset size": False,
+    "if classification, nomenclature level": False,
+    "if classification, nomenclature name": False,
+    "output data names": False,
+    "output data natures and resolution": False,
+    "output data raster/points/lines/polygon": False,
+    "operator type": False,
+    "operator description": False,
+    "Study Area name": False,
+    "belongs to country": False,
+    "geographic extent type": False,
+    "OA": False,
+    "mF1": False,
+    "mIoU": False,
+    "kappa": False,
+    "global recall (producer accuracy)": False,
+    "global precision (user accuracy)": False,
+    "per class binary accuracy": False,
+    "per class F1 score": False,
+    "per class IoU": False,
+    "per class recall (producer accuracy)": False,
+    "per class precision (user accuracy)": False,
+    "user defined algorithm quality assessment metrics": False,
+    "challenge": False,
+    "strength": False,
+    "weakness": False,
+}
+
+
+def column_key(name):
+    """Name of a column with normalized whitespace, e.g. "Input is VGI" for "Input  is VGI "."""
+    return " ".join(str(name).split())
+
+
+class SheetLayout:
+    """Positions of the columns of a chunk, shared by its RowRecords."""
+    __slots__ = ("columns", "positions", "list_positions")
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.positions = {}
+        for position, name in enumerate(self.columns):
+            self.positions.setdefault(name, position)
+        for position, name in enumerate(self.columns):
+            self.positions.setdefault(column_key(name), position)
+        #Index of each split column of the sheet in the lists of a RowRecord
+        self.list_positions = {name: i for i, name in enumerate(name for name in LIST_COLUMNS if name in self.positions)}
+
+
+class RowRecord:
+    """
+    Prepared values of a row, looked up by column name: row[name] is the value of the cell
+    (NaN if empty), row.isna(name) tells if it is empty, row.text(name) gives "" for an empty cell,
+    and row.split(name) the items of a ";" separated list.
+    """
+    __slots__ = ("layout", "values", "missing", "lists")
+
+    def __init__(self, layout, values, missing, lists):
+        self.layout = layout
+        self.values = values
+        self.missing = missing
+        self.lists = lists
+
+    def __getitem__(self, name):
+        return self.values[self.layout.positions[name]]
+
+    def get(self, name, default=None):
+        position = self.layout.positions.get(name)
+        return default if position is None else self.values[position]
+
+    def isna(self, name):
+        return self.missing[self.layout.positions[name]]
+
+    def text(self, name):
+        position = self.layout.positions[name]
+        return "" if self.missing[position] else self.values[position]
+
+    def split(self, name):
+        """Items of the ";" separated list of the cell. An empty cell cannot be split, as with split_list."""
+        index = self.layout.list_positions.get(name)
+        items = split_list(self[name]) if index is None else self.lists[index]
+        if not isinstance(items, (list, tuple)):
+            raise TypeError(f"the cell {name!r} is empty")
+        return items
+
+    def __repr__(self):
+        return "\n".join(f"{name}: {value}" for name, value, missing in zip(self.layout.columns, self.values, self.missing) if not missing)
+
+
+def prepare_rows(excel_ontology_file):
+    """
+    RowRecords of the rows of a DataFrame shaped like the sheet as create_article reads it
+    (one level of columns), prepared column by column.
+    """
+    layout = SheetLayout(excel_ontology_file.columns)
+    values = excel_ontology_file.to_numpy(dtype=object).tolist()
+    missing = excel_ontology_file.isna().to_numpy().tolist()
+    split_columns = []
+    for name in layout.list_positions:
+        cells = excel_ontology_file.iloc[:, layout.positions[name]]
+        if LIST_COLUMNS[name]:
+            cells = cells.str.lower()
+        split_columns.append(cells.str.split(LIST_SEPARATOR).tolist())
+    lists = list(zip(*split_columns)) if split_columns else [()] * len(values)
+    return [RowRecord(layout, *row) for row in zip(values, missing, lists)]
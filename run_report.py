@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Report of a run: time spent in each stage, counters (rows, papers, individuals...),
+progress of the rows with their rate and the estimated time left, and the
+statistics of the components (cache, HTTP session, geocoder), saved as JSON.
+"""
+import json
+import time
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger("run_report")
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+PROGRESS_INTERVAL = 10  # seconds between two progress messages
+
+
+def configure_logging(level="INFO"):
+    """Configures the logging of a script: messages of level and above, with time and origin."""
+    logging.basicConfig(level=level, format=LOG_FORMAT, force=True)
+
+
+class RunReport:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Starts a new report."""
+        self.start_time = time.time()
+        self.start_counter = time.perf_counter()
+        self.stages = {}  # name: seconds
+        self.counters = {}
+        self.sections = {}  # name: statistics of a component
+        self.lock = threading.Lock()
+        self.total_rows = 0
+        self.done_rows = 0
+        self.rows_start_time = None
+        self.last_progress_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager adding the time spent in it to the stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def timed(self, name, iterable):
+        """Yields the items of iterable, adding the time spent to get each of them to the stage name."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def expect_rows(self, n):
+        """Adds n rows to the (estimated) number of rows of the run, used for the time left."""
+        if self.rows_start_time is None:
+            self.rows_start_time = time.perf_counter()
+        self.total_rows += n
+
+    def rows_done(self, n=1):
+        """Counts n rows processed, and logs the progress every PROGRESS_INTERVAL seconds."""
+        now = time.perf_counter()
+        if self.rows_start_time is None:
+            self.rows_start_time = now
+        self.done_rows += n
+        self.count("rows", n)
+        if now - self.last_progress_time >= PROGRESS_INTERVAL:
+            self.last_progress_time = now
+            logger.info(self.progress())
+
+    def progress(self):
+        """Rows done, rows per second, and estimated time left."""
+        elapsed = time.perf_counter() - (self.rows_start_time or time.perf_counter())
+        rate = self.done_rows / elapsed if elapsed > 0 else 0
+        message = f"{self.done_rows} rows done, {rate:.1f} rows/s"
+        if self.total_rows > self.done_rows and rate > 0:
+            message += f", about {(self.total_rows - self.done_rows) / rate:.0f}s left"
+        return message
+
+    def add_section(self, name, statistics):
+        """Adds the statistics of a component (e.g. the response cache) to the report."""
+        self.sections[name] = statistics
+
+    def merge(self, report):
+        """Adds the stages, counters and rows done of a report made by another process (see to_dict)."""
+        for name, seconds in report["stages"].items():
+            self.add_time(name, seconds)
+        for name, n in report["counters"].items():
+            self.count(name, n)
+        #The rows of the other process were done since the start of this run
+        if self.rows_start_time is None:
+            self.rows_start_time = self.start_counter
+        self.done_rows += report["counters"].get("rows", 0)
+
+    def to_dict(self):
+        return {
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+            "duration": time.time() - self.start_time,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            **self.sections,
+        }
+
+    def log_summary(self):
+        logger.info(f"Run done in {time.time() - self.start_time:.1f}s, {self.progress()}")
+        for name, seconds in sorted(self.stages.items(), key=lambda stage: -stage[1]):
+            logger.info(f"  {name}: {seconds:.2f}s")
+        for name, n in sorted(self.counters.items()):
+            logger.info(f"  {name}: {n}")
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+#Report of the current run
+run_report = RunReport()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Output of the instantiated ontology: RDF/XML (owlready2), or N-Triples and Turtle
+written in a streaming fashion from the quadstore, optionally compressed with gzip
+and split into shards (one per Excel file or per paper), so that the shards can be
+loaded in parallel by a triple store and regenerated independently.
+"""
+import os
+import re
+import gzip
+import time
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger("serializers")
+
+#format: extension
+FORMATS = {"rdfxml": ".owl", "ntriples": ".nt", "turtle": ".ttl"}
+SHARD_KEYS = ["workbook", "paper"]
+BASE_SHARD = "base"
+
+TURTLE_PREFIXES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+}
+TURTLE_LOCAL_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_\-]*$")
+RDF_TYPE_IRI = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+
+def escape_literal(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+
+
+class NTriplesWriter:
+    def __init__(self, file, unabbreviate):
+        self.file = file
+        self.unabbreviate = unabbreviate
+
+    def node(self, storid):
+        if storid < 0:
+            return f"_:b{-storid}"
+        return f"<{self.unabbreviate(storid)}>"
+
+    def literal(self, o, d):
+        if isinstance(d, str) and d.startswith("@"):
+            return f'"{escape_literal(o)}"{d}'
+        if d == 0:
+            return f'"{escape_literal(o)}"'
+        return f'"{escape_literal(o)}"^^{self.node(d)}'
+
+    def start(self):
+        pass
+
+    def write(self, s, p, o, d):
+        o = self.node(o) if d is None else self.literal(o, d)
+        self.file.write(f"{self.node(s)} {self.node(p)} {o} .\n")
+
+    def end(self):
+        pass
+
+
+class TurtleWriter(NTriplesWriter):
+    """Turtle with prefixes, the consecutive triples of a subject being grouped."""
+    def __init__(self, file, unabbreviate, base_iri):
+        super().__init__(file, unabbreviate)
+        self.prefixes = dict(TURTLE_PREFIXES, **{"": base_iri})
+        self.subject = None
+
+    def node(self, storid):
+        if storid < 0:
+            return f"_:b{-storid}"
+        iri = self.unabbreviate(storid)
+        if iri == RDF_TYPE_IRI:
+            return "a"
+        for prefix, namespace in self.prefixes.items():
+            if iri.startswith(namespace) and TURTLE_LOCAL_NAME.match(iri[len(namespace):]):
+                return f"{prefix}:{iri[len(namespace):]}"
+        return f"<{iri}>"
+
+    def start(self):
+        for prefix, namespace in self.prefixes.items():
+            self.file.write(f"@prefix {prefix}: <{namespace}> .\n")
+        self.subject = None
+
+    def write(self, s, p, o, d):
+        o = self.node(o) if d is None else self.literal(o, d)
+        if s == self.subject:
+            self.file.write(f" ;\n    {self.node(p)} {o}")
+        else:
+            if self.subject is not None:
+                self.file.write(" .\n")
+            self.file.write(f"\n{self.node(s)} {self.node(p)} {o}")
+            self.subject = s
+
+    def end(self):
+        if self.subject is not None:
+            self.file.write(" .\n")
+
+
+def shard_name(key):
+    """File name of a shard: its key with the characters not allowed in file names replaced."""
+    return re.sub(r"[^A-Za-z0-9_.\-]+", "_", key).strip("_") or "shard"
+
+
+def shards_of_individuals(instantiated_workbooks, shard_by):
+    """
+    Shard of each individual, from the rows instantiated from each Excel file
+    ({workbook path: {row hash: {"paper": key, "individuals": [IRIs]}}}):
+    the Excel file or the paper of the row which created it.
+    """
+    shards = {}
+    for workbook_path, rows in instantiated_workbooks.items():
+        workbook_shard = shard_name(os.path.splitext(os.path.basename(workbook_path))[0])
+        for row in rows.values():
+            shard = workbook_shard if shard_by == "workbook" else shard_name(row["paper"])
+            for iri in row["individuals"]:
+                shards.setdefault(iri, shard)
+    return shards
+
+
+def open_output(path, compress):
+    if compress:
+        return gzip.open(path + ".gz", "wt", encoding="utf-8", newline="\n", compresslevel=6)
+    return open(path, "w", encoding="utf-8", newline="\n")
+
+
+def write_triples(onto, output_path, format, compress=False, shards=None):
+    """
+    Writes the triples of onto in N-Triples or Turtle, streamed from the quadstore.
+    If shards ({IRI: shard name}) is given, output_path is a folder, in which the triples
+    of each individual are written in the file of its shard, the other ones in the base shard.
+    Returns the paths of the files written.
+    """
+    world = onto.world
+    graph = world.graph
+    unabbreviate = lru_cache(None)(graph._unabbreviate)
+    c = onto.graph.c
+    if shards is None:
+        order = " ORDER BY s" if format == "turtle" else ""
+        triples = ((None, s, p, o, d) for s, p, o, d in graph.execute(
+            f"SELECT s, p, o, d FROM quads WHERE c=?{order}", (c,)))
+    else:
+        #The triples are sorted by shard, so that only one file is open at a time
+        os.makedirs(output_path, exist_ok=True)
+        shard_names = sorted(set(shards.values()))
+        shard_numbers = {name: i for i, name in enumerate(shard_names)}
+        graph.execute("CREATE TEMP TABLE IF NOT EXISTS shard_subjects (s INTEGER PRIMARY KEY, shard INTEGER)")
+        graph.execute("DELETE FROM shard_subjects")
+        graph.db.executemany(
+            "INSERT OR IGNORE INTO shard_subjects SELECT storid, ? FROM resources WHERE iri=?",
+            ((shard_numbers[shard], iri) for iri, shard in shards.items())
+        )
+        triples = ((shard_names[shard] if shard is not None else BASE_SHARD, s, p, o, d) for shard, s, p, o, d in graph.execute(
+            "SELECT shard_subjects.shard, quads.s, quads.p, quads.o, quads.d FROM quads "
+            "LEFT JOIN shard_subjects ON shard_subjects.s = quads.s "
+            "WHERE quads.c=? ORDER BY shard_subjects.shard, quads.s", (c,)))
+
+    paths = []
+    file = writer = None
+    current_shard = ()
+    try:
+        for shard, s, p, o, d in triples:
+            if shard != current_shard:
+                if file is not None:
+                    writer.end()
+                    file.close()
+                path = output_path if shard is None else os.path.join(output_path, shard + FORMATS[format])
+                file = open_output(path, compress)
+                paths.append(path + ".gz" if compress else path)
+                if format == "turtle":
+                    writer = TurtleWriter(file, unabbreviate, onto.base_iri)
+                else:
+                    writer = NTriplesWriter(file, unabbreviate)
+                writer.start()
+                current_shard = shard
+            writer.write(s, p, o, d)
+    finally:
+        if file is not None:
+            writer.end()
+            file.close()
+        if shards is not None:
+            graph.execute("DROP TABLE IF EXISTS shard_subjects")
+    return paths
+
+
+def save_ontology(onto, output_path, format="rdfxml", compress=False, shards=None):
+    """
+    Saves onto in format to output_path (a folder if shards is given, see write_triples),
+    and returns (paths of the files written, total size in bytes, time in seconds).
+    """
+    start = time.perf_counter()
+    if format == "rdfxml":
+        if shards is not None:
+            logger.warning("The RDF/XML output cannot be split in shards, it is saved in one file")
+        if compress:
+            with gzip.open(output_path + ".gz", "wb", compresslevel=6) as file:
+                onto.save(file, format="rdfxml")
+            paths = [output_path + ".gz"]
+        else:
+            onto.save(output_path, format="rdfxml")
+            paths = [output_path]
+    else:
+        paths = write_triples(onto, output_path, format, compress, shards)
+    return paths, sum(os.path.getsize(path) for path in paths), time.perf_counter() - start
+
+
+def report_outputs(outputs):
+    """Logs the size and the writing time of each output format."""
+    for format, (paths, size, duration) in outputs.items():
+        logger.info(f"{format}: {len(paths)} files, {size / 1024 / 1024:.2f} MB written in {duration:.2f}s")
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import shutil
+import subprocess
+
+import openpyxl
+import pytest
+
+#The modules of the repository are imported as top-level modules, as the scripts do
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+EXAMPLE_PATH = os.path.join(REPO_DIR, "LULC_Ontology_example.xlsm")
+#Rows of the example workbook: header names in row 2, papers from row 4
+HEADER_ROW = 2
+FIRST_DATA_ROW = 4
+BLANK_NODE = re.compile(r"_:\w+")
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """Folder in which owl_filler.py is run, with the ontology file."""
+    shutil.copy(os.path.join(REPO_DIR, "lulc_review.owl"), tmp_path)
+    return tmp_path
+
+
+def make_workbook(path, rows):
+    """
+    Saves a copy of the example workbook whose papers are rows: for each row, the number of
+    the row of the example it copies, and the values of some of its columns ({header: value}).
+    """
+    workbook = openpyxl.load_workbook(EXAMPLE_PATH, keep_vba=True)
+    sheet = workbook["ontology_instanciation"]
+    headers = {}
+    for column in range(sheet.max_column, 0, -1):
+        headers[sheet.cell(HEADER_ROW, column).value] = column
+    examples = {row: [sheet.cell(row, column).value for column in range(1, sheet.max_column + 1)]
+                for row in range(FIRST_DATA_ROW, sheet.max_row + 1)}
+    for row in range(FIRST_DATA_ROW, sheet.max_row + 1):
+        for column in range(1, sheet.max_column + 1):
+            sheet.cell(row, column).value = None
+    for i, (example_row, values) in enumerate(rows):
+        for column, value in enumerate(examples[example_row], 1):
+            sheet.cell(FIRST_DATA_ROW + i, column).value = value
+        for header, value in values.items():
+            sheet.cell(FIRST_DATA_ROW + i, headers[header]).value = value
+    workbook.save(path)
+
+
+def run_owl_filler(workdir, *args):
+    """Runs owl_filler.py in workdir offline, the web services and the geocoder answering from an empty fixture file."""
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, "owl_filler.py"), *args,
+                    "--replay", "empty.fix", "--cache-dir", "cache", "--log-level", "ERROR"],
+                   cwd=workdir, check=True, capture_output=True)
+
+
+def ntriples(path):
+    """Sorted triples of an N-Triples file, the blank nodes being renamed (they are only meaningful in one file)."""
+    with open(path, encoding="utf-8") as file:
+        return sorted(BLANK_NODE.sub("_:b", line) for line in file if line.strip())
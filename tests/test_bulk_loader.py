@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+TripleBatch writes in the quadstore of owlready2 and drops its caches (see bulk_loader.py):
+the ontology must be the same as when the values are written through the attributes.
+"""
+import os
+
+import owlready2 as or2
+
+from bulk_loader import TripleBatch
+from conftest import REPO_DIR, ntriples
+
+OWL_FILE_PATH = os.path.join(REPO_DIR, "lulc_review.owl")
+
+
+def build(path, batched):
+    onto = or2.World().get_ontology(OWL_FILE_PATH).load()
+    paper, first, second = onto.paper("p"), onto.author("a1"), onto.author("a2")
+    keyword = onto.keyword("k")
+    #Values of a previous row
+    paper.label = ["old"]
+    paper.hasAuthor = [second]
+    #The inverse values are read, and cached, before the flush
+    assert first.isAuthorOf == [] and second.isAuthorOf == [paper]
+
+    if batched:
+        batch = TripleBatch(onto.world)
+        assert batch.set(paper, "label", "A")
+        assert batch.append(paper, "label", "B")
+        assert batch.set(paper, "hasAuthor", [first])
+        assert batch.append(paper, "hasAuthor", second)
+        assert batch.set(paper, "doi", "10.1/p")
+        assert batch.append(paper, "hasKeyword", keyword)
+        batch.flush()
+    else:
+        paper.label = ["A"]
+        paper.label.append("B")
+        paper.hasAuthor = [first]
+        paper.hasAuthor.append(second)
+        paper.doi = "10.1/p"
+        paper.hasKeyword.append(keyword)
+
+    assert sorted(paper.label) == ["A", "B"]
+    assert set(paper.hasAuthor) == {first, second}
+    assert first.isAuthorOf == [paper] and second.isAuthorOf == [paper]
+    #The attributes written after the flush start from the values of the quadstore
+    first.isAuthorOf.remove(paper)
+    paper.label.append("C")
+    onto.save(str(path), format="ntriples")
+    return ntriples(path)
+
+
+def test_batch_matches_attributes(tmp_path):
+    assert build(tmp_path / "batch.nt", True) == build(tmp_path / "attributes.nt", False)
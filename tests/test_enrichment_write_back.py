@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""The enrichment writes back the metadata it fills, not its working values of the DOI column."""
+import os
+
+import pandas as pd
+
+import metadata_enrichment
+from conftest import REPO_DIR
+
+EXAMPLE_PATH = os.path.join(REPO_DIR, "LULC_Ontology_example.xlsm")
+DOI = ("Paper metadata", "doi")
+KEYWORDS = ("Paper metadata", "Keywords")
+
+
+def test_only_metadata_cells_are_written_back(monkeypatch):
+    original = pd.read_excel(EXAMPLE_PATH, dtype=str, sheet_name="ontology_instanciation", header=[0, 1]).astype(object)
+    #Row 0 is the guide row: a paper without DOI, then a DOI given as a URL
+    original.loc[1, DOI] = None
+    original.loc[2, DOI] = "https://doi.org/10.1/x"
+    original.loc[[1, 2], KEYWORDS] = None
+    queried = []
+    monkeypatch.setattr(metadata_enrichment, "prefetch_crossref_batches", lambda dois: None)
+    monkeypatch.setattr(metadata_enrichment, "fetch_metadata_record",
+                        lambda doi, missing: queried.append(doi) or {"Keywords": "found"})
+
+    enriched = metadata_enrichment.enrich_metadata(original.copy())
+    cells = metadata_enrichment.filled_cells(original, enriched)
+
+    assert "10.1/x" in queried
+    assert not any(doi.startswith("NoDoi_") for doi in queried)
+    assert cells
+    assert all(header[0] == "Paper metadata" and header[1] != "doi" for row, column, header, before, after in cells)
+    assert (5, original.columns.get_loc(KEYWORDS) + 1, list(KEYWORDS), None, "found") in cells
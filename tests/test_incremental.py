@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""--incremental gives the same ontology as a full run of the workbook as it is now."""
+import os
+import shutil
+
+from conftest import REPO_DIR, make_workbook, run_owl_filler, ntriples
+
+#The paper of the rows 4 and 5 of the example, and two papers with the same authors, journal and some keywords
+PAPER_B = (4, {"doi": "10.1/b", "Title": "Paper B", "Keywords": "land cover ; LU change"})
+PAPER_C = (4, {"doi": "10.1/c", "Title": "Paper C", "Keywords": "removed keyword ; LU change"})
+
+
+def test_incremental_run_matches_full_run(workdir):
+    make_workbook(workdir / "papers.xlsm", [(4, {}), (5, {}), PAPER_B, PAPER_C])
+    run_owl_filler(workdir, "papers.xlsm", "--incremental", "--format", "rdfxml", "ntriples")
+    before = ntriples(workdir / "lulc_review_instantiated.nt")
+
+    #The second row of the first paper is edited, and the paper C is removed
+    current = [(4, {}), (5, {"OA": "0.75", "tool used names": "LACO-wiki ; QGIS"}), PAPER_B]
+    make_workbook(workdir / "papers.xlsm", current)
+    run_owl_filler(workdir, "papers.xlsm", "--incremental", "--format", "rdfxml", "ntriples")
+    incremental = ntriples(workdir / "lulc_review_instantiated.nt")
+
+    fresh = workdir / "fresh"
+    os.mkdir(fresh)
+    shutil.copy(os.path.join(REPO_DIR, "lulc_review.owl"), fresh)
+    make_workbook(fresh / "papers.xlsm", current)
+    run_owl_filler(fresh, "papers.xlsm", "--format", "rdfxml", "ntriples")
+    full = ntriples(fresh / "lulc_review_instantiated.nt")
+
+    assert any("removed_keyword" in triple for triple in before)
+    assert any("QGIS" in triple for triple in incremental)
+    #The authors, journal and keywords of the paper C are kept for the other papers
+    assert any("keyword_LU_change" in triple for triple in incremental)
+    assert any("See_L." in triple for triple in incremental)
+    assert incremental == full
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""--jobs instantiates the Excel files of a folder as a serial run does."""
+import os
+
+from conftest import make_workbook, run_owl_filler, ntriples
+
+
+def test_jobs_match_serial_run(workdir):
+    #Two workbooks whose papers share their authors and journal. The second one names an author
+    #differently ("See,L."), and gives another title to a paper of the first one: the last values are kept
+    os.mkdir(workdir / "papers")
+    make_workbook(workdir / "papers" / "a.xlsm", [(4, {}), (5, {}), (4, {"doi": "10.1/d", "Title": "First title"})])
+    make_workbook(workdir / "papers" / "b.xlsm", [(4, {"doi": "10.1/b", "Keywords": "land cover", "Authors": "See,L. and Foody, G."}),
+                                                  (4, {"doi": "10.1/c", "journal": "other journal"}),
+                                                  (4, {"doi": "10.1/d", "Title": "Second title"})])
+
+    run_owl_filler(workdir, "papers", "--format", "ntriples")
+    serial = ntriples(workdir / "lulc_review_instantiated.nt")
+    run_owl_filler(workdir, "papers", "--format", "ntriples", "--jobs", "2")
+    parallel = ntriples(workdir / "lulc_review_instantiated.nt")
+
+    assert any("10.1/b" in triple for triple in parallel)
+    assert parallel == serial
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""The workers of the parse pool do not geocode: the place names are resolved by the main process."""
+import os
+import random
+
+import owlready2 as or2
+
+import benchmark
+import owl_filler
+from row_records import prepare_rows
+
+QUALIFIERS = ["2019: 0.7", "random forest: 0.5", "paris: 0.6", "global: 0.77", "unknown thing: 0.4", "0.85 of north part"]
+
+
+def test_parse_pool_matches_serial_parsing(monkeypatch):
+    main_process = os.getpid()
+    geocoded = []
+
+    def geocode_address(address):
+        #The workers are forked with this function
+        assert os.getpid() == main_process, "geocoding in a parse worker"
+        geocoded.append(address)
+        return address.lower() in {"paris", "north part"}
+
+    monkeypatch.setattr(owl_filler, "geocode_address", geocode_address)
+    sheet = benchmark.synthetic_sheet(20, seed=3)
+    rng = random.Random(7)
+    for i in range(len(sheet)):
+        sheet.loc[i, "OA"] = " ; ".join(rng.sample(QUALIFIERS, 3))
+    rows = prepare_rows(sheet)
+    schema = owl_filler.schema_index(or2.World().get_ontology(benchmark.OWL_FILE_PATH).load())
+
+    serial = [ir.ops for ir in owl_filler.parse_articles(rows, schema)]
+    owl_filler.configure_parse_pool(2)
+    try:
+        geocoded.clear()
+        parallel = [ir.ops for ir in owl_filler.parse_articles(rows, schema)]
+    finally:
+        owl_filler.configure_parse_pool(1)
+
+    assert parallel == serial
+    #Each text is geocoded once, in one pass
+    assert sorted(geocoded) == sorted(set(geocoded)) and "paris" in geocoded
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reader of the ontology_instanciation sheet of the Excel files.
+
+The sheet is read row by row with the read-only mode of openpyxl, so the memory
+used does not depend on the size of the sheet, and the papers of the first rows
+can be instantiated before the whole file is read.
+"""
+import datetime
+from itertools import zip_longest
+
+import openpyxl
+import pandas as pd
+
+SHEET_NAME = "ontology_instanciation"
+DEFAULT_CHUNK_SIZE = 100
+
+
+def cell_text(value):
+    """Value of a cell as read by pd.read_excel(dtype=str): a string, or None if the cell is empty."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.time) and not isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def sheet_columns(top_row, names_row):
+    """
+    Two-level columns (block, name) of the sheet, as with pd.read_excel(header=[0,1]):
+    the name of a block (e.g. "Paper metadata") spans the columns until the next one.
+    The trailing columns without any header are ignored.
+    """
+    headers = list(zip_longest(top_row, names_row))
+    while headers and headers[-1] == (None, None):
+        headers.pop()
+    columns = []
+    block = None
+    for i, (top, name) in enumerate(headers):
+        if top is not None:
+            block = cell_text(top)
+        columns.append((block if block is not None else f"Unnamed: {i}_level_0",
+                        cell_text(name) if name is not None else f"Unnamed: {i}_level_1"))
+    return columns
+
+
+def iter_sheet_rows(path, sheet_name=SHEET_NAME):
+    """
+    Yields the columns of the sheet (list of (block, name)), then the values of each row
+    below the header, starting with the guide row: tuples of strings, None for the empty cells.
+    The empty rows are skipped.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        columns = sheet_columns(next(rows, ()), next(rows, ()))
+        yield columns
+        width = len(columns)
+        for row in rows:
+            values = tuple(cell_text(value) for value in row[:width])
+            if any(value is not None for value in values):
+                yield values + (None,) * (width - len(values))
+    finally:
+        workbook.close()
+
+
+def iter_sheet_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, sheet_name=SHEET_NAME):
+    """
+    Yields the rows of the sheet as DataFrames of at most chunk_size rows, with the same
+    two-level columns as pd.read_excel(path, dtype=str, sheet_name=sheet_name, header=[0,1]).
+    As in the whole sheet, whose first row is the guide row, the rows of a chunk are indexed
+    from 1 and the row 0 is the row above them: the guide row for the first chunk, and the last
+    row of the previous chunk otherwise, so that a row can refer to the previous one.
+    """
+    rows = iter_sheet_rows(path, sheet_name)
+    columns = pd.MultiIndex.from_tuples(next(rows))
+    previous = next(rows, None)
+    if previous is None:
+        return
+    chunk = [previous]
+    for values in rows:
+        chunk.append(values)
+        if len(chunk) > chunk_size:
+            yield pd.DataFrame(chunk, columns=columns, dtype=object)
+            chunk = [chunk[-1]]
+    if len(chunk) > 1:
+        yield pd.DataFrame(chunk, columns=columns, dtype=object)
+
+
+def sheet_row_count(path, sheet_name=SHEET_NAME):
+    """
+    Number of rows of papers of the sheet (below the header and the guide row), estimated
+    from the dimension saved in the file, without reading the rows: the empty rows are counted.
+    Returns 0 if the file does not record its dimension.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        max_row = workbook[sheet_name].max_row
+    finally:
+        workbook.close()
+    return max(0, (max_row or 0) - 3)
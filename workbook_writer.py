@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Write-back of the enriched metadata to the Excel file: only the cells filled by the
+enrichment are written, the other cells, the formatting and the macros of the .xlsm
+being left untouched. The changes can also be saved as a patch file (JSON) next to
+the Excel file, and applied later with python workbook_writer.py PATCH.
+"""
+import json
+import argparse
+import logging
+
+import numpy as np
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+from incremental import file_hash
+from workbook_reader import SHEET_NAME
+from run_report import configure_logging
+
+logger = logging.getLogger("workbook_writer")
+
+#Row of the sheet of the first row of the DataFrame (the guide row), below the two header rows
+FIRST_ROW = 3
+PATCH_VERSION = 1
+
+
+def cell_value(value):
+    """Value of a DataFrame cell as written in the Excel file: None for NaN, Python types for NumPy ones."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def changed_cells(original, enriched, ignored_columns=()):
+    """
+    Cells of the sheet changed by the enrichment, from the DataFrame read from it (original,
+    as read by pd.read_excel(header=[0,1])) and the enriched one (same shape):
+    list of (row, column, column header, original value, new value), row and column starting from 1.
+    The cells of ignored_columns (headers) are left out.
+    """
+    before = original.to_numpy(dtype=object)
+    after = enriched.to_numpy(dtype=object)
+    unchanged = (before == after) | (original.isna().to_numpy() & enriched.isna().to_numpy())
+    for j, column in enumerate(enriched.columns):
+        if column in ignored_columns:
+            unchanged[:, j] = True
+    cells = []
+    for i, j in zip(*np.nonzero(~unchanged)):
+        cells.append((int(i) + FIRST_ROW, int(j) + 1, list(enriched.columns[j]),
+                      cell_value(before[i, j]), cell_value(after[i, j])))
+    return cells
+
+
+def write_cells(workbook_path, output_path, cells, sheet_name=SHEET_NAME):
+    """Writes the values of cells (see changed_cells) in the sheet, keeping the macros, and saves it to output_path."""
+    workbook = openpyxl.load_workbook(workbook_path, keep_vba=workbook_path.lower().endswith(".xlsm"))
+    sheet = workbook[sheet_name]
+    for row, column, header, original, value in cells:
+        sheet.cell(row=row, column=column, value=value)
+    workbook.save(output_path)
+
+
+def save_patch(patch_path, workbook_path, cells, sheet_name=SHEET_NAME):
+    """Saves cells (see changed_cells) as a JSON patch of the workbook, to apply later with apply_patch."""
+    patch = {
+        "version": PATCH_VERSION,
+        "workbook": workbook_path,
+        "workbook_hash": file_hash(workbook_path),
+        "sheet": sheet_name,
+        "cells": [{"cell": f"{get_column_letter(column)}{row}", "row": row, "column": column,
+                   "header": header, "original": original, "value": value}
+                  for row, column, header, original, value in cells],
+    }
+    with open(patch_path, "w", encoding="utf-8") as file:
+        json.dump(patch, file, indent=1, ensure_ascii=False, default=str)
+
+
+def apply_patch(patch_path, output_path=None, workbook_path=None):
+    """
+    Writes the cells of a patch saved by save_patch in its workbook (or workbook_path),
+    and saves it to output_path (default: the workbook itself). Returns the number of cells written.
+    A cell whose value changed since the patch was made is not overwritten.
+    """
+    with open(patch_path, encoding="utf-8") as file:
+        patch = json.load(file)
+    if patch.get("version") != PATCH_VERSION:
+        raise ValueError(f"{patch_path} is not a patch of version {PATCH_VERSION}")
+    workbook_path = workbook_path or patch["workbook"]
+    if file_hash(workbook_path) != patch["workbook_hash"]:
+        logger.warning(f"{workbook_path} changed since the patch was made, the cells changed since are skipped")
+    workbook = openpyxl.load_workbook(workbook_path, keep_vba=workbook_path.lower().endswith(".xlsm"))
+    sheet = workbook[patch["sheet"]]
+    written = 0
+    for cell in patch["cells"]:
+        current = sheet.cell(row=cell["row"], column=cell["column"])
+        if current.value is not None and str(current.value) != str(cell["original"]):
+            logger.warning(f"{cell['cell']} changed since the patch was made, it is not overwritten")
+            continue
+        current.value = cell["value"]
+        written += 1
+    workbook.save(output_path or workbook_path)
+    return written
+
+
+#%%
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Applies a patch of enriched metadata (saved with metadata_enrichment.py --patch) to its Excel file.")
+    parser.add_argument("patch", help="Patch file")
+    parser.add_argument("output", nargs="?", default=None, help="Output Excel file (default: the patched Excel file)")
+    parser.add_argument("--workbook", default=None, help="Excel file to patch (default: the one the patch was made from)")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Level of the messages logged")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    written = apply_patch(args.patch, args.output, args.workbook)
+    logger.info(f"{written} cells written")